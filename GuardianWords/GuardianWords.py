@@ -2,12 +2,18 @@ import os
 import re
 import time
 import json
+import heapq
+import atexit
 import asyncio
 import aiohttp
-import threading
-from collections import deque
+import unicodedata
+from array import array
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import Dict, List, Set, Optional
+from typing import Dict, List, Set, Optional, Tuple
+from io import BytesIO
+from PIL import Image
 from Hyper import Configurator
 
 # 加载配置
@@ -42,7 +48,13 @@ SECONDARY_HELP = f"""{reminder}敏感词检测 开启/关闭/状态 —> 🌟 
 {reminder}敏感词检测 查看违规记录 [QQ号] —> 📊 查看用户的违规记录
 {reminder}敏感词检测 设置 窗口时间 [秒数] —> ⏰ 设置违规统计窗口时间
 {reminder}敏感词检测 设置 最大违规 [次数] —️> ⚠️ 设置最大违规次数
-{reminder}敏感词检测 设置 禁言时长 [秒数] —> 🔇 设置禁言时长"""
+{reminder}敏感词检测 设置 禁言时长 [秒数] —> 🔇 设置禁言时长
+{reminder}敏感词检测 设置 检测模式 [分级/直连] —> 🧭 设置检测模式
+{reminder}敏感词检测 设置 并发上限 [数量] —> 🚦 设置API并发请求上限
+{reminder}敏感词检测 设置 失败策略 [放行/拦截] —> 🛡️ 设置API出错时的处理方式
+{reminder}敏感词检测 设置 图片检测 [开启/关闭] —> 🖼️ 开启或关闭违规图片检测
+{reminder}敏感词检测 添加违规图片 [图片] —> 🖼️ 将图片加入违规图库
+{reminder}敏感词检测 删除违规图片 [哈希] —> 🗑️ 从违规图库移除图片"""
 
 # 数据存储路径
 DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data", "sensitive_words")
@@ -53,7 +65,10 @@ ENABLED_GROUPS_FILE = os.path.join(DATA_DIR, "enabled_groups.json")
 LOCAL_WORDS_FILE = os.path.join(DATA_DIR, "sensitive_words.txt")
 WHITELIST_FILE = os.path.join(DATA_DIR, "whitelist.txt")
 VIOLATION_RECORDS_FILE = os.path.join(DATA_DIR, "violation_records.json")
+VIOLATION_LOG_FILE = os.path.join(DATA_DIR, "violation_records.log")
 CONFIG_FILE = os.path.join(DATA_DIR, "config.json")
+BANNED_IMAGES_FILE = os.path.join(DATA_DIR, "banned_images.txt")  # 违规图片的感知哈希，每行一个十六进制值
+VARIANTS_FILE = os.path.join(DATA_DIR, "variants.txt")  # 自定义变体字映射，每行“变体 标准”
 
 # 默认配置
 DEFAULT_CONFIG = {
@@ -61,126 +76,816 @@ DEFAULT_CONFIG = {
     "violation_window": 60,  # 违规计数窗口（秒）
     "max_violations": 10,  # 最大违规次数
     "ban_duration": 600,  # 禁言时长（秒）- 10分钟
-    "check_images": False  # 是否检查图片消息
+    "check_images": False,  # 是否检查图片消息
+    "pipeline_mode": True,  # 分级检测：本地命中直接撤回，简单文本跳过API，其余文本微批请求API
+    "api_min_length": 2,  # 短于该长度的文本不请求API
+    "api_skip_patterns": [r"^[\W\d_]+$", r"^(哈|呵|嘿|嘻|嗯|哦|噢|啊|好|6)+$"],  # 匹配的文本不请求API
+    "api_batch_size": 8,  # 每批最多文本数
+    "api_batch_wait": 0.05,  # 攒批最长等待时间（秒）
+    "api_concurrency": 4,  # 同时进行的API请求上限
+    "api_fail_closed": False,  # API出错时：False放行，True按违规处理
+    "flush_interval": 5,  # 违规记录写盘间隔（秒）
+    "compact_threshold": 5000,  # 违规日志超过该条数时合并为快照
+    "record_retention": 86400,  # 超过该时间（秒）没有违规的用户记录会被清理
+    "image_hash_distance": 6,  # 图片哈希汉明距离不超过该值视为同一张违规图片
+    "image_workers": 2,  # 计算图片哈希的线程数
+    "image_max_bytes": 10 * 1024 * 1024  # 下载图片的大小上限
 }
 
 # AC自动机类
-class AhoCorasick:
-    """AC自动机 - 多模式字符串匹配算法"""
+class _FlatTrie:
+    """扁平数组实现的AC自动机（构建后只读）
+
+    所有节点用整数编号，转移表是一个以 (节点 << 21) | 码位 为键的字典，
+    失败指针与输出链接存放在 array 中，避免每个节点一个 Python 对象。
+    """
     
-    class TrieNode:
-        def __init__(self):
-            self.children = {}  # 子节点字典
-            self.fail = None    # 失败指针
-            self.is_end = False # 是否为模式串结尾
-            self.word = None    # 对应的敏感词
-            self.output = []    # 输出列表（用于包含更短的敏感词）
+    _CHAR_BITS = 21  # Unicode码位最多占21位
     
-    def __init__(self):
-        self.root = self.TrieNode()
-        self.is_built = False
-        self.word_count = 0
+    def __init__(self, words=()):
+        self.trans = {}               # 转移表 {(node << 21) | ord(char): child}
+        self.fail = array('i', [0])   # 失败指针
+        self.out = array('i', [0])    # 输出链接：沿失败链最近的终止节点，0表示没有
+        self.word = [None]            # 终止节点对应的敏感词
+        self.depth = array('i', [0])  # 节点深度（仅构建时用于BFS排序）
+        
+        for word in words:
+            self._insert(word)
+        self._build_links()
+        # 构建完成后深度数组不再需要
+        self.depth = None
     
-    def add_word(self, word: str):
-        """添加敏感词到Trie树"""
+    def __len__(self):
+        return len(self.word)
+    
+    def _insert(self, word: str):
+        """插入一个模式串"""
         if not word:
             return
         
-        node = self.root
+        trans = self.trans
+        node = 0
         for char in word:
-            if char not in node.children:
-                node.children[char] = self.TrieNode()
-            node = node.children[char]
+            key = (node << self._CHAR_BITS) | ord(char)
+            child = trans.get(key)
+            if child is None:
+                child = len(self.word)
+                trans[key] = child
+                self.word.append(None)
+                self.fail.append(0)
+                self.out.append(0)
+                self.depth.append(self.depth[node] + 1)
+            node = child
+        self.word[node] = word
+    
+    def _build_links(self):
+        """按BFS顺序（节点深度）计算失败指针和输出链接"""
+        bits = self._CHAR_BITS
+        mask = (1 << bits) - 1
+        trans, fail, out, word, depth = self.trans, self.fail, self.out, self.word, self.depth
+        
+        for key, child in sorted(trans.items(), key=lambda item: depth[item[1]]):
+            parent = key >> bits
+            if parent == 0:
+                fail[child] = 0
+                continue
+            
+            char = key & mask
+            node = fail[parent]
+            while True:
+                target = trans.get((node << bits) | char)
+                if target is not None:
+                    break
+                if node == 0:
+                    target = 0
+                    break
+                node = fail[node]
+            
+            fail[child] = target
+            out[child] = target if word[target] is not None else out[target]
+    
+    def iter_matches(self, text: str):
+        """逐个产出 (结束下标, 敏感词)"""
+        bits = self._CHAR_BITS
+        trans, fail, out, word = self.trans, self.fail, self.out, self.word
+        node = 0
+        
+        for i, char in enumerate(text):
+            code = ord(char)
+            while True:
+                child = trans.get((node << bits) | code)
+                if child is not None:
+                    node = child
+                    break
+                if node == 0:
+                    break
+                node = fail[node]
+            
+            match = node if word[node] is not None else out[node]
+            while match:
+                yield i, word[match]
+                match = out[match]
+
+
+class AhoCorasick:
+    """AC自动机 - 多模式字符串匹配算法
+
+    采用主自动机 + 增量自动机的结构：批量加载的词构建成主自动机，
+    之后新增的词只重建体积很小的增量自动机，删除的词以墓碑标记屏蔽，
+    增量部分或墓碑过多时再合并重建主自动机，避免每次增删都全量重建。
+    """
+    
+    MERGE_MIN = 256      # 增量部分达到该数量后才考虑合并
+    MERGE_RATIO = 0.125  # 增量/墓碑超过主自动机词数的比例时合并
+    
+    def __init__(self, words=()):
+        self._words = set()       # 当前有效的全部敏感词
+        self._main_words = set()  # 主自动机中包含的词（含已删除的）
+        self._delta_words = set() # 增量自动机中的词
+        self._removed = set()     # 主自动机中已删除的词（墓碑）
+        self._main = _FlatTrie()
+        self._delta = _FlatTrie()
+        self.is_built = True
         
-        if not node.is_end:  # 避免重复计数
-            node.is_end = True
-            node.word = word
-            self.word_count += 1
+        if words:
+            self.rebuild(words)
+    
+    @property
+    def word_count(self) -> int:
+        return len(self._words)
+    
+    @property
+    def node_count(self) -> int:
+        return len(self._main) + len(self._delta)
+    
+    def rebuild(self, words):
+        """用给定词表全量重建主自动机"""
+        self._words = {word for word in words if word}
+        self._main_words = set(self._words)
+        self._delta_words = set()
+        self._removed = set()
+        self._main = _FlatTrie(self._main_words)
+        self._delta = _FlatTrie()
+        self.is_built = True
+    
+    def add_word(self, word: str):
+        """添加敏感词（只影响增量自动机）"""
+        if not word or word in self._words:
+            return
+        
+        self._words.add(word)
+        if word in self._removed:
+            # 主自动机中仍保留该词，撤销墓碑即可
+            self._removed.discard(word)
+            return
         
+        self._delta_words.add(word)
         self.is_built = False
     
-    def build_fail(self):
-        """构建失败指针（BFS算法）"""
-        queue = deque()
+    def remove_word(self, word: str):
+        """删除敏感词（主自动机中的词打墓碑标记）"""
+        if word not in self._words:
+            return
         
-        # 第一层节点的fail指向root
-        for child in self.root.children.values():
-            child.fail = self.root
-            queue.append(child)
+        self._words.discard(word)
+        if word in self._delta_words:
+            self._delta_words.discard(word)
+            self.is_built = False
+        else:
+            self._removed.add(word)
+            if self._needs_merge(len(self._removed)):
+                self.rebuild(self._words)
+    
+    def build_fail(self):
+        """构建增量自动机；增量部分过大时合并进主自动机"""
+        if self.is_built:
+            return
         
-        # BFS构建失败指针
-        while queue:
-            current_node = queue.popleft()
-            
-            # 遍历当前节点的所有子节点
-            for char, child_node in current_node.children.items():
-                queue.append(child_node)
-                
-                # 从当前节点的fail节点开始寻找
-                fail_node = current_node.fail
-                
-                # 不断回溯直到找到有char子节点的节点或到达root
-                while fail_node is not None and char not in fail_node.children:
-                    fail_node = fail_node.fail
-                
-                if fail_node is None:
-                    child_node.fail = self.root
-                else:
-                    child_node.fail = fail_node.children[char]
-                    
-                    # 如果fail节点是结束节点，将对应的敏感词添加到output中
-                    if child_node.fail.is_end:
-                        child_node.output.append(child_node.fail.word)
+        if self._needs_merge(len(self._delta_words)):
+            self.rebuild(self._words)
+        else:
+            self._delta = _FlatTrie(self._delta_words)
+            self.is_built = True
+    
+    def _needs_merge(self, pending: int) -> bool:
+        return pending >= max(self.MERGE_MIN, len(self._main_words) * self.MERGE_RATIO)
+    
+    def iter_matches(self, text: str):
+        """产出 (起始下标, 结束下标, 敏感词)，结束下标包含在内"""
+        if not text or not self._words:
+            return
+        if not self.is_built:
+            self.build_fail()
         
-        self.is_built = True
+        removed = self._removed
+        for end, word in self._main.iter_matches(text):
+            if word not in removed:
+                yield end - len(word) + 1, end, word
+        if self._delta_words:
+            for end, word in self._delta.iter_matches(text):
+                yield end - len(word) + 1, end, word
     
     def search(self, text: str) -> List[str]:
         """搜索文本中匹配的敏感词"""
-        if not text or not self.word_count or not self.is_built:
-            return []
+        return list({word for _, _, word in self.iter_matches(text)})
+
+class ViolationStore:
+    """违规记录的延迟写入存储
+
+    每次违规/重置只在内存中追加一条日志，由后台任务定时批量追加到日志文件；
+    日志条数过多时把内存中的全部记录写成快照（临时文件 + 原子重命名）并清空日志。
+    日志条目带递增序号，快照记录已包含的序号，重放时跳过，保证崩溃后不重复计数。
+    """
+    
+    def __init__(self, snapshot_file: str, log_file: str):
+        self.snapshot_file = snapshot_file
+        self.log_file = log_file
+        self.records = {}
+        self.seq = 0
+        self._pending = []     # 尚未写盘的日志行
+        self._log_entries = 0  # 日志文件中已有的条目数
+        self._task = None
+        self._lock = None
+    
+    @property
+    def pending_count(self) -> int:
+        return len(self._pending)
+    
+    def load(self, apply_entry, restore_records=None) -> Dict:
+        """读取快照并重放日志
+
+        restore_records(raw) 把快照中的原始字典还原成内存结构，
+        apply_entry(records, entry) 负责把日志应用到记录上。
+        """
+        records = {}
+        snapshot_seq = 0
         
-        matched = set()
-        current_node = self.root
+        if os.path.exists(self.snapshot_file):
+            with open(self.snapshot_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if isinstance(data, dict) and "records" in data and "seq" in data:
+                records = data["records"]
+                snapshot_seq = data["seq"]
+            else:
+                # 旧版本直接保存的记录字典
+                records = data
+        if restore_records is not None:
+            records = restore_records(records)
         
-        for i, char in enumerate(text):
-            # 如果当前字符不在子节点中，沿着失败指针回溯
-            while current_node != self.root and char not in current_node.children:
-                current_node = current_node.fail
-            
-            # 如果字符在当前节点的子节点中，移动到该子节点
-            if char in current_node.children:
-                current_node = current_node.children[char]
-                
-                # 检查当前节点是否为结束节点
-                if current_node.is_end:
-                    matched.add(current_node.word)
-                
-                # 检查输出列表中的敏感词（包含更短的敏感词）
-                for word in current_node.output:
-                    matched.add(word)
+        self.seq = snapshot_seq
+        self._log_entries = 0
+        if os.path.exists(self.log_file):
+            with open(self.log_file, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # 写了一半的行
+                    self._log_entries += 1
+                    if entry.get("seq", 0) <= snapshot_seq:
+                        continue
+                    apply_entry(records, entry)
+                    self.seq = max(self.seq, entry["seq"])
+        
+        self.records = records
+        return records
+    
+    def append(self, entry: Dict):
+        """追加一条日志（只写内存，等待后台写盘）"""
+        self.seq += 1
+        entry["seq"] = self.seq
+        self._pending.append(json.dumps(entry, ensure_ascii=False) + "\n")
+    
+    def start(self):
+        """启动后台定时写盘任务（需要在事件循环中调用）"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+    
+    async def _run(self):
+        while True:
+            await asyncio.sleep(plugin_config["flush_interval"])
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"[敏感词检测] 保存违规记录失败: {e}")
+    
+    async def flush(self):
+        """把待写日志追加到文件，日志过长时改为写快照"""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        
+        async with self._lock:
+            loop = asyncio.get_running_loop()
+            if self._log_entries + len(self._pending) >= plugin_config["compact_threshold"]:
+                # 快照已包含所有待写日志的效果
+                snapshot = json.dumps(
+                    {"seq": self.seq, "records": self.records},
+                    ensure_ascii=False,
+                    default=lambda obj: obj.to_dict()
+                )
+                # 写快照期间新追加的日志不在快照内，写成功后只丢弃快照已包含的部分
+                included = len(self._pending)
+                await loop.run_in_executor(None, self._write_snapshot, snapshot)
+                del self._pending[:included]
+                self._log_entries = 0
+            elif self._pending:
+                lines, self._pending = self._pending, []
+                try:
+                    await loop.run_in_executor(None, self._append_lines, lines)
+                except Exception:
+                    # 写入失败时放回队首，下次重试
+                    self._pending[:0] = lines
+                    raise
+                self._log_entries += len(lines)
+    
+    def flush_sync(self):
+        """同步写出待写日志（进程退出时使用）"""
+        if self._pending:
+            self._append_lines(self._pending)
+            self._log_entries += len(self._pending)
+            self._pending = []
+    
+    async def close(self):
+        """停止后台任务并写出剩余日志"""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+    
+    def _append_lines(self, lines: List[str]):
+        with open(self.log_file, 'a', encoding='utf-8') as f:
+            f.write("".join(lines))
+    
+    def _write_snapshot(self, snapshot: str):
+        tmp_file = self.snapshot_file + ".tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            f.write(snapshot)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, self.snapshot_file)
+        # 快照落盘后再清空日志；若在此之前崩溃，重放时会按序号跳过
+        with open(self.log_file, 'w', encoding='utf-8'):
+            pass
+
+# 文本归一化
+# 繁体/异体字 → 简体（两两一组），更多映射可写入 variants.txt
+VARIANT_CHARS = (
+    "賭赌黃黄號号葉叶發发髮发會会們们個个這这開开關关買买賣卖錢钱親亲愛爱媽妈"
+    "幹干殺杀槍枪彈弹藥药販贩騙骗詐诈貸贷網网點点裡里裏里嗎吗麼么來来為为國国"
+    "黨党聯联線线約约視视頻频級级蕩荡雞鸡滾滚賤贱雜杂種种獨独導导偉伟習习動动"
+    "亂乱處处應应訊讯達达進进過过還还時时間间說说話话語语認认識识讓让給给紅红"
+    "帳账戶户體体驗验掃扫碼码頭头無无實实際际邊边員员門门問问題题車车東东裝装"
+    "兒儿劇剧鬥斗壞坏幣币寶宝貝贝現现兌兑換换領领獎奖勵励優优"
+)
+# 形近字母（西里尔/希腊字母 → 拉丁字母）
+HOMOGLYPH_CHARS = "аaеeоoрpсcхxуyіiјjѕsԁdһhαaοoιiνvρpτtκk"
+
+variant_map = {}   # 变体字符 -> 标准字符
+_fold_table = {}   # 单字符归一化结果缓存 {原字符: 归一化后的字符串，可为空，分隔符为 " "}
+
+def load_variants():
+    """加载内置与自定义的变体字映射"""
+    variant_map.clear()
+    for table in (VARIANT_CHARS, HOMOGLYPH_CHARS):
+        for i in range(0, len(table) - 1, 2):
+            variant_map[table[i]] = table[i + 1]
+    
+    try:
+        if os.path.exists(VARIANTS_FILE):
+            with open(VARIANTS_FILE, 'r', encoding='utf-8') as f:
+                for line in f:
+                    parts = line.split()
+                    if len(parts) >= 2 and not parts[0].startswith('#') and len(parts[0]) == 1:
+                        variant_map[parts[0]] = parts[1]
+    except Exception as e:
+        print(f"[敏感词检测] 加载变体字映射失败: {e}")
+    
+    # 映射变化后清空单字符缓存
+    _fold_table.clear()
+
+def _fold_char(char: str) -> str:
+    """计算单个字符的归一化结果：全半角/兼容字符折叠、小写、变体映射
+
+    控制/格式字符（如零宽字符）直接去掉；整个字符都是空白、标点或符号时返回 " " 表示分隔符。
+    """
+    result = []
+    separator = False
+    for c in unicodedata.normalize("NFKC", char).lower():
+        c = variant_map.get(c, c)
+        category = unicodedata.category(c)[0]
+        if category == "C":
+            continue
+        if category in "ZPS":
+            separator = True
+            continue
+        result.append(c)
+    if not result and separator:
+        return " "
+    return "".join(result)
+
+def _is_word_char(c: str) -> bool:
+    """拉丁、希腊、西里尔等按空格分词的文字中的字母或数字"""
+    return c.isalnum() and ord(c) < 0x2E80
+
+def normalize_text(text: str) -> Tuple[str, List[int]]:
+    """一次线性扫描归一化文本，返回 (归一化文本, 每个字符对应的原文下标)
+
+    中文等字符之间插入的分隔符直接去掉；两个拉丁字母/数字之间的一段分隔符折叠成一个空格，
+    避免相邻的英文单词被拼在一起，例如 "this bus" 不会匹配到 "sb"。
+    但用分隔符隔开的一串单个字母（"f u c k"、"s*b"）属于拆字规避，仍然拼接起来。
+    """
+    table = _fold_table
+    chars = []
+    offsets = []
+    separator = -1  # 尚未处理的分隔符在原文中的下标
+    spaces = []     # 插入的空格在 chars 中的下标
+    
+    for i, char in enumerate(text):
+        folded = table.get(char)
+        if folded is None:
+            folded = table[char] = _fold_char(char)
+        if folded == " ":
+            if separator < 0:
+                separator = i
+            continue
+        if not folded:
+            continue
+        if separator >= 0:
+            if chars and _is_word_char(chars[-1]) and _is_word_char(folded[0]):
+                spaces.append(len(chars))
+                chars.append(" ")
+                offsets.append(separator)
+            separator = -1
+        if len(folded) == 1:
+            chars.append(folded)
+            offsets.append(i)
+        elif folded:
+            chars.extend(folded)
+            offsets.extend([i] * len(folded))
+    
+    if spaces:
+        # 空格两侧都是单个字母/数字时去掉这个空格
+        end = len(chars)
+        single = lambda j: not (0 <= j < end) or not _is_word_char(chars[j])
+        drop = {j for j in spaces if single(j - 2) and single(j + 2)}
+        if drop:
+            chars = [c for j, c in enumerate(chars) if j not in drop]
+            offsets = [o for j, o in enumerate(offsets) if j not in drop]
+    
+    return "".join(chars), offsets
+
+def normalize_word(word: str) -> str:
+    """归一化敏感词，与消息文本使用同一套规则"""
+    return normalize_text(word)[0]
+
+class ViolationCounter:
+    """单个用户的滑动窗口违规计数器
+
+    用固定容量的环形数组保存最近 capacity 次违规的时间戳（capacity 即最大违规次数）。
+    时间戳按先后写入，窗口内次数达到容量当且仅当环中最早的一次仍在窗口内，
+    所以判断是否需要禁言是 O(1) 的，也不会出现跨越重置点的漏计。
+    """
+    
+    __slots__ = ("times", "head", "size", "last_time", "messages")
+    
+    MESSAGE_LIMIT = 5  # 保留的最近违规内容条数
+    
+    def __init__(self, capacity: int):
+        self.times = array('d', bytes(8 * max(1, capacity)))
+        self.head = 0         # 最早一次违规在环中的位置
+        self.size = 0         # 环中有效的时间戳个数
+        self.last_time = 0.0
+        self.messages = deque(maxlen=self.MESSAGE_LIMIT)  # (时间, 内容, 消息ID)
+    
+    @property
+    def capacity(self) -> int:
+        return len(self.times)
+    
+    def timestamps(self) -> List[float]:
+        """按先后顺序返回环中的时间戳"""
+        cap = len(self.times)
+        return [self.times[(self.head + i) % cap] for i in range(self.size)]
+    
+    def _expire(self, now: float, window: float):
+        """丢弃窗口之外的时间戳"""
+        times = self.times
+        cap = len(times)
+        while self.size and times[self.head] < now - window:
+            self.head = (self.head + 1) % cap
+            self.size -= 1
+    
+    def _resize(self, capacity: int):
+        """最大违规次数变化时调整环的容量，保留最近的时间戳"""
+        recent = self.timestamps()[-capacity:]
+        self.times = array('d', bytes(8 * capacity))
+        self.times[:len(recent)] = array('d', recent)
+        self.head = 0
+        self.size = len(recent)
+    
+    def add(self, now: float, text: str, message_id: int, window: float, capacity: int) -> int:
+        """记录一次违规，返回窗口内的违规次数"""
+        capacity = max(1, capacity)
+        if capacity != len(self.times):
+            self._resize(capacity)
+        self._expire(now, window)
+        
+        cap = len(self.times)
+        self.times[(self.head + self.size) % cap] = now
+        if self.size < cap:
+            self.size += 1
+        else:
+            # 环已满，覆盖最早的一次
+            self.head = (self.head + 1) % cap
+        
+        self.last_time = now
+        self.messages.append((now, text, message_id))
+        return self.size
+    
+    def count(self, now: float, window: float) -> int:
+        """窗口内的违规次数"""
+        self._expire(now, window)
+        return self.size
+    
+    def first_time(self, now: float, window: float) -> Optional[float]:
+        """窗口内最早一次违规的时间"""
+        self._expire(now, window)
+        return self.times[self.head] if self.size else None
+    
+    def should_ban(self, now: float, window: float, max_violations: int) -> bool:
+        """窗口内是否已达到最大违规次数"""
+        max_violations = max(1, max_violations)
+        if self.size < max_violations:
+            return False
+        # 倒数第 max_violations 次违规仍在窗口内
+        return self.times[(self.head + self.size - max_violations) % len(self.times)] >= now - window
+    
+    def to_dict(self) -> Dict:
+        return {
+            "times": self.timestamps(),
+            "last_time": self.last_time,
+            "messages": [list(msg) for msg in self.messages]
+        }
+    
+    @classmethod
+    def from_dict(cls, data: Dict, capacity: int) -> "ViolationCounter":
+        """从快照还原，兼容旧版本的 {count, first_time, last_time, messages} 格式"""
+        counter = cls(capacity)
+        if "times" in data:
+            times = data["times"]
+            messages = [tuple(msg) for msg in data.get("messages", [])]
+        else:
+            messages = [(msg["time"], msg["text"], msg["message_id"]) for msg in data.get("messages", [])]
+            times = [msg[0] for msg in messages]
         
-        return list(matched)
+        recent = times[-counter.capacity:]
+        counter.times[:len(recent)] = array('d', recent)
+        counter.size = len(recent)
+        counter.last_time = data.get("last_time", times[-1] if times else 0.0)
+        counter.messages.extend(messages[-cls.MESSAGE_LIMIT:])
+        return counter
 
 # 全局存储结构
 enabled_groups = {}  # 存储启用了敏感词检测的群
 local_words = set()  # 本地敏感词库
 whitelist = set()  # 白名单用户
-violation_records = {}  # 违规记录 {group_id: {user_id: {count: x, first_time: t, last_time: t, messages: []}}}
+violation_records = {}  # 违规记录 {group_id: {user_id: ViolationCounter}}
 cooldown_data = {}  # 存储禁言中的用户 {group_id: {user_id: end_time}}
 plugin_config = DEFAULT_CONFIG.copy()
-admin_list = []  # 管理员列表缓存
+admin_list = set()  # 管理员列表缓存（文件变化时自动刷新）
 data_loaded = False  # 数据加载标志
 
 # AC自动机实例
 ac_automaton = AhoCorasick()
 
+# 违规记录存储
+violation_store = ViolationStore(VIOLATION_RECORDS_FILE, VIOLATION_LOG_FILE)
+EVICTION_INTERVAL = 300  # 清理空闲违规记录的间隔（秒）
+last_eviction_time = 0.0
+
 # 敏感词检测API设置
 SENSITIVE_WORD_API = "https://uapis.cn/api/v1/text/profanitycheck"
 REQUEST_TIMEOUT = 10
+API_POOL_SIZE = 20         # 连接池最大连接数
+API_CACHE_SIZE = 4096      # API结果缓存条目上限
+API_CACHE_TTL = 600        # API结果缓存有效期（秒）
+
+class TTLCache:
+    """带过期时间的LRU缓存，并统计命中率"""
+    
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()  # key -> (过期时间, 值)
+    
+    def __len__(self):
+        return len(self._data)
+    
+    def get(self, key):
+        item = self._data.get(key)
+        if item is not None:
+            if item[0] > time.monotonic():
+                self._data.move_to_end(key)
+                self.hits += 1
+                return item[1]
+            del self._data[key]
+        self.misses += 1
+        return None
+    
+    def set(self, key, value):
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+    
+    def clear(self):
+        self._data.clear()
+    
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+api_cache = TTLCache(API_CACHE_SIZE, API_CACHE_TTL)
+
+class RemoteCheckBatcher:
+    """API检测微批处理器
+
+    短时间内到达的待检测文本攒成一批，去重后在并发上限内同时请求API，
+    所有批次共享同一个并发信号量。
+    """
+    
+    def __init__(self):
+        self._pending = []         # [(text, future)]
+        self._flush_handle = None  # 延迟发批的定时器
+        self._tasks = {}           # 正在执行的批次任务 -> 该批次的 [(text, future)]
+        self._semaphore = None
+        self._concurrency = 0
+    
+    @property
+    def pending_count(self) -> int:
+        return len(self._pending)
+    
+    async def check(self, text: str) -> Dict:
+        """提交一条文本，等待所在批次返回API结果"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((text, future))
+        
+        if len(self._pending) >= plugin_config["api_batch_size"]:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(plugin_config["api_batch_wait"], self._flush)
+        
+        return await future
+    
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.ensure_future(self._run_batch(batch))
+            self._tasks[task] = batch
+            task.add_done_callback(lambda t: self._tasks.pop(t, None))
+    
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        limit = max(1, int(plugin_config["api_concurrency"]))
+        if self._semaphore is None or self._concurrency != limit:
+            self._semaphore = asyncio.Semaphore(limit)
+            self._concurrency = limit
+        return self._semaphore
+    
+    async def _run_batch(self, batch):
+        # 同一批内相同的文本只请求一次
+        groups = {}
+        for text, future in batch:
+            groups.setdefault(normalize_cache_key(text), (text, []))[1].append(future)
+        
+        semaphore = self._get_semaphore()
+        
+        async def run(text, futures):
+            async with semaphore:
+                result = await check_api_sensitive_word(text)
+            for future in futures:
+                if not future.done():
+                    future.set_result(result)
+        
+        await asyncio.gather(*(run(text, futures) for text, futures in groups.values()))
+    
+    async def close(self):
+        """停止检测：仍在等待的调用方按API失败处理，然后取消批次任务"""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        stopped = {"status": "error", "message": "检测已停止"}
+        batches = [self._pending] + list(self._tasks.values())
+        for batch in batches:
+            for _, future in batch:
+                if not future.done():
+                    future.set_result(stopped)
+        self._pending = []
+        for task in list(self._tasks):
+            task.cancel()
+
+api_batcher = RemoteCheckBatcher()
+pipeline_stats = {"local": 0, "skipped": 0, "remote": 0}  # 分级检测各阶段处理的消息数
+_skip_pattern_cache = (None, None)  # (规则列表, 编译后的正则)
+http_session: Optional[aiohttp.ClientSession] = None  # 插件共享的连接池会话
+
+class WatchedFile:
+    """按修改时间缓存的名单文件（每行一个QQ号）
+
+    comments 为 True 时跳过以 # 开头的行（白名单文件），框架的 .ini 名单与原来一样逐行读取。
+    """
+    
+    def __init__(self, path: str, create: bool = False, comments: bool = False):
+        self.path = path
+        self.create = create
+        self.comments = comments
+        self.members = set()
+        self._stat = None  # 上次读取时的 (mtime_ns, size)
+    
+    def _stat_key(self):
+        try:
+            st = os.stat(self.path)
+            return st.st_mtime_ns, st.st_size
+        except OSError:
+            return None
+    
+    def refresh(self) -> bool:
+        """文件有变化时重新读取，返回是否发生了变化"""
+        key = self._stat_key()
+        if key is None and self.create:
+            with open(self.path, 'w', encoding='utf-8'):
+                pass
+            key = self._stat_key()
+        if key == self._stat:
+            return False
+        
+        members = set()
+        if key is not None:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    user_id = line.strip()
+                    if user_id and not (self.comments and user_id.startswith('#')):
+                        members.add(user_id)
+        self.members = members
+        self._stat = key
+        return True
+    
+    def mark_synced(self):
+        """插件自己写入文件后调用，避免再重读一次"""
+        self._stat = self._stat_key()
+
+
+class MembershipCache:
+    """管理员（ROOT/Super/Manage）与白名单的共享缓存
+
+    查询仍是集合查找，每隔 CHECK_INTERVAL 秒检查一次名单文件的修改时间，
+    有变化时才重新读取，手动编辑名单无需重启即可生效。
+    """
+    
+    CHECK_INTERVAL = 1.0
+    
+    def __init__(self):
+        self.root_users = set()
+        self.super_users = WatchedFile("Super_User.ini", create=True)
+        self.manage_users = WatchedFile("Manage_User.ini", create=True)
+        self.whitelist_file = WatchedFile(WHITELIST_FILE, comments=True)
+        self._last_check = None
+    
+    def refresh(self, force: bool = False):
+        """检查名单文件并刷新 admin_list 与 whitelist"""
+        global admin_list
+        
+        now = time.monotonic()
+        if not force and self._last_check is not None and now - self._last_check < self.CHECK_INTERVAL:
+            return
+        self._last_check = now
+        
+        try:
+            admins_changed = self.super_users.refresh()
+            admins_changed = self.manage_users.refresh() or admins_changed
+            if admins_changed or force:
+                admin_list = self.root_users | self.super_users.members | self.manage_users.members
+        except Exception as e:
+            print(f"[敏感词检测] 获取管理员列表失败: {e}")
+        
+        try:
+            if self.whitelist_file.refresh():
+                whitelist.clear()
+                whitelist.update(self.whitelist_file.members)
+        except Exception as e:
+            print(f"[敏感词检测] 加载白名单失败: {e}")
+
+membership = MembershipCache()
 
 def load_all_data():
     """一次性加载所有数据"""
-    global enabled_groups, local_words, whitelist, violation_records, plugin_config, admin_list, data_loaded
+    global enabled_groups, local_words, violation_records, plugin_config, data_loaded
     
     if data_loaded:
         return
@@ -194,30 +899,14 @@ def load_all_data():
         print(f"[敏感词检测] 加载群组配置失败: {e}")
         enabled_groups = {}
     
+    # 加载变体字映射（敏感词与消息都依赖它归一化）
+    load_variants()
+    
     # 加载本地敏感词
     load_local_words()
     
-    # 加载白名单
-    try:
-        if os.path.exists(WHITELIST_FILE):
-            with open(WHITELIST_FILE, 'r', encoding='utf-8') as f:
-                whitelist.clear()
-                for line in f:
-                    user_id = line.strip()
-                    if user_id and not user_id.startswith('#'):
-                        whitelist.add(user_id)
-    except Exception as e:
-        print(f"[敏感词检测] 加载白名单失败: {e}")
-        whitelist = set()
-    
-    # 加载违规记录
-    try:
-        if os.path.exists(VIOLATION_RECORDS_FILE):
-            with open(VIOLATION_RECORDS_FILE, 'r', encoding='utf-8') as f:
-                violation_records = json.load(f)
-    except Exception as e:
-        print(f"[敏感词检测] 加载违规记录失败: {e}")
-        violation_records = {}
+    # 加载违规图片哈希
+    load_banned_images()
     
     # 加载插件配置
     try:
@@ -229,63 +918,48 @@ def load_all_data():
         print(f"[敏感词检测] 加载插件配置失败: {e}")
         plugin_config = DEFAULT_CONFIG.copy()
     
-    # 加载管理员列表
-    admin_list = get_admins()
+    # 加载违规记录（快照 + 日志重放，依赖插件配置中的统计窗口）
+    try:
+        violation_records = violation_store.load(apply_violation_entry, restore_violation_records)
+        evict_idle_violations()
+    except Exception as e:
+        print(f"[敏感词检测] 加载违规记录失败: {e}")
+        violation_records = {}
+        violation_store.records = violation_records
+    
+    # 加载管理员列表和白名单
+    membership.root_users = get_root_users()
+    membership.refresh(force=True)
     
     data_loaded = True
 
-def get_admins():
-    """获取所有管理员用户列表（ROOT_User + Super_User + Manage_User）"""
+def get_root_users() -> Set[str]:
+    """从配置文件获取ROOT用户"""
     try:
-        # 从配置文件获取root用户
-        root_users = []
         if hasattr(config, 'owner'):
-            root_users = [str(uid) for uid in getattr(config, 'owner', [])]
+            return {str(uid) for uid in getattr(config, 'owner', [])}
         elif hasattr(config, 'others') and 'ROOT_User' in config.others:
-            root_users = config.others.get('ROOT_User', [])
-        
-        # 加载Super_User列表
-        def load_user_list(filename):
-            try:
-                if not os.path.exists(filename):
-                    with open(filename, 'w', encoding='utf-8') as f:
-                        pass
-                    return []
-                
-                with open(filename, 'r', encoding='utf-8') as f:
-                    users = [line.strip() for line in f if line.strip()]
-                    return list(set(users))
-            except Exception as e:
-                return []
-        
-        # 加载Super_User和Manage_User
-        super_users = load_user_list("Super_User.ini")
-        manage_users = load_user_list("Manage_User.ini")
-        
-        # 合并所有管理员
-        all_admins = []
-        all_admins.extend(root_users)
-        all_admins.extend(super_users)
-        all_admins.extend(manage_users)
-        
-        # 去重后返回
-        return list(set(all_admins))
+            return {str(uid) for uid in config.others.get('ROOT_User', [])}
     except Exception as e:
-        print(f"[敏感词检测] 获取管理员列表失败: {e}")
-        return []
+        print(f"[敏感词检测] 获取ROOT用户失败: {e}")
+    return set()
 
 def is_admin_user(user_id: int) -> bool:
     """检查用户是否为管理员（ROOT_User/Super_User/Manage_User）"""
+    membership.refresh()
     return str(user_id) in admin_list
 
+def is_whitelisted_user(user_id: int) -> bool:
+    """检查用户是否在白名单中"""
+    membership.refresh()
+    return str(user_id) in whitelist
+
 def load_local_words():
     """加载本地敏感词并构建AC自动机"""
-    global local_words, ac_automaton
+    global local_words
     
     try:
         if os.path.exists(LOCAL_WORDS_FILE):
-            # 重新初始化AC自动机
-            ac_automaton = AhoCorasick()
             local_words.clear()
             
             with open(LOCAL_WORDS_FILE, 'r', encoding='utf-8') as f:
@@ -293,23 +967,32 @@ def load_local_words():
                     word = line.strip()
                     if word and not word.startswith('#'):
                         local_words.add(word)
-                        ac_automaton.add_word(word.lower())
-                
-                # 构建AC自动机的失败指针
-                ac_automaton.build_fail()
+            
+            # 一次性批量构建AC自动机
+            refresh_ac_automaton()
     except Exception as e:
         print(f"[敏感词检测] 加载本地敏感词失败: {e}")
         local_words = set()
 
 def refresh_ac_automaton():
-    """根据当前local_words重建AC自动机"""
-    global ac_automaton
-    
-    ac_automaton = AhoCorasick()
-    for word in local_words:
-        ac_automaton.add_word(word.lower())
+    """根据当前local_words全量重建AC自动机"""
+    ac_automaton.rebuild(normalize_word(word) for word in local_words)
+
+def add_local_word(word: str):
+    """添加本地敏感词并增量更新AC自动机"""
+    local_words.add(word)
+    ac_automaton.add_word(normalize_word(word))
     ac_automaton.build_fail()
 
+def remove_local_word(word: str):
+    """删除本地敏感词并增量更新AC自动机"""
+    local_words.discard(word)
+    normalized = normalize_word(word)
+    # 归一化后相同的词（如大小写、全半角不同）仍在词库中时保留
+    if not any(normalize_word(other) == normalized for other in local_words):
+        ac_automaton.remove_word(normalized)
+        ac_automaton.build_fail()
+
 def save_local_words():
     """保存本地敏感词"""
     try:
@@ -333,14 +1016,14 @@ def save_whitelist():
         with open(WHITELIST_FILE, 'w', encoding='utf-8') as f:
             for user_id in sorted(whitelist):
                 f.write(user_id + "\n")
+        membership.whitelist_file.mark_synced()
     except Exception as e:
         print(f"[敏感词检测] 保存白名单失败: {e}")
 
 def save_violation_records():
-    """保存违规记录"""
+    """把尚未写盘的违规记录立即写出"""
     try:
-        with open(VIOLATION_RECORDS_FILE, 'w', encoding='utf-8') as f:
-            json.dump(violation_records, f, ensure_ascii=False, indent=2)
+        violation_store.flush_sync()
     except Exception as e:
         print(f"[敏感词检测] 保存违规记录失败: {e}")
 
@@ -372,36 +1055,297 @@ def extract_text_from_message(message) -> str:
     except:
         return ""
 
-def check_local_sensitive_words(text: str) -> List[str]:
-    """使用AC自动机检查本地敏感词并返回匹配的词列表"""
+def find_local_sensitive_words(text: str) -> List[Tuple[int, int, str]]:
+    """归一化后用AC自动机匹配，返回原文中的 (起始下标, 结束下标, 原文片段)，结束下标不含"""
     if not text:
         return []
     
-    # 统一转为小写进行匹配
-    text_lower = text.lower()
-    return ac_automaton.search(text_lower)
+    normalized, offsets = normalize_text(text)
+    matches = []
+    for start, end, _ in ac_automaton.iter_matches(normalized):
+        origin_start = offsets[start]
+        origin_end = offsets[end] + 1
+        matches.append((origin_start, origin_end, text[origin_start:origin_end]))
+    return matches
+
+def check_local_sensitive_words(text: str) -> List[str]:
+    """使用AC自动机检查本地敏感词并返回匹配到的原文片段列表"""
+    return list(dict.fromkeys(fragment for _, _, fragment in find_local_sensitive_words(text)))
+
+def normalize_cache_key(text: str) -> str:
+    """生成API缓存键：小写并合并空白"""
+    return " ".join(text.lower().split())
+
+async def get_http_session() -> aiohttp.ClientSession:
+    """获取插件共享的HTTP会话（长连接、连接池复用）"""
+    global http_session
+    
+    if http_session is None or http_session.closed:
+        http_session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=API_POOL_SIZE, ttl_dns_cache=300),
+            timeout=aiohttp.ClientTimeout(total=REQUEST_TIMEOUT),
+            headers={"Content-Type": "application/json"}
+        )
+    return http_session
+
+async def close_http_session():
+    """关闭共享的HTTP会话"""
+    global http_session
+    
+    if http_session is not None and not http_session.closed:
+        await http_session.close()
+    http_session = None
 
 async def check_api_sensitive_word(text: str) -> Dict:
-    """调用API检测敏感词"""
+    """调用API检测敏感词（相同文本优先使用缓存结果）"""
     if not text:
         return {"status": "error", "message": "文本为空"}
     
-    headers = {"Content-Type": "application/json"}
+    cache_key = normalize_cache_key(text)
+    cached = api_cache.get(cache_key)
+    if cached is not None:
+        return cached
+    
     data = {"text": text}
     
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(SENSITIVE_WORD_API, json=data, headers=headers, timeout=REQUEST_TIMEOUT) as response:
-                if response.status == 200:
-                    result = await response.json()
-                    return result
-                else:
-                    return {"status": "error", "message": f"API请求失败: {response.status}"}
+        session = await get_http_session()
+        async with session.post(SENSITIVE_WORD_API, json=data) as response:
+            if response.status == 200:
+                result = await response.json()
+                # 只缓存成功的检测结果，出错时下次重新请求
+                if isinstance(result, dict) and result.get("status") != "error":
+                    api_cache.set(cache_key, result)
+                return result
+            else:
+                return {"status": "error", "message": f"API请求失败: {response.status}"}
     except asyncio.TimeoutError:
         return {"status": "error", "message": "API请求超时"}
     except Exception as e:
         return {"status": "error", "message": f"网络错误: {str(e)}"}
 
+def get_skip_pattern():
+    """把api_skip_patterns编译成一个正则（规则变化时重新编译）"""
+    global _skip_pattern_cache
+    
+    patterns = tuple(plugin_config.get("api_skip_patterns") or ())
+    if _skip_pattern_cache[0] != patterns:
+        compiled = None
+        if patterns:
+            try:
+                compiled = re.compile("|".join(f"(?:{p})" for p in patterns))
+            except re.error as e:
+                print(f"[敏感词检测] API跳过规则无效: {e}")
+        _skip_pattern_cache = (patterns, compiled)
+    return _skip_pattern_cache[1]
+
+def should_skip_api(text: str) -> bool:
+    """过短或匹配跳过规则的文本不需要请求API"""
+    if len(text) < plugin_config["api_min_length"]:
+        return True
+    pattern = get_skip_pattern()
+    return bool(pattern and pattern.match(text))
+
+def parse_api_result(api_result: Dict):
+    """解析API结果，返回 (是否违规, 违规词列表)"""
+    status = api_result.get("status")
+    if status == "forbidden":
+        return True, api_result.get("forbidden_words", [])
+    if status == "error":
+        # API不可用时按失败策略处理
+        return bool(plugin_config["api_fail_closed"]), []
+    return False, []
+
+async def detect_sensitive_content(text: str):
+    """分级检测文本，返回 (是否违规, 违规词列表)"""
+    matched_local_words = check_local_sensitive_words(text)
+    
+    if not plugin_config["pipeline_mode"]:
+        # 直连模式：本地与API都检测
+        api_violated, matched_api_words = parse_api_result(await check_api_sensitive_word(text))
+        return bool(matched_local_words) or api_violated, list(set(matched_local_words + matched_api_words))
+    
+    # 1. 本地命中直接判定违规，不再请求API
+    if matched_local_words:
+        pipeline_stats["local"] += 1
+        return True, matched_local_words
+    
+    # 2. 简单文本直接放行
+    if should_skip_api(text):
+        pipeline_stats["skipped"] += 1
+        return False, []
+    
+    # 3. 其余文本进入微批，由API检测
+    pipeline_stats["remote"] += 1
+    return parse_api_result(await api_batcher.check(text))
+
+# 图片检测
+def compute_image_hash(data: bytes) -> int:
+    """计算图片的64位差值哈希（dHash），在线程池中运行（PIL 解码和缩放时会释放 GIL）"""
+    with Image.open(BytesIO(data)) as img:
+        if getattr(img, "is_animated", False):
+            img.seek(0)  # 动图只取第一帧
+        pixels = list(img.convert("L").resize((9, 8), Image.LANCZOS).getdata())
+    
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            left = pixels[row * 9 + col]
+            value = (value << 1) | (left > pixels[row * 9 + col + 1])
+    return value
+
+class BKTree:
+    """按汉明距离组织的BK树，用于查找相近的图片哈希"""
+    
+    def __init__(self, values=()):
+        self.root = None  # [哈希, {距离: 子节点}]
+        self.size = 0
+        for value in values:
+            self.add(value)
+    
+    def __len__(self):
+        return self.size
+    
+    def add(self, value: int):
+        if self.root is None:
+            self.root = [value, {}]
+            self.size = 1
+            return
+        
+        node = self.root
+        while True:
+            distance = bin(node[0] ^ value).count("1")
+            if distance == 0:
+                return
+            child = node[1].get(distance)
+            if child is None:
+                node[1][distance] = [value, {}]
+                self.size += 1
+                return
+            node = child
+    
+    def find(self, value: int, max_distance: int) -> Optional[int]:
+        """返回距离不超过 max_distance 的最近哈希，没有则返回None"""
+        if self.root is None:
+            return None
+        
+        best, best_distance = None, max_distance + 1
+        stack = [self.root]
+        while stack:
+            node_value, children = stack.pop()
+            distance = bin(node_value ^ value).count("1")
+            if distance < best_distance:
+                best, best_distance = node_value, distance
+            # 三角不等式剪枝
+            low, high = distance - max_distance, distance + max_distance
+            for child_distance, child in children.items():
+                if low <= child_distance <= high:
+                    stack.append(child)
+        return best
+
+banned_image_hashes = set()  # 违规图片哈希
+banned_image_tree = BKTree()
+image_hash_cache = TTLCache(2048, 3600)  # 图片文件名 -> 哈希，刷屏的同一张图只下载一次
+image_pool: Optional[ThreadPoolExecutor] = None
+image_stats = {"checked": 0, "blocked": 0}
+
+def load_banned_images():
+    """加载违规图片哈希并构建BK树"""
+    global banned_image_tree
+    
+    try:
+        banned_image_hashes.clear()
+        if os.path.exists(BANNED_IMAGES_FILE):
+            with open(BANNED_IMAGES_FILE, 'r', encoding='utf-8') as f:
+                for line in f:
+                    value = line.split('#', 1)[0].strip()
+                    if value:
+                        banned_image_hashes.add(int(value, 16))
+    except Exception as e:
+        print(f"[敏感词检测] 加载违规图片失败: {e}")
+    banned_image_tree = BKTree(banned_image_hashes)
+
+def save_banned_images():
+    """保存违规图片哈希"""
+    try:
+        with open(BANNED_IMAGES_FILE, 'w', encoding='utf-8') as f:
+            for value in sorted(banned_image_hashes):
+                f.write(f"{value:016x}\n")
+    except Exception as e:
+        print(f"[敏感词检测] 保存违规图片失败: {e}")
+
+def extract_image_segments(message, Segments) -> List[Tuple[str, str]]:
+    """提取消息中的图片，返回 [(缓存键, 下载地址)]"""
+    images = []
+    for segment in message:
+        if isinstance(segment, Segments.Image):
+            file = str(getattr(segment, "file", "") or "")
+            url = file if file.startswith("http") else getattr(segment, "url", None)
+            if url:
+                images.append((file or url, url))
+    return images
+
+async def get_image_hash(cache_key: str, url: str) -> Optional[int]:
+    """下载图片并在线程池中计算哈希"""
+    global image_pool
+    
+    cached = image_hash_cache.get(cache_key)
+    if cached is not None:
+        return cached
+    
+    try:
+        session = await get_http_session()
+        async with session.get(url) as response:
+            if response.status != 200:
+                return None
+            limit = plugin_config["image_max_bytes"]
+            if (response.content_length or 0) > limit:
+                return None
+            # 分块读取，没有 Content-Length 或分块传输的响应超过上限时同样放弃
+            chunks = []
+            size = 0
+            async for chunk in response.content.iter_chunked(65536):
+                size += len(chunk)
+                if size > limit:
+                    return None
+                chunks.append(chunk)
+            data = b"".join(chunks)
+        
+        if image_pool is None:
+            image_pool = ThreadPoolExecutor(
+                max_workers=max(1, int(plugin_config["image_workers"])),
+                thread_name_prefix="image_hash"
+            )
+        value = await asyncio.get_running_loop().run_in_executor(image_pool, compute_image_hash, data)
+    except Exception as e:
+        print(f"[敏感词检测] 计算图片哈希失败: {str(e)[:100]}")
+        return None
+    
+    image_hash_cache.set(cache_key, value)
+    return value
+
+async def check_banned_images(images: List[Tuple[str, str]]) -> bool:
+    """检查图片是否与违规图库中的图片相近"""
+    if not images or not len(banned_image_tree):
+        return False
+    
+    image_stats["checked"] += len(images)
+    hashes = await asyncio.gather(*(get_image_hash(key, url) for key, url in images))
+    max_distance = plugin_config["image_hash_distance"]
+    for value in hashes:
+        if value is not None and banned_image_tree.find(value, max_distance) is not None:
+            image_stats["blocked"] += 1
+            return True
+    return False
+
+def close_image_pool():
+    """关闭图片哈希线程池"""
+    global image_pool
+    
+    if image_pool is not None:
+        image_pool.shutdown(wait=False, cancel_futures=True)
+        image_pool = None
+
 async def safe_delete_message(actions, message_id: int) -> bool:
     """安全删除消息，避免超时错误"""
     try:
@@ -418,6 +1362,73 @@ async def safe_delete_message(actions, message_id: int) -> bool:
         else:
             return False
 
+class DeletionScheduler:
+    """消息定时撤回调度器
+
+    所有待撤回的消息放在同一个最小堆中（按到期时间排序），
+    由事件循环中的一个协程依次等待到期并撤回，不再为每条消息开线程。
+    """
+    
+    def __init__(self):
+        self._heap = []        # [(到期时间, 序号, message_id, actions)]
+        self._seq = 0
+        self._wakeup = None    # 有更早到期的消息加入时唤醒调度协程
+        self._task = None
+        self._deleting = set() # 正在执行的撤回任务
+        self.deleted = 0       # 已撤回的消息数
+    
+    @property
+    def pending_count(self) -> int:
+        return len(self._heap)
+    
+    def schedule(self, actions, message_id: int, delay: float):
+        """安排消息在 delay 秒后撤回"""
+        loop = asyncio.get_running_loop()
+        heapq.heappush(self._heap, (loop.time() + delay, self._seq, message_id, actions))
+        self._seq += 1
+        
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+        elif self._wakeup is not None:
+            self._wakeup.set()
+    
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        
+        while self._heap:
+            timeout = self._heap[0][0] - loop.time()
+            if timeout > 0:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            
+            _, _, message_id, actions = heapq.heappop(self._heap)
+            task = asyncio.ensure_future(self._delete(actions, message_id))
+            self._deleting.add(task)
+            task.add_done_callback(self._deleting.discard)
+    
+    async def _delete(self, actions, message_id: int):
+        try:
+            if await safe_delete_message(actions, message_id):
+                self.deleted += 1
+        except Exception:
+            pass
+    
+    async def close(self):
+        """取消所有尚未执行的撤回"""
+        self._heap.clear()
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        for task in list(self._deleting):
+            task.cancel()
+
+deletion_scheduler = DeletionScheduler()
+
 async def schedule_message_deletion(sent_msg, actions, delay: int = None):
     """安排消息在指定时间后删除"""
     if delay is None:
@@ -439,33 +1450,7 @@ async def schedule_message_deletion(sent_msg, actions, delay: int = None):
         if not message_id:
             return
         
-        def delete_message_sync():
-            """同步删除消息的线程函数"""
-            try:
-                # 等待指定时间
-                time.sleep(delay)
-                
-                # 创建新的事件循环
-                loop = asyncio.new_event_loop()
-                asyncio.set_event_loop(loop)
-                
-                async def delete():
-                    """异步删除消息"""
-                    try:
-                        await safe_delete_message(actions, message_id)
-                    except Exception:
-                        pass
-                
-                # 运行删除任务
-                loop.run_until_complete(delete())
-                loop.close()
-                
-            except Exception:
-                pass
-        
-        # 创建并启动删除线程
-        thread = threading.Thread(target=delete_message_sync, daemon=True)
-        thread.start()
+        deletion_scheduler.schedule(actions, message_id, delay)
                     
     except Exception:
         pass
@@ -481,7 +1466,7 @@ async def send_message_with_auto_delete(actions, group_id, message, delay: int =
         
         if sent_msg:
             # 安排自动删除
-            asyncio.create_task(schedule_message_deletion(sent_msg, actions, delay))
+            await schedule_message_deletion(sent_msg, actions, delay)
             return sent_msg
         else:
             return None
@@ -490,68 +1475,98 @@ async def send_message_with_auto_delete(actions, group_id, message, delay: int =
         print(f"[敏感词检测] 发送消息失败: {e}")
         return None
 
+def _apply_violation(records: Dict, group_key: str, user_key: str, current_time: float, message_text: str, message_id: int) -> int:
+    """在记录字典上累加一次违规，返回窗口内的违规次数"""
+    group_records = records.setdefault(group_key, {})
+    counter = group_records.get(user_key)
+    if counter is None:
+        counter = group_records[user_key] = ViolationCounter(plugin_config["max_violations"])
+    
+    return counter.add(
+        current_time,
+        message_text,
+        message_id,
+        plugin_config["violation_window"],
+        plugin_config["max_violations"]
+    )
+
+def _apply_reset(records: Dict, group_key: str, user_key: str):
+    """在记录字典上清空用户的违规记录"""
+    if group_key in records and user_key in records[group_key]:
+        del records[group_key][user_key]
+        if not records[group_key]:
+            del records[group_key]
+
+def restore_violation_records(raw: Dict) -> Dict:
+    """把快照中的记录还原为计数器"""
+    capacity = plugin_config["max_violations"]
+    return {
+        group_key: {user_key: ViolationCounter.from_dict(data, capacity) for user_key, data in users.items()}
+        for group_key, users in raw.items()
+    }
+
+def evict_idle_violations(now: float = None) -> int:
+    """清理长时间没有违规的用户记录，返回清理数量"""
+    global last_eviction_time
+    
+    if now is None:
+        now = time.time()
+    last_eviction_time = now
+    retention = plugin_config["record_retention"]
+    evicted = 0
+    
+    for group_key in list(violation_records):
+        group_records = violation_records[group_key]
+        for user_key in [u for u, counter in group_records.items() if now - counter.last_time > retention]:
+            del group_records[user_key]
+            evicted += 1
+        if not group_records:
+            del violation_records[group_key]
+    
+    return evicted
+
+def maybe_evict_idle_violations():
+    """距离上次清理超过间隔时清理一次空闲记录"""
+    now = time.time()
+    if now - last_eviction_time >= EVICTION_INTERVAL:
+        evict_idle_violations(now)
+
+def apply_violation_entry(records: Dict, entry: Dict):
+    """重放一条违规日志"""
+    if entry.get("op") == "add":
+        _apply_violation(records, entry["group"], entry["user"], entry["time"], entry["text"], entry["message_id"])
+    elif entry.get("op") == "reset":
+        _apply_reset(records, entry["group"], entry["user"])
+
 def update_violation_record(group_id: int, user_id: int, message_text: str, message_id: int):
     """更新违规记录"""
     group_key = str(group_id)
     user_key = str(user_id)
     current_time = time.time()
+    text = message_text[:100]  # 只保存前100个字符
     
-    # 初始化数据结构
-    if group_key not in violation_records:
-        violation_records[group_key] = {}
+    count = _apply_violation(violation_records, group_key, user_key, current_time, text, message_id)
     
-    if user_key not in violation_records[group_key]:
-        violation_records[group_key][user_key] = {
-            "count": 0,
-            "first_time": current_time,
-            "last_time": current_time,
-            "messages": []
-        }
-    
-    user_record = violation_records[group_key][user_key]
-    
-    # 清理过期的违规记录（超过统计窗口）
-    window = plugin_config["violation_window"]
-    if current_time - user_record["first_time"] > window:
-        user_record["count"] = 0
-        user_record["first_time"] = current_time
-        user_record["messages"] = []
-    
-    # 更新记录
-    user_record["count"] += 1
-    user_record["last_time"] = current_time
-    user_record["messages"].append({
+    # 只追加一条日志，由后台任务写盘
+    violation_store.append({
+        "op": "add",
+        "group": group_key,
+        "user": user_key,
         "time": current_time,
-        "text": message_text[:100],  # 只保存前100个字符
+        "text": text,
         "message_id": message_id
     })
     
-    # 限制保存的消息数量
-    if len(user_record["messages"]) > plugin_config["max_violations"]:
-        user_record["messages"] = user_record["messages"][-plugin_config["max_violations"]:]
-    
-    # 保存到文件
-    save_violation_records()
-    
-    return user_record["count"]
+    return count
 
 def check_should_ban(group_id: int, user_id: int) -> bool:
     """检查是否应该禁言用户"""
-    group_key = str(group_id)
-    user_key = str(user_id)
-    
-    if group_key not in violation_records or user_key not in violation_records[group_key]:
+    counter = violation_records.get(str(group_id), {}).get(str(user_id))
+    if counter is None:
         return False
     
-    user_record = violation_records[group_key][user_key]
-    current_time = time.time()
-    
     # 检查是否在时间窗口内达到最大违规次数
-    if (user_record["count"] >= plugin_config["max_violations"] and 
-        current_time - user_record["first_time"] <= plugin_config["violation_window"]):
-        return True
-    
-    return False
+    return counter.should_ban(time.time(), plugin_config["violation_window"], plugin_config["max_violations"])
 
 def reset_violation_record(group_id: int, user_id: int):
     """重置用户的违规记录"""
@@ -559,10 +1574,8 @@ def reset_violation_record(group_id: int, user_id: int):
     user_key = str(user_id)
     
     if group_key in violation_records and user_key in violation_records[group_key]:
-        del violation_records[group_key][user_key]
-        if not violation_records[group_key]:
-            del violation_records[group_key]
-        save_violation_records()
+        _apply_reset(violation_records, group_key, user_key)
+        violation_store.append({"op": "reset", "group": group_key, "user": user_key})
 
 async def ban_user(actions, group_id: int, user_id: int, duration: int = None):
     """禁言用户"""
@@ -588,6 +1601,12 @@ async def ban_user(actions, group_id: int, user_id: int, duration: int = None):
 
 async def on_message(event, actions, Manager, Segments, Events, reminder):
     """处理消息事件"""
+    # 插件停止时取消待撤回任务、关闭会话并写出违规记录
+    if isinstance(event, Events.HyperListenerStopNotify):
+        print("[敏感词检测] 插件将停止运行")
+        await shutdown()
+        return False
+    
     # 只处理群消息事件
     if not isinstance(event, Events.GroupMessageEvent):
         return False
@@ -596,6 +1615,10 @@ async def on_message(event, actions, Manager, Segments, Events, reminder):
     if not data_loaded:
         load_all_data()
     
+    # 启动违规记录的后台写盘任务，并定期清理空闲记录
+    violation_store.start()
+    maybe_evict_idle_violations()
+    
     # 跳过机器人自己的消息
     if event.user_id == event.self_id:
         return False
@@ -605,13 +1628,14 @@ async def on_message(event, actions, Manager, Segments, Events, reminder):
     group_id = event.group_id
     user_id = event.user_id
     
-    # 只处理文本消息
-    if not is_text_message(message_text):
-        return False
-    
     # 提取纯文本内容
-    clean_text = extract_text_from_message(message_text)
-    if not clean_text:
+    clean_text = extract_text_from_message(message_text) if is_text_message(message_text) else ""
+    
+    # 开启图片检测时提取图片
+    images = extract_image_segments(event.message, Segments) if plugin_config["check_images"] else []
+    
+    # 只处理文本或图片消息
+    if not clean_text and not images:
         return False
     
     # 处理管理员的命令 - 使用配置中的reminder作为前缀
@@ -691,6 +1715,15 @@ async def on_message(event, actions, Manager, Segments, Events, reminder):
                     f"🔸 当前群状态: {status}\n"
                     f"🔸 本地敏感词: {local_count} 个\n"
                     f"🔸 白名单用户: {whitelist_count} 个\n"
+                    f"🔸 API缓存: {len(api_cache)} 条，命中 {api_cache.hits}/{api_cache.hits + api_cache.misses} "
+                    f"({api_cache.hit_rate:.1%})\n"
+                    f"🔸 检测模式: {'分级' if plugin_config['pipeline_mode'] else '直连'}"
+                    f"（本地 {pipeline_stats['local']} / 跳过 {pipeline_stats['skipped']} / API {pipeline_stats['remote']}）\n"
+                    f"🔸 API失败策略: {'拦截' if plugin_config['api_fail_closed'] else '放行'}，"
+                    f"并发上限 {plugin_config['api_concurrency']}\n"
+                    f"🔸 图片检测: {'✅ 开启' if plugin_config['check_images'] else '❌ 关闭'}，"
+                    f"图库 {len(banned_image_hashes)} 张，已检查 {image_stats['checked']} 张 / 拦截 {image_stats['blocked']} 次\n"
+                    f"🔸 待撤回提示: {deletion_scheduler.pending_count} 条（已撤回 {deletion_scheduler.deleted} 条）\n"
                     f"━━━━━━━━━━━━━━━━━━━━━━━\n"
                     f"⚙️ 当前设置：\n"
                     f"  • 违规窗口: {plugin_config['violation_window']}秒\n"
@@ -708,10 +1741,8 @@ async def on_message(event, actions, Manager, Segments, Events, reminder):
             word = command_text[6:].strip()
             if word:
                 if word not in local_words:
-                    local_words.add(word)
+                    add_local_word(word)
                     save_local_words()
-                    # 重新构建AC自动机
-                    refresh_ac_automaton()
                     await send_message_with_auto_delete(
                         actions,
                         group_id,
@@ -736,10 +1767,8 @@ async def on_message(event, actions, Manager, Segments, Events, reminder):
             word = command_text[6:].strip()
             if word:
                 if word in local_words:
-                    local_words.remove(word)
+                    remove_local_word(word)
                     save_local_words()
-                    # 重新构建AC自动机
-                    refresh_ac_automaton()
                     await send_message_with_auto_delete(
                         actions,
                         group_id,
@@ -759,6 +1788,63 @@ async def on_message(event, actions, Manager, Segments, Events, reminder):
                 )
             return True
         
+        # 添加违规图片（图片与命令在同一条消息中）
+        elif command_text == "添加违规图片":
+            command_images = extract_image_segments(event.message, Segments)
+            if command_images:
+                hashes = await asyncio.gather(*(get_image_hash(key, url) for key, url in command_images))
+                hashes = [value for value in hashes if value is not None]
+                if hashes:
+                    for value in hashes:
+                        banned_image_hashes.add(value)
+                        banned_image_tree.add(value)
+                    save_banned_images()
+                    await send_message_with_auto_delete(
+                        actions,
+                        group_id,
+                        Manager.Message(Segments.Text(
+                            f"✅ 已添加 {len(hashes)} 张违规图片: {', '.join(f'{value:016x}' for value in hashes)} (＾∀＾)ﾉ"
+                        ))
+                    )
+                else:
+                    await send_message_with_auto_delete(
+                        actions,
+                        group_id,
+                        Manager.Message(Segments.Text("❌ 图片下载或解析失败了呢~ (＞﹏＜)"))
+                    )
+            else:
+                await send_message_with_auto_delete(
+                    actions,
+                    group_id,
+                    Manager.Message(Segments.Text("❌ 请在命令后附上要添加的图片哦~ (；´д｀)ゞ"))
+                )
+            return True
+        
+        # 删除违规图片
+        elif command_text.startswith("删除违规图片 "):
+            value = command_text[7:].strip().lower()
+            try:
+                image_hash = int(value, 16)
+            except ValueError:
+                image_hash = None
+            
+            if image_hash is not None and image_hash in banned_image_hashes:
+                banned_image_hashes.discard(image_hash)
+                save_banned_images()
+                load_banned_images()
+                await send_message_with_auto_delete(
+                    actions,
+                    group_id,
+                    Manager.Message(Segments.Text(f"✅ 已删除违规图片: {value} (´∀｀)♡"))
+                )
+            else:
+                await send_message_with_auto_delete(
+                    actions,
+                    group_id,
+                    Manager.Message(Segments.Text(f"⚠️ 违规图库中没有 {value} 呢~ (´･ω･`?)"))
+                )
+            return True
+        
         # 添加白名单
         elif command_text.startswith("添加白名单 "):
             user = command_text[6:].strip()
@@ -838,8 +1924,11 @@ async def on_message(event, actions, Manager, Segments, Events, reminder):
                 
                 if group_key in violation_records and user_key in violation_records[group_key]:
                     record = violation_records[group_key][user_key]
-                    messages = "\n".join([f"  {i+1}. {datetime.fromtimestamp(msg['time']).strftime('%H:%M:%S')}: {msg['text']}" 
-                                        for i, msg in enumerate(record['messages'][-5:])])  # 只显示最近5条
+                    window = plugin_config["violation_window"]
+                    now = time.time()
+                    first_time = record.first_time(now, window)
+                    messages = "\n".join([f"  {i+1}. {datetime.fromtimestamp(msg_time).strftime('%H:%M:%S')}: {text}" 
+                                        for i, (msg_time, text, _) in enumerate(record.messages)])  # 只显示最近5条
                     
                     await send_message_with_auto_delete(
                         actions,
@@ -847,9 +1936,9 @@ async def on_message(event, actions, Manager, Segments, Events, reminder):
                         Manager.Message(Segments.Text(
                             f"📝 【用户 {user} 的违规记录】\n"
                             f"━━━━━━━━━━━━━━━━━━━━━━━\n"
-                            f"🔸 违规次数: {record['count']} 次\n"
-                            f"🔸 首次违规: {datetime.fromtimestamp(record['first_time']).strftime('%H:%M:%S')}\n"
-                            f"🔸 最近违规: {datetime.fromtimestamp(record['last_time']).strftime('%H:%M:%S')}\n"
+                            f"🔸 窗口内违规: {record.count(now, window)} 次\n"
+                            f"🔸 窗口内首次: {datetime.fromtimestamp(first_time).strftime('%H:%M:%S') if first_time else '无'}\n"
+                            f"🔸 最近违规: {datetime.fromtimestamp(record.last_time).strftime('%H:%M:%S')}\n"
                             f"━━━━━━━━━━━━━━━━━━━━━━━\n"
                             f"📋 最近违规内容:\n{messages}\n"
                             f"━━━━━━━━━━━━━━━━━━━━━━━\n"
@@ -901,6 +1990,34 @@ async def on_message(event, actions, Manager, Segments, Events, reminder):
                             group_id,
                             Manager.Message(Segments.Text(f"🔇 已设置禁言时长为 {value} 秒 ({value//60} 分钟) (｀・ω・´)"))
                         )
+                    elif param == "检测模式" and value in ["分级", "直连"]:
+                        plugin_config["pipeline_mode"] = value == "分级"
+                        await send_message_with_auto_delete(
+                            actions,
+                            group_id,
+                            Manager.Message(Segments.Text(f"🧭 已设置检测模式为 {value} (＾▽＾)"))
+                        )
+                    elif param == "图片检测" and value in ["开启", "关闭"]:
+                        plugin_config["check_images"] = value == "开启"
+                        await send_message_with_auto_delete(
+                            actions,
+                            group_id,
+                            Manager.Message(Segments.Text(f"🖼️ 已{value}违规图片检测 (＾▽＾)"))
+                        )
+                    elif param == "并发上限" and value.isdigit() and int(value) > 0:
+                        plugin_config["api_concurrency"] = int(value)
+                        await send_message_with_auto_delete(
+                            actions,
+                            group_id,
+                            Manager.Message(Segments.Text(f"🚦 已设置API并发上限为 {value} (｀・ω・´)"))
+                        )
+                    elif param == "失败策略" and value in ["放行", "拦截"]:
+                        plugin_config["api_fail_closed"] = value == "拦截"
+                        await send_message_with_auto_delete(
+                            actions,
+                            group_id,
+                            Manager.Message(Segments.Text(f"🛡️ 已设置API失败时{value}消息 (｀・ω・´)"))
+                        )
                     else:
                         await send_message_with_auto_delete(
                             actions,
@@ -945,7 +2062,7 @@ async def on_message(event, actions, Manager, Segments, Events, reminder):
         return False
     
     # 2. 检查是否在白名单中
-    if user_key in whitelist:
+    if is_whitelisted_user(user_id):
         # 白名单用户发言不受限制
         return False
     
@@ -961,15 +2078,15 @@ async def on_message(event, actions, Manager, Segments, Events, reminder):
             if not cooldown_data[group_key]:
                 del cooldown_data[group_key]
     
-    # 检查本地敏感词（使用AC自动机）
-    matched_local_words = check_local_sensitive_words(clean_text)
+    # 分级检测敏感词（本地AC自动机 + API）
+    violated, all_forbidden_words = await detect_sensitive_content(clean_text) if clean_text else (False, [])
     
-    # 检查API敏感词
-    api_result = await check_api_sensitive_word(clean_text)
-    matched_api_words = api_result.get("forbidden_words", []) if api_result.get("status") == "forbidden" else []
+    # 文字没有问题时再检查图片
+    if not violated and images and await check_banned_images(images):
+        violated, all_forbidden_words = True, ["违规图片"]
     
     # 如果没有敏感词，返回
-    if not matched_local_words and not matched_api_words:
+    if not violated:
         return False
     
     print(f"[敏感词检测] 检测到敏感词，用户: {user_id}, 群: {group_id}")
@@ -982,10 +2099,7 @@ async def on_message(event, actions, Manager, Segments, Events, reminder):
             print(f"[敏感词检测] 已撤回用户 {user_id} 的消息")
             
             # 更新违规记录
-            violation_count = update_violation_record(group_id, user_id, clean_text, event.message_id)
-            
-            # 获取所有违规词
-            all_forbidden_words = list(set(matched_local_words + matched_api_words))
+            violation_count = update_violation_record(group_id, user_id, clean_text or "[图片]", event.message_id)
             
             # 构建警告消息
             warning_parts = []
@@ -1043,12 +2157,23 @@ async def on_message(event, actions, Manager, Segments, Events, reminder):
     
     return True
 
+async def shutdown():
+    """插件停止时释放资源"""
+    await deletion_scheduler.close()
+    await api_batcher.close()
+    await close_http_session()
+    close_image_pool()
+    await violation_store.close()
+
 # 插件初始化
 print("[敏感词检测插件] 正在初始化...")
 
 # 加载数据
 load_all_data()
 
+# 进程退出时写出尚未保存的违规记录
+atexit.register(save_violation_records)
+
 print(f"[敏感词检测插件] 初始化完成")
 print(f"  启用群组: {len(enabled_groups)} 个")
 print(f"  本地敏感词: {len(local_words)} 个")
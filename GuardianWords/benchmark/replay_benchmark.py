@@ -0,0 +1,475 @@
+"""GuardianWords 离线基准测试与消息回放工具
+
+在隔离的临时目录中加载插件，用假的 actions 对象和本地假敏感词API回放群消息，
+统计 on_message 的延迟分布与吞吐，以及不同规模词库下AC自动机的构建耗时和内存。
+
+用法（在机器人根目录或任意目录运行均可）：
+    python replay_benchmark.py
+    python replay_benchmark.py --sizes 1000,10000,100000 --messages 20000
+    python replay_benchmark.py --corpus messages.txt --words sensitive_words.txt --json result.json
+
+语料文件每行一条消息，可以是纯文本，也可以是“群号<TAB>QQ号<TAB>文本”。
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import asyncio
+import argparse
+import tempfile
+import contextlib
+import tracemalloc
+import importlib.util
+import types
+from aiohttp import web
+
+PLUGIN_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "GuardianWords.py")
+
+# 生成随机文本用的字符
+CJK_CHARS = "的一是不了人我在有他这中大来上个国到说们为子和你地出会也时要就可以对生能而那得于着下自之年过发后作里用道行所然家种事成方多经么去法学如都同现当没动面起看定天分还进好小部其些主样理心她本前开但因只从想实日军者意无力它与长把机十民第公此已工使情明性知全三又关点正业外将两高间由问很最重并物手应战向头文体政美相见被利什二等产或新己制身果加西斯月话合回特代内信表化老给世位次度门任常先海通教儿原东声提立及比员解水名真论处走义各入几口认条平系气题活尔更别打女变四神总何电数安少报才结反受目太量再感建务做接必场件计管期市直德资命山金指克许统区保至队形社便空决治展马科司五基眼书非则听白却界达光放强即像难且权思王象完设式色路记南品住告类求据程北边死张该交规万取拉格望觉术领共确传师观清今切院让识候带导争运笑飞风步改收根干造言联持组每济车亲极林服快办议往元英士证近失转夫令准布始怎呢存未远叫台单影具罗字爱击流备兵连调深商算质团集百需价花党华城石级整府离况亚请技际约示复病息究线似官火断精满支视消越器容照须九增研写称企八功吗包片史委乎查轻易早曾除农找装广显吧阿李标谈吃图念六引历首医局突专费号尽另周较注语仅考落青随选列武红响虽推势参希古众构房半节土投某案黑维革划敌致陈律足态护七兴派孩验责营星够章音跟志底站严巴例防族供效续施留讲型料终答紧黄绝奇察母京段依批群项故按河米围江织害斗双境客纪采举杀攻父苏密低朝友诉止细愿千值仍男钱破网热助倒育属坐帝限船脸职速刻乐否刚威毛状率甚独球般普怕弹校苦创假久错承印晚兰试股拿脑预谁益阳若哪微尼继送急血惊伤素药适波夜省初喜卫源食险待述陆习置居劳财环排福纳欢雷警获模充负云停木游龙树疑层冷洲冲射略范竟句室异激汉村哈策演简卡罪判担州静退既衣您宗积余痛检差富灵协角占配征修皮挥胜降阶审沉坚善妈刘读啊超免压银买皇养伊怀执副乱抗犯追帮宣佛岁航优怪香著田铁控税左右份穿艺背阵草脚概恶块顿敢守酒岛托央户烈洋哥索胡款靠评版宝座释景顾弟登货互付伯慢欧换闻危忙核暗姐介坏讨丽良序升监临亮露永呼味野架域沙掉括舰鱼杂误湾吉减编楚肯测败屋跑梦散温困剑渐封救贵枪缺楼县尚毫移娘朋画班智亦耳恩短掌恐遗固席松秘谢鲁遇康虑幸均销钟诗藏赶剧票损忽巨炮旧端探湖录叶春乡附吸予礼港雨呀板庭妇归睛饭额含顺输摇招婚脱补谓督毒油疗旅泽材灭逐莫笔亡鲜词圣择寻厂睡博勒烟授诺伦岸奥唐卖俄炸载洛健堂旁宫喝借君禁阴园谋宋避抓荣姑孙逃牙束跳顶玉镇雪午练迫爷篇肉嘴馆遍凡础洞卷坦牛宁纸诸训私庄祖丝翻暴森塔默握戏隐熟骨访弱蒙歌店鬼软典欲萨伙遭盘爸扩盖弄雄稳忘亿刺拥徒姆杨齐赛趣曲刀床迎冰虚玩析窗醒妻透购替塞努休虎扬途侵刑绿兄迅套贸毕唯谷轮库迹尤竞街促延震弃甲伟麻川申缓潜闪售灯针哲络抵朱埃抱鼓植纯夏忍页杰筑折郑贝尊吴秀混臣雅振染盛怒舞圆搞狂措姓残秋培迷诚宽宇猛摆梅毁伸摩盟末乃悲拍丁赵"
+LATIN_CHARS = "abcdefghijklmnopqrstuvwxyz0123456789"
+REPEAT_TEXTS = ["哈哈哈", "+1", "6666", "好的", "收到", "哈哈哈哈哈", "？？？", "早上好", "晚安"]
+EVASION_SEPARATORS = [" ", ".", "*", "　", "-", "​"]
+
+
+# ========== 隔离加载插件 ==========
+def install_hyper_shim():
+    """没有 Hyper 框架或 config.json 时，注入一个只提供 Configurator 的最小实现"""
+    class _Config:
+        def __init__(self, file=None):
+            self.others = {"reminder": "/", "bot_name": "简儿", "ROOT_User": []}
+            self.owner = []
+
+        def load_from_file(self):
+            return self
+
+    class _ConfigManager:
+        def __init__(self, cfg):
+            self._cfg = cfg
+
+        def get_cfg(self):
+            return self._cfg
+
+    configurator = types.ModuleType("Hyper.Configurator")
+    configurator.Config = _Config
+    configurator.ConfigManager = _ConfigManager
+    configurator.cm = None
+    hyper = types.ModuleType("Hyper")
+    hyper.Configurator = configurator
+    sys.modules["Hyper"] = hyper
+    sys.modules["Hyper.Configurator"] = configurator
+
+
+def load_plugin(plugin_path: str, workdir: str):
+    """把插件复制到临时目录并加载，数据文件全部写在临时目录中"""
+    origin_cwd = os.getcwd()
+    plugins_dir = os.path.join(workdir, "plugins")
+    os.makedirs(plugins_dir, exist_ok=True)
+    target = os.path.join(plugins_dir, "GuardianWords.py")
+    shutil.copy(plugin_path, target)
+
+    origin_config = os.path.join(origin_cwd, "config.json")
+    use_real_hyper = os.path.exists(origin_config)
+    if use_real_hyper:
+        shutil.copy(origin_config, os.path.join(workdir, "config.json"))
+        try:
+            import Hyper.Configurator  # noqa: F401
+        except ImportError:
+            use_real_hyper = False
+    if not use_real_hyper:
+        install_hyper_shim()
+
+    # Super_User.ini 等文件相对于工作目录
+    os.chdir(workdir)
+    spec = importlib.util.spec_from_file_location("GuardianWords", target)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules["GuardianWords"] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+# ========== 假的框架对象 ==========
+class FakeSegments:
+    class Text:
+        def __init__(self, text):
+            self.text = text
+
+        def __str__(self):
+            return self.text
+
+    class At:
+        def __init__(self, qq):
+            self.qq = qq
+
+        def __str__(self):
+            return f"[CQ:at,qq={self.qq}]"
+
+    class Image:
+        def __init__(self, file, url=None):
+            self.file = file
+            self.url = url
+
+        def __str__(self):
+            return f"[CQ:image,file={self.file}]"
+
+
+class FakeMessage(list):
+    def __str__(self):
+        return "".join(str(segment) for segment in self)
+
+
+class FakeManager:
+    Message = staticmethod(lambda *segments: FakeMessage(segments))
+
+
+class FakeEvents:
+    class GroupMessageEvent:
+        def __init__(self, group_id, user_id, message, message_id, self_id=10000):
+            self.group_id = group_id
+            self.user_id = user_id
+            self.message = message
+            self.message_id = message_id
+            self.self_id = self_id
+
+    class HyperListenerStopNotify:
+        pass
+
+
+class FakeActions:
+    """记录调用次数的假 actions，可模拟OneBot接口延迟"""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls = {"send": 0, "del_message": 0, "set_group_ban": 0}
+        self._next_id = 1
+
+    async def _delay(self):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        else:
+            await asyncio.sleep(0)
+
+    async def send(self, group_id=None, message=None):
+        self.calls["send"] += 1
+        await self._delay()
+        self._next_id += 1
+        return {"message_id": self._next_id}
+
+    async def del_message(self, message_id):
+        self.calls["del_message"] += 1
+        await self._delay()
+
+    async def set_group_ban(self, group_id=None, user_id=None, duration=0):
+        self.calls["set_group_ban"] += 1
+        await self._delay()
+
+
+async def start_fake_api(forbidden_words, latency: float):
+    """启动本地假敏感词API，返回 (runner, 地址, 请求计数)"""
+    counter = {"requests": 0}
+
+    async def handle(request):
+        counter["requests"] += 1
+        data = await request.json()
+        if latency:
+            await asyncio.sleep(latency)
+        text = data.get("text", "")
+        hits = [word for word in forbidden_words if word in text]
+        if hits:
+            return web.json_response({"status": "forbidden", "forbidden_words": hits})
+        return web.json_response({"status": "ok"})
+
+    app = web.Application()
+    app.router.add_post("/profanitycheck", handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}/profanitycheck", counter
+
+
+# ========== 数据生成 ==========
+def random_text(rng: random.Random, min_len: int, max_len: int) -> str:
+    length = rng.randint(min_len, max_len)
+    if rng.random() < 0.8:
+        return "".join(rng.choice(CJK_CHARS) for _ in range(length))
+    return "".join(rng.choice(LATIN_CHARS) for _ in range(length))
+
+
+def generate_words(count: int, seed: int = 1):
+    rng = random.Random(seed)
+    words = set()
+    while len(words) < count:
+        words.add(random_text(rng, 2, 6))
+    return sorted(words)
+
+
+def generate_corpus(count: int, words, groups: int, users: int, seed: int = 2):
+    """生成合成语料：普通聊天、重复刷屏、含敏感词、插入分隔符规避"""
+    rng = random.Random(seed)
+    corpus = []
+    for _ in range(count):
+        roll = rng.random()
+        if roll < 0.55:
+            text = random_text(rng, 4, 40)
+        elif roll < 0.8:
+            text = rng.choice(REPEAT_TEXTS)
+        elif roll < 0.92:
+            text = random_text(rng, 0, 10) + rng.choice(words) + random_text(rng, 0, 10)
+        else:
+            separator = rng.choice(EVASION_SEPARATORS)
+            text = random_text(rng, 0, 6) + separator.join(rng.choice(words)) + random_text(rng, 0, 6)
+        corpus.append((rng.randint(1, groups), rng.randint(100000, 100000 + users), text))
+    return corpus
+
+
+def load_corpus(path: str, groups: int, users: int, seed: int = 2):
+    rng = random.Random(seed)
+    corpus = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.rstrip("\n")
+            if not line:
+                continue
+            parts = line.split("\t", 2)
+            if len(parts) == 3 and parts[0].isdigit() and parts[1].isdigit():
+                corpus.append((int(parts[0]), int(parts[1]), parts[2]))
+            else:
+                corpus.append((rng.randint(1, groups), rng.randint(100000, 100000 + users), line))
+    return corpus
+
+
+def load_words(path: str):
+    with open(path, "r", encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith("#")]
+
+
+# ========== 测量 ==========
+def percentile(sorted_values, ratio: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(ratio * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def summarize(latencies):
+    values = sorted(latencies)
+    return {
+        "count": len(values),
+        "p50_ms": percentile(values, 0.50) * 1000,
+        "p90_ms": percentile(values, 0.90) * 1000,
+        "p99_ms": percentile(values, 0.99) * 1000,
+        "max_ms": (values[-1] if values else 0.0) * 1000,
+    }
+
+
+def bench_automaton(plugin, sizes):
+    """测量不同规模词库下AC自动机的构建耗时、内存和增量编辑耗时"""
+    results = []
+    for size in sizes:
+        words = [plugin.normalize_word(word) for word in generate_words(size)]
+
+        start = time.perf_counter()
+        automaton = plugin.AhoCorasick(words)
+        build_seconds = time.perf_counter() - start
+        del automaton
+
+        tracemalloc.start()
+        automaton = plugin.AhoCorasick(words)
+        memory_bytes = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+
+        start = time.perf_counter()
+        automaton.add_word("基准测试新增词")
+        automaton.build_fail()
+        automaton.remove_word(words[0])
+        automaton.build_fail()
+        edit_seconds = time.perf_counter() - start
+
+        sample = "".join(words[i % len(words)] + "，普通的聊天内容" for i in range(5))
+        rounds = 2000
+        start = time.perf_counter()
+        for _ in range(rounds):
+            automaton.search(sample)
+        search_us = (time.perf_counter() - start) / rounds * 1e6
+
+        results.append({
+            "words": size,
+            "nodes": automaton.node_count,
+            "build_ms": build_seconds * 1000,
+            "memory_mb": memory_bytes / 1024 / 1024,
+            "edit_ms": edit_seconds * 1000,
+            "search_us": search_us,
+        })
+    return results
+
+
+def bench_components(plugin, corpus):
+    """单独测量本地匹配与违规记录更新的耗时"""
+    local_latencies = []
+    for _, _, text in corpus:
+        start = time.perf_counter()
+        plugin.check_local_sensitive_words(text)
+        local_latencies.append(time.perf_counter() - start)
+
+    record_latencies = []
+    for index, (group_id, user_id, text) in enumerate(corpus[:5000]):
+        start = time.perf_counter()
+        plugin.update_violation_record(group_id, user_id, text, index)
+        plugin.check_should_ban(group_id, user_id)
+        record_latencies.append(time.perf_counter() - start)
+
+    return {
+        "check_local_sensitive_words": summarize(local_latencies),
+        "update_violation_record": summarize(record_latencies),
+    }
+
+
+async def replay(plugin, corpus, concurrency: int, actions):
+    """并发回放语料，返回每条消息 on_message 的耗时与总耗时"""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    handled = 0
+
+    async def run(index, group_id, user_id, text):
+        nonlocal handled
+        event = FakeEvents.GroupMessageEvent(
+            group_id, user_id, FakeMessage([FakeSegments.Text(text)]), 1000000 + index
+        )
+        async with semaphore:
+            start = time.perf_counter()
+            if await plugin.on_message(event, actions, FakeManager, FakeSegments, FakeEvents, "/"):
+                handled += 1
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(run(i, g, u, t) for i, (g, u, t) in enumerate(corpus)))
+    return latencies, time.perf_counter() - start, handled
+
+
+async def main_async(args):
+    workdir = tempfile.mkdtemp(prefix="guardianwords_bench_")
+    origin_cwd = os.getcwd()
+    result = {}
+
+    try:
+        plugin = load_plugin(os.path.abspath(args.plugin), workdir)
+        plugin.plugin_config.update({
+            "pipeline_mode": not args.direct,
+            "api_concurrency": args.api_concurrency,
+            "max_violations": args.max_violations,
+        })
+
+        # 1. AC自动机规模测试
+        sizes = [int(size) for size in args.sizes.split(",") if size]
+        result["automaton"] = bench_automaton(plugin, sizes)
+
+        # 2. 准备词库和语料
+        words = load_words(args.words) if args.words else generate_words(args.replay_words, seed=1)
+        plugin.local_words.clear()
+        plugin.local_words.update(words)
+        plugin.refresh_ac_automaton()
+
+        if args.corpus:
+            corpus = load_corpus(args.corpus, args.groups, args.users)
+        else:
+            corpus = generate_corpus(args.messages, words, args.groups, args.users)
+        for group_id in {group_id for group_id, _, _ in corpus}:
+            plugin.enabled_groups[str(group_id)] = True
+
+        result["components"] = bench_components(plugin, corpus)
+        plugin.violation_records.clear()
+
+        # 3. 启动假API并回放
+        api_words = set(generate_words(200, seed=3))
+        runner, api_url, api_counter = await start_fake_api(api_words, args.api_latency)
+        plugin.SENSITIVE_WORD_API = api_url
+        actions = FakeActions(args.action_latency)
+
+        # 插件每条违规都会打印日志，默认屏蔽以免影响计时
+        output = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(open(os.devnull, "w"))
+        try:
+            with output:
+                latencies, elapsed, handled = await replay(plugin, corpus, args.concurrency, actions)
+                await plugin.violation_store.flush()
+        finally:
+            await plugin.shutdown()
+            await runner.cleanup()
+
+        result["replay"] = {
+            **summarize(latencies),
+            "messages_per_sec": len(corpus) / elapsed if elapsed else 0.0,
+            "elapsed_s": elapsed,
+            "violations": handled,
+            "api_requests": api_counter["requests"],
+            "api_cache_hit_rate": plugin.api_cache.hit_rate,
+            "pipeline": dict(plugin.pipeline_stats),
+            "actions": actions.calls,
+        }
+    finally:
+        os.chdir(origin_cwd)
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    return result
+
+
+def print_report(result):
+    print("\n== AC自动机 ==")
+    print(f"{'词数':>8} {'节点数':>10} {'构建(ms)':>10} {'内存(MB)':>10} {'增删(ms)':>10} {'查询(us)':>10}")
+    for row in result["automaton"]:
+        print(f"{row['words']:>8} {row['nodes']:>10} {row['build_ms']:>10.1f} {row['memory_mb']:>10.2f} "
+              f"{row['edit_ms']:>10.2f} {row['search_us']:>10.1f}")
+
+    print("\n== 热路径组件 ==")
+    for name, stats in result["components"].items():
+        print(f"{name:<30} p50 {stats['p50_ms']:.4f} ms  p99 {stats['p99_ms']:.4f} ms")
+
+    replay_stats = result["replay"]
+    print("\n== on_message 回放 ==")
+    print(f"消息数 {replay_stats['count']}，耗时 {replay_stats['elapsed_s']:.2f} s，"
+          f"吞吐 {replay_stats['messages_per_sec']:.0f} 条/秒")
+    print(f"p50 {replay_stats['p50_ms']:.2f} ms  p90 {replay_stats['p90_ms']:.2f} ms  "
+          f"p99 {replay_stats['p99_ms']:.2f} ms  max {replay_stats['max_ms']:.2f} ms")
+    print(f"违规 {replay_stats['violations']} 条，API请求 {replay_stats['api_requests']} 次，"
+          f"缓存命中率 {replay_stats['api_cache_hit_rate']:.1%}")
+    print(f"分级检测 {replay_stats['pipeline']}，actions调用 {replay_stats['actions']}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="GuardianWords 离线基准测试与消息回放")
+    parser.add_argument("--plugin", default=PLUGIN_FILE, help="GuardianWords.py 路径")
+    parser.add_argument("--sizes", default="1000,10000,100000", help="AC自动机测试的词库规模，逗号分隔")
+    parser.add_argument("--words", help="回放使用的敏感词文件（默认随机生成）")
+    parser.add_argument("--replay-words", type=int, default=10000, help="随机生成的回放词库大小")
+    parser.add_argument("--corpus", help="回放语料文件（默认随机生成）")
+    parser.add_argument("--messages", type=int, default=10000, help="随机生成的消息条数")
+    parser.add_argument("--groups", type=int, default=50, help="随机分配的群数量")
+    parser.add_argument("--users", type=int, default=2000, help="随机分配的用户数量")
+    parser.add_argument("--concurrency", type=int, default=32, help="同时处理的消息数")
+    parser.add_argument("--api-latency", type=float, default=0.05, help="假API的响应延迟（秒）")
+    parser.add_argument("--api-concurrency", type=int, default=4, help="插件的API并发上限")
+    parser.add_argument("--action-latency", type=float, default=0.0, help="假actions接口延迟（秒）")
+    parser.add_argument("--max-violations", type=int, default=10, help="最大违规次数")
+    parser.add_argument("--direct", action="store_true", help="使用直连模式而不是分级检测")
+    parser.add_argument("--json", help="把结果写入JSON文件")
+    parser.add_argument("--keep", action="store_true", help="保留临时工作目录")
+    parser.add_argument("--verbose", action="store_true", help="显示插件在回放时打印的日志")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    result = asyncio.run(main_async(args))
+    print_report(result)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,11 @@
 import os
-import glob
+import re
 import json
 import math
+import time
+import asyncio
+import hashlib
+import threading
 from collections import Counter
 from Hyper import Configurator
 from Tools.deepseek import dsr114
@@ -32,7 +36,7 @@ async def on_message(event, actions, Manager, Segments):
         return False
     
     # 检查并创建知识库文件夹
-    knowledge_dir = "data/knowledge"
+    knowledge_dir = KNOWLEDGE_DIR
     if not os.path.exists(knowledge_dir):
         os.makedirs(knowledge_dir)
     
@@ -41,8 +45,8 @@ async def on_message(event, actions, Manager, Segments):
         print("提醒：知识库文件夹为空，请在 data/knowledge 文件夹下放置 markdown 格式的 .md 文档当作知识库")
         return False
     
-    # 检索知识库中的相关信息
-    relevant_info = search_knowledge_base(knowledge_dir, user_input)
+    # 检索知识库中的相关信息（在线程池中执行，避免阻塞事件循环）
+    relevant_info = await asyncio.get_running_loop().run_in_executor(None, search_knowledge_base, knowledge_dir, user_input)
     
     # 如果没有检索到相关知识，则不回复
     if not relevant_info:
@@ -211,151 +215,271 @@ def extract_keywords(text):
     
     return extended_keywords
 
-def calculate_similarity(text1, text2, keywords1=None, keywords2=None, filename=""):
-    """计算两个文本的相似度（改进版）"""
-    # 如果没有提供关键词，提取关键词
-    if keywords1 is None:
-        keywords1 = extract_keywords(text1)
-    if keywords2 is None:
-        keywords2 = extract_keywords(text2)
-    
-    # 确保keywords1和keywords2是集合
-    keywords1 = set(keywords1) if keywords1 else set()
-    keywords2 = set(keywords2) if keywords2 else set()
-    
-    # 计算共同关键词数
-    common_keywords = keywords1.intersection(keywords2)
-    
-    # 计算关键词相似度
-    if len(keywords1) == 0 or len(keywords2) == 0:
-        keyword_similarity = 0.0
-    else:
-        keyword_similarity = len(common_keywords) / math.sqrt(len(keywords1) * len(keywords2))
-    
-    # 计算文本长度相似度（惩罚过长或过短的文本）
-    len1 = len(text1)
-    len2 = len(text2)
-    if len1 + len2 == 0:
-        length_similarity = 1.0
-    else:
-        length_similarity = 1.0 - abs(len1 - len2) / (len1 + len2 + 1)
-    
-    # 计算语义相似度（基于关键词覆盖率）
-    coverage1 = len(common_keywords) / (len(keywords1) + 1)
-    coverage2 = len(common_keywords) / (len(keywords2) + 1)
-    coverage_similarity = (coverage1 + coverage2) / 2
-    
-    # 综合相似度
-    similarity = 0.4 * keyword_similarity + 0.1 * length_similarity + 0.3 * coverage_similarity
-    
-    # 额外加分：如果文本2包含文本1的主要词汇
-    text1_lower = text1.lower()
-    text2_lower = text2.lower()
-    main_words = [word for word in chinese_tokenize(text1) if len(word) > 2]
-    if main_words:
-        main_word_matches = sum(1 for word in main_words if word in text2_lower)
-        if main_word_matches > 0:
-            similarity += 0.1 * (main_word_matches / len(main_words))
-    
-    # 额外加分：如果是文件名匹配
-    filename_lower = filename.lower()
-    if filename:
-        # 检查文件名是否包含文本1的关键词
-        text1_words = chinese_tokenize(text1)
-        filename_matches = sum(1 for word in text1_words if len(word) > 1 and word.lower() in filename_lower)
-        if filename_matches > 0:
-            similarity += 0.2 * (filename_matches / len([w for w in text1_words if len(w) > 1]))
-    
-    # 额外加分：如果文本包含相关的语义词汇
-    semantic_boost = 0.0
-    semantic_groups = CONFIG['semantic_groups']
-    
-    for group in semantic_groups:
-        if any(word in text1_lower for word in group) and any(word in text2_lower for word in group):
-            semantic_boost += 0.15
-            break
-    
-    similarity += semantic_boost
-    
-    # 额外加分：基于语义距离
-    semantic_distance_boost = 0.0
-    # 计算语义距离（简单实现）
-    if len(common_keywords) > 0:
-        semantic_distance_boost = 0.05
-    
-    similarity += semantic_distance_boost
-    
-    # 额外加分：对于特定关键词的匹配
-    # 从配置中获取特定关键词匹配规则
-    specific_keywords = {}
-    for key, value in CONFIG['keywords'].items():
-        if key in ['deploy', 'usage', 'permanent_plugin', 'trigger_plugin', 'bot', 'napcat', 'qq_bot']:
-            specific_keywords[value[0]] = value
-    
-    for base_word, variants in specific_keywords.items():
-        if any(variant in text1_lower for variant in variants) and any(variant in text2_lower for variant in variants):
-            similarity += 0.2  # 提高特定关键词的匹配权重
-            break
-    
-    # 额外加分：专有名词匹配
-    proper_nouns = CONFIG['proper_nouns']
-    proper_noun_matches = sum(1 for noun in proper_nouns if noun.lower() in text1_lower and noun.lower() in text2_lower)
-    if proper_noun_matches > 0:
-        similarity += 0.3 * proper_noun_matches  # 大幅提高专有名词的匹配权重
-    
-    return min(similarity, 1.0)
+TERM_PATTERN = re.compile(r"[\u3400-\u4dbf\u4e00-\u9fff]+|[a-z0-9_]+")
+INDEX_VERSION = 3
+FILENAME_WEIGHT = 3  # 文件名中的词按正文出现 3 次计入词频
+EXPANSION_WEIGHT = 0.5  # 同义词、语义词组扩展出的词的权重
+REFRESH_INTERVAL = 10  # 两次检查知识库文件变化的最小间隔（秒）
+
+def compile_word_pattern(words):
+    """把词表编译成一个正则（长词优先），英文数字词只匹配完整的单词；词表为空时返回 None"""
+    alternatives = []
+    for word in sorted({word.lower() for word in words if word}, key=len, reverse=True):
+        if word.isascii():
+            alternatives.append(r"(?<![a-z0-9_])" + re.escape(word) + r"(?![a-z0-9_])")
+        else:
+            alternatives.append(re.escape(word))
+    return re.compile("|".join(alternatives)) if alternatives else None
+
+STOP_WORDS = set(CONFIG['stop_words'])
+# 停用词在连续汉字中出现时作为断点，不参与组成二元组，如“我的插件”只得到“插件”
+STOP_WORD_SPLITTER = compile_word_pattern(word for word in STOP_WORDS if not word.isascii())
+
+# 每个问题都必须提到应用名才会触发检索，应用名及其同义词对区分文档没有帮助；疑问词同理
+APP_WORDS = set(CONFIG['keywords']['main'])
+for _group in CONFIG['keywords'].values():
+    if any(word.lower() in {main.lower() for main in CONFIG['keywords']['main']} for word in _group):
+        APP_WORDS.update(_group)
+QUERY_NOISE = compile_word_pattern(APP_WORDS | set(CONFIG['question_words']))
+
+def index_terms(text):
+    """把文本切分为索引词：连续汉字按停用词断开后取二元组（单字直接保留），英文数字取整词并过滤停用词"""
+    terms = []
+    for run in TERM_PATTERN.findall(text.lower()):
+        if run[0].isascii():
+            if len(run) > 1 and run not in STOP_WORDS:
+                terms.append(run)
+            continue
+        pieces = STOP_WORD_SPLITTER.split(run) if STOP_WORD_SPLITTER else [run]
+        for piece in pieces:
+            if len(piece) == 1:
+                terms.append(piece)
+            else:
+                terms.extend(piece[i:i + 2] for i in range(len(piece) - 1))
+    return terms
+
+APP_TERMS = set(index_terms(" ".join(APP_WORDS)))
+
+def strip_query_noise(text):
+    """去掉（已转为小写的）问题中的应用名和疑问词"""
+    return QUERY_NOISE.sub(" ", text) if QUERY_NOISE else text
+
+def query_terms(user_input):
+    """返回 {索引词: 权重}
+
+    问题本身的词权重为 1（单字证据较弱，按扩展词计），同义词和语义词组扩展出的词权重较低；
+    应用名及其同义词、疑问词不参与检索。
+    """
+    text_lower = user_input.lower()
+    weights = {term: 1.0 if len(term) > 1 else EXPANSION_WEIGHT for term in index_terms(strip_query_noise(text_lower))}
+    expansions = set(extract_keywords(user_input))
+    for group in CONFIG['semantic_groups']:
+        if any(word in text_lower for word in group):
+            expansions.update(group)
+    for term in index_terms(strip_query_noise(" ".join(expansions).lower())):
+        if term not in APP_TERMS:
+            weights.setdefault(term, EXPANSION_WEIGHT)
+    return weights
+
+class KnowledgeIndex:
+    """知识库倒排索引（BM25）
+
+    每个文档只在新增或修改（按 mtime 和大小判断）时读取并分词一次，词频保存在磁盘上的索引文件中，
+    重启后无需重新读取未修改的文档。查询时只访问问题中出现的词的倒排表。
+    """
+
+    def __init__(self, knowledge_dir, index_path, k1=1.5, b=0.75):
+        self.knowledge_dir = knowledge_dir
+        self.index_path = index_path
+        self.k1 = k1
+        self.b = b
+        self.docs = {}  # 文件名 -> {"mtime_ns", "size", "length", "terms": {词: 词频}}
+        self.postings = {}  # 词 -> {文件名: 词频}
+        self.total_length = 0
+        self.last_refresh = 0.0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def signature():
+        """分词相关配置的摘要，配置改变后需要重建索引"""
+        raw = json.dumps([INDEX_VERSION, FILENAME_WEIGHT, sorted(CONFIG['stop_words'])], ensure_ascii=False)
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    def _add(self, name, doc):
+        self.docs[name] = doc
+        self.total_length += doc["length"]
+        for term, tf in doc["terms"].items():
+            self.postings.setdefault(term, {})[name] = tf
+
+    def _remove(self, name):
+        doc = self.docs.pop(name, None)
+        if doc is None:
+            return
+        self.total_length -= doc["length"]
+        for term in doc["terms"]:
+            posting = self.postings.get(term)
+            if posting is not None:
+                posting.pop(name, None)
+                if not posting:
+                    del self.postings[term]
+
+    def load(self):
+        if not os.path.exists(self.index_path):
+            return
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except Exception as e:
+            print(f"读取知识库索引失败，将重新建立: {e}")
+            return
+        if data.get("signature") != self.signature():
+            print("知识库分词配置已变化，将重新建立索引")
+            return
+        for name, doc in data.get("docs", {}).items():
+            self._add(name, doc)
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.index_path) or ".", exist_ok=True)
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"signature": self.signature(), "docs": self.docs}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.index_path)
+
+    def _index_file(self, name, stat):
+        with open(os.path.join(self.knowledge_dir, name), 'r', encoding='utf-8') as f:
+            content = f.read()
+        terms = Counter(index_terms(content))
+        for term in index_terms(os.path.splitext(name)[0]):
+            terms[term] += FILENAME_WEIGHT
+        return {
+            "mtime_ns": stat.st_mtime_ns,
+            "size": stat.st_size,
+            "length": sum(terms.values()),
+            "terms": dict(terms)
+        }
+
+    def refresh(self, force=False):
+        """按 mtime 增量更新索引：只重新读取新增或修改过的文件，删除已不存在的文件"""
+        with self.lock:
+            now = time.monotonic()
+            if not force and now - self.last_refresh < REFRESH_INTERVAL:
+                return
+            self.last_refresh = now
+            current = {}
+            if os.path.isdir(self.knowledge_dir):
+                with os.scandir(self.knowledge_dir) as entries:
+                    for entry in entries:
+                        if entry.is_file() and entry.name.endswith(".md"):
+                            current[entry.name] = entry.stat()
+
+            changed = False
+            for name in list(self.docs):
+                if name not in current:
+                    self._remove(name)
+                    changed = True
+            for name, stat in current.items():
+                doc = self.docs.get(name)
+                if doc is not None and doc["mtime_ns"] == stat.st_mtime_ns and doc["size"] == stat.st_size:
+                    continue
+                try:
+                    new_doc = self._index_file(name, stat)
+                except Exception as e:
+                    print(f"处理文件 {name} 时出错: {e}")
+                    continue
+                self._remove(name)
+                self._add(name, new_doc)
+                changed = True
+                print(f"知识库索引已更新: {name}")
+
+            if changed:
+                try:
+                    self.save()
+                except Exception as e:
+                    print(f"保存知识库索引失败: {e}")
+
+    def idf(self, term):
+        n = len(self.docs)
+        df = len(self.postings.get(term, ()))
+        return math.log(1 + (n - df + 0.5) / (df + 0.5))
+
+    def search(self, weights):
+        """返回 [(文件名, 相对得分)]，相对得分为 BM25 得分除以问题中权重为 1 的词的最大可能得分
+
+        知识库中没有出现过的词同样计入最大得分，与知识库无关的问题因此得分很低。
+        """
+        with self.lock:
+            if not self.docs:
+                return []
+            avg_length = self.total_length / len(self.docs) or 1
+            scores = Counter()
+            max_score = 0.0
+            for term, weight in weights.items():
+                idf = self.idf(term)
+                if weight >= 1.0:
+                    max_score += idf * (self.k1 + 1)
+                posting = self.postings.get(term)
+                if not posting:
+                    continue
+                for name, tf in posting.items():
+                    norm = self.k1 * (1 - self.b + self.b * self.docs[name]["length"] / avg_length)
+                    scores[name] += weight * idf * tf * (self.k1 + 1) / (tf + norm)
+            if max_score == 0:
+                return []
+            return [(name, min(score / max_score, 1.0)) for name, score in scores.most_common()]
+
+KNOWLEDGE_DIR = "data/knowledge"
+knowledge_indexes = {}  # 知识库目录 -> KnowledgeIndex
+
+def get_knowledge_index(knowledge_dir):
+    """获取知识库目录对应的索引，第一次使用时从磁盘加载并按 mtime 补齐；索引文件与目录同级，如 data/knowledge_index.json"""
+    knowledge_dir = os.path.normpath(knowledge_dir)
+    index = knowledge_indexes.get(knowledge_dir)
+    if index is None:
+        index = KnowledgeIndex(
+            knowledge_dir,
+            knowledge_dir + "_index.json",
+            CONFIG.get('bm25_k1', 1.5),
+            CONFIG.get('bm25_b', 0.75)
+        )
+        index.load()
+        index.refresh(force=True)
+        knowledge_indexes[knowledge_dir] = index
+    return index
+
+# 启动时建立默认知识库的索引
+get_knowledge_index(KNOWLEDGE_DIR)
 
 def search_knowledge_base(knowledge_dir, user_input):
     """在知识库中检索相关信息"""
-    relevant_info = []
-    
-    # 查找所有markdown文件
-    md_files = glob.glob(os.path.join(knowledge_dir, "*.md"))
+    knowledge_index = get_knowledge_index(knowledge_dir)
+    knowledge_index.refresh()
     
-    # 提取用户问题的关键词
-    user_keywords = extract_keywords(user_input)
+    # 从配置中获取相似度阈值和最大结果数
+    threshold = CONFIG['similarity_threshold']
+    max_results = CONFIG['max_results']
     
-    # 对每个文件进行处理
-    for md_file in md_files:
+    relevant_info = []
+    for file_name, similarity in knowledge_index.search(query_terms(user_input)):
+        if similarity <= threshold or len(relevant_info) >= max_results:
+            break
+        
+        # 打印调试信息
+        print(f"文件: {file_name}, 相似度: {similarity}")
+        
+        # 只读取最终命中的文件，直接使用整个文件内容，确保不丢失任何信息
         try:
-            with open(md_file, 'r', encoding='utf-8') as f:
+            with open(os.path.join(knowledge_dir, file_name), 'r', encoding='utf-8') as f:
                 content = f.read()
-                
-                # 提取文件名
-                file_name = os.path.basename(md_file)
-                
-                # 提取文件关键词
-                file_keywords = extract_keywords(content)
-                
-                # 计算文本相似度（使用改进的算法，传递文件名）
-                similarity = calculate_similarity(user_input, content, user_keywords, file_keywords, file_name)
-                
-                # 打印调试信息
-                print(f"文件: {file_name}, 相似度: {similarity}")
-                
-                # 从配置中获取相似度阈值
-                threshold = CONFIG['similarity_threshold']
-                if similarity > threshold:
-                    # 直接使用整个文件内容，确保不丢失任何信息
-                    relevant_info.append({
-                        'file': file_name,
-                        'content': content,
-                        'similarity': similarity
-                    })
         except Exception as e:
-            print(f"处理文件 {os.path.basename(md_file)} 时出错: {e}")
-    
-    # 按相似度排序
-    relevant_info.sort(key=lambda x: x['similarity'], reverse=True)
-    
-    # 从配置中获取最大结果数
-    max_results = CONFIG['max_results']
-    # 从配置中获取相似度阈值
-    threshold = CONFIG['similarity_threshold']
-    
-    # 只返回超过阈值且在最大数量范围内的最相关结果
-    filtered_results = [item for item in relevant_info if item['similarity'] > threshold]
-    return filtered_results[:max_results]
+            print(f"处理文件 {file_name} 时出错: {e}")
+            continue
+        relevant_info.append({
+            'file': file_name,
+            'content': content,
+            'similarity': similarity
+        })
+    
+    return relevant_info
 
 async def generate_reply_with_deepseek(user_input, relevant_info, user_id):
     """使用DeepSeek生成回复"""
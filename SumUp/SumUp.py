@@ -1,9 +1,12 @@
 import asyncio
-import re, os, shutil
+import re, os, time, shutil
+import heapq, hashlib
+from operator import itemgetter
+import json, struct
 import traceback
 from Tools.GoogleAI import Context, Roles, Parts
 from Tools.user_info import get_nickname_by_userid as get_user_nickname
-from collections import defaultdict, deque, Counter
+from collections import defaultdict, deque, Counter, OrderedDict
 import pickle, gc
 from Hyper import Configurator
 Configurator.cm = Configurator.ConfigManager(Configurator.Config(file="config.json").load_from_file())
@@ -34,118 +37,687 @@ client = Context(
     base_url=Configurator.cm.get_cfg().others.get("gemini_base_url", "https://generativelanguage.googleapis.com")
 ) 
 
+HISTORY_LIMIT = 1000  # 每个群保留的历史消息条数
+CHAT_DB_DIR = os.path.join("data", 'sum_up')
+CHAT_LOG_DIR = os.path.join(CHAT_DB_DIR, 'log')
+
+class TokenPrefix:
+    """与 history 同步滚动的 Token 前缀和
+    
+    sums[i] 为该群自启动以来前 i 条消息的累计 Token（只增不减），窗口内的消息对应
+    sums[start:]。history 淘汰最旧消息时只需把 start 后移一位，因此「最近 N 条共多少
+    Token」是 O(1) 的两数相减。
+    """
+    
+    __slots__ = ("limit", "sums", "start")
+    
+    def __init__(self, limit: int = HISTORY_LIMIT):
+        self.limit = limit
+        self.sums = [0]
+        self.start = 0
+    
+    def __len__(self) -> int:
+        return len(self.sums) - 1 - self.start
+    
+    def append(self, tokens: int):
+        self.sums.append(self.sums[-1] + tokens)
+        if len(self) > self.limit:
+            self.start += 1
+            # 已淘汰的前缀积累到一个窗口大小时再整体丢弃，均摊 O(1)
+            if self.start >= self.limit:
+                del self.sums[:self.start]
+                self.start = 0
+    
+    @property
+    def total(self) -> int:
+        return self.sums[-1] - self.sums[self.start]
+    
+    def last(self, n: int) -> int:
+        """最近 n 条消息的 Token 总数"""
+        n = max(0, min(n, len(self)))
+        return self.sums[-1] - self.sums[-1 - n]
+
+# 热词只统计 2-4 个字的完整中文片段，排除数字、英文和其他符号
+HOT_WORD_PATTERN = re.compile(r'(?<![\u4e00-\u9fff])([\u4e00-\u9fff]{2,4})(?![\u4e00-\u9fff])')
+# 常见停用词列表
+STOP_WORDS = {
+    '的', '了', '是', '在', '我', '有', '和', '就', '不', '人', '都', '一', '一个', 
+    '上', '也', '很', '到', '说', '要', '去', '你', '会', '着', '没有', '看', '好', 
+    '自己', '这', '但', '而', '于', '以', '可', '为', '之', '与', '则', '其', '或', 
+    '即', '因', '及', '由', '时', '等', '所', '并', '且', '着', '呢', '吗', '啊', 
+    '吧', '呀', '哦', '恩', '嗯', '哈', '嘿', '嘻', '呗', '哒', '啦', '哟', '呼'
+}
+
+def extract_hot_words(content: str) -> list:
+    """提取一条消息中参与热词统计的词语"""
+    return [word for word in HOT_WORD_PATTERN.findall(content) if word not in STOP_WORDS]
+
+class HotWordIndex:
+    """随 history 增量维护的词频与发言人计数
+    
+    新消息进入时累加，最旧消息被挤出 deque 时扣减，看板只需要从计数里取前 k 个，
+    不再重新扫描整段历史。
+    """
+    
+    __slots__ = ("words", "speakers")
+    
+    def __init__(self):
+        self.words = Counter()
+        self.speakers = Counter()
+    
+    def add(self, msg: dict):
+        self.words.update(extract_hot_words(msg['content']))
+        self.speakers[message_speaker(msg)] += 1
+    
+    def remove(self, msg: dict):
+        for word in extract_hot_words(msg['content']):
+            self._decrement(self.words, word)
+        self._decrement(self.speakers, message_speaker(msg))
+    
+    @staticmethod
+    def _decrement(counter: Counter, key):
+        count = counter[key] - 1
+        if count > 0:
+            counter[key] = count
+        else:
+            del counter[key]
+    
+    def top(self, k: int = 5) -> list:
+        """出现次数最多的 k 个词及其次数"""
+        return heapq.nlargest(k, self.words.items(), key=itemgetter(1))
+
 def default_factory():
     return {
-        "history": deque(maxlen=1000),  
-        "token_counter": 0 
+        "history": deque(maxlen=HISTORY_LIMIT),  
+        "token_counter": 0,
+        "token_prefix": TokenPrefix(HISTORY_LIMIT),
+        "hot_index": HotWordIndex()
     }
 
+class SegmentedChatLog:
+    """按群分段的追加写聊天日志
+    
+    每个群一个目录，每条消息以「4字节长度 + JSON」的记录追加到当前分段文件末尾，
+    分段写满 SEGMENT_RECORDS 条后切换到新分段。较新的分段已经覆盖最近 limit 条消息时，
+    直接删除最旧的分段完成压缩，不需要重写任何文件。
+    """
+    
+    SEGMENT_RECORDS = 250
+    _HEADER = struct.Struct(">I")
+    
+    def __init__(self, root: str, limit: int = HISTORY_LIMIT):
+        self.root = root
+        self.limit = limit
+        self._segments = {}  # 群目录名 -> [[分段编号, 记录数], ...]
+    
+    def _group_dir(self, group_key: str) -> str:
+        return os.path.join(self.root, group_key)
+    
+    def _segment_path(self, group_key: str, number: int) -> str:
+        return os.path.join(self.root, group_key, f"{number:08d}.seg")
+    
+    def _read_segment(self, path: str):
+        """读取分段中的完整记录，返回 (记录列表, 有效字节数)"""
+        with open(path, 'rb') as f:
+            data = f.read()
+        
+        header = self._HEADER
+        records = []
+        offset = 0
+        while offset + header.size <= len(data):
+            (length,) = header.unpack_from(data, offset)
+            end = offset + header.size + length
+            if end > len(data):
+                break
+            try:
+                records.append(json.loads(data[offset + header.size:end].decode('utf-8')))
+            except ValueError:
+                break
+            offset = end
+        return records, offset
+    
+    def load(self) -> dict:
+        """逐个分段读取所有群的日志，返回 {群目录名: 最近 limit 条记录}"""
+        result = {}
+        if not os.path.isdir(self.root):
+            return result
+        
+        for group_key in os.listdir(self.root):
+            group_dir = self._group_dir(group_key)
+            if not os.path.isdir(group_dir):
+                continue
+            
+            numbers = sorted(int(name[:-4]) for name in os.listdir(group_dir)
+                             if name.endswith('.seg') and name[:-4].isdigit())
+            history = deque(maxlen=self.limit)
+            segments = []
+            for number in numbers:
+                path = self._segment_path(group_key, number)
+                records, valid = self._read_segment(path)
+                if valid < os.path.getsize(path):
+                    # 截掉崩溃时写了一半的记录，保证后续追加的数据可读
+                    with open(path, 'r+b') as f:
+                        f.truncate(valid)
+                history.extend(records)
+                segments.append([number, len(records)])
+            
+            self._segments[group_key] = segments
+            result[group_key] = history
+        return result
+    
+    def append(self, group_id, record: dict):
+        """追加一条消息记录"""
+        group_key = str(group_id)
+        segments = self._segments.get(group_key)
+        if segments is None:
+            os.makedirs(self._group_dir(group_key), exist_ok=True)
+            segments = self._segments[group_key] = []
+        
+        rolled = not segments or segments[-1][1] >= self.SEGMENT_RECORDS
+        if rolled:
+            segments.append([segments[-1][0] + 1 if segments else 0, 0])
+        
+        payload = json.dumps(record, ensure_ascii=False).encode('utf-8')
+        with open(self._segment_path(group_key, segments[-1][0]), 'ab') as f:
+            f.write(self._HEADER.pack(len(payload)) + payload)
+        segments[-1][1] += 1
+        
+        if rolled:
+            self._compact(group_key)
+    
+    def rewrite(self, group_id, records):
+        """用给定记录重写一个群的日志（用于迁移旧数据）"""
+        group_key = str(group_id)
+        group_dir = self._group_dir(group_key)
+        os.makedirs(group_dir, exist_ok=True)
+        for name in os.listdir(group_dir):
+            if name.endswith('.seg'):
+                os.remove(os.path.join(group_dir, name))
+        
+        records = list(records)[-self.limit:]
+        segments = []
+        for number, start in enumerate(range(0, len(records), self.SEGMENT_RECORDS)):
+            chunk = records[start:start + self.SEGMENT_RECORDS]
+            with open(self._segment_path(group_key, number), 'wb') as f:
+                for record in chunk:
+                    payload = json.dumps(record, ensure_ascii=False).encode('utf-8')
+                    f.write(self._HEADER.pack(len(payload)) + payload)
+            segments.append([number, len(chunk)])
+        self._segments[group_key] = segments
+    
+    def _compact(self, group_key: str):
+        """删除已经完全超出最近 limit 条范围的旧分段"""
+        segments = self._segments[group_key]
+        while len(segments) > 1 and sum(count for _, count in segments[1:]) >= self.limit:
+            number, _ = segments.pop(0)
+            try:
+                os.remove(self._segment_path(group_key, number))
+            except OSError as e:
+                print(f"SumUp: 删除旧分段失败: {e}")
+
+chat_log = SegmentedChatLog(CHAT_LOG_DIR)
+
+def _group_key(name: str):
+    """群目录名还原为群号（数字群号统一用 int，与事件中的 group_id 一致）"""
+    return int(name) if name.lstrip('-').isdigit() else name
+
+def _migrate_pickle_db(pkl_path: str, chat_db) -> bool:
+    """把旧版 chat_db.pkl 一次性迁移到分段日志，返回是否完成迁移
+
+    先写到临时目录，全部写完后再改名为正式目录，最后把 pkl 改名为 .migrated；
+    中途失败时 pkl 保持原样，下次启动会重新迁移。上次失败后已经写入日志目录的新消息会接在旧记录之后。
+    """
+    with open(pkl_path, 'rb') as f:
+        loaded_db = pickle.load(f)
+    
+    if not isinstance(loaded_db, dict):
+        # 旧格式（直接pickle整个defaultdict）可能因模块名变化无法反序列化
+        # 此处不再直接使用旧对象，改为初始化空库，避免导入错误
+        print("SumUp: 检测到旧格式聊天记录，因插件模块名变化无法安全加载，已跳过并使用新格式初始化")
+        return False
+    
+    migrated = defaultdict(default_factory)
+    for group_id, data in loaded_db.items():
+        restore_history(migrated[_group_key(str(group_id))], data.get("history", []))
+    for name, history in chat_log.load().items():
+        restore_history(migrated[_group_key(name)], history)
+    
+    tmp_dir = CHAT_LOG_DIR + '.migrating'
+    if os.path.isdir(tmp_dir):
+        shutil.rmtree(tmp_dir)  # 上次迁移留下的半成品
+    tmp_log = SegmentedChatLog(tmp_dir)
+    os.makedirs(tmp_dir)
+    for group_id, data in migrated.items():
+        tmp_log.rewrite(group_id, data["history"])
+    
+    if os.path.isdir(CHAT_LOG_DIR):
+        old_dir = CHAT_LOG_DIR + '.old'
+        if os.path.isdir(old_dir):
+            shutil.rmtree(old_dir)
+        os.replace(CHAT_LOG_DIR, old_dir)
+        os.replace(tmp_dir, CHAT_LOG_DIR)
+        shutil.rmtree(old_dir)
+    else:
+        os.replace(tmp_dir, CHAT_LOG_DIR)
+    chat_log._segments = tmp_log._segments
+    chat_db.update(migrated)
+    
+    os.replace(pkl_path, pkl_path + '.migrated')
+    print(f"SumUp: 已将 {len(loaded_db)} 个群聊的历史消息迁移到分段日志")
+    return True
+
+# 估算Token（中文≈1字/Tok，英文≈1词/4字母）
+def estimate_tokens(text: str) -> int:
+    chinese_chars = sum(1 for c in text if '\u4e00' <= c <= '\u9fff')
+    non_chinese = len(text) - chinese_chars
+    return chinese_chars + (non_chinese // 4) + 1
+
+def message_speaker(msg: dict):
+    """消息的发言人标识：群消息记录 user_id，合并转发和旧记录只有昵称"""
+    return msg.get("user_id", msg.get("user"))
+
+def message_label(msg: dict, names: dict = None) -> str:
+    """消息在聊天记录中显示的发言人"""
+    if "user" in msg:
+        return msg["user"]
+    return (names or {}).get(msg["user_id"]) or f"@{msg['user_id']}"
+
+def message_tokens(msg: dict) -> int:
+    """读取消息缓存的 Token 数，旧记录没有缓存时现场估算并补上"""
+    tokens = msg.get("tokens")
+    if tokens is None:
+        tokens = msg["tokens"] = estimate_tokens(f"{message_label(msg)}: {msg['content']}")
+    return tokens
+
+def append_history(group_data: dict, msg: dict):
+    """追加一条消息，同步更新 Token 前缀和与热词计数"""
+    history = group_data["history"]
+    if len(history) == history.maxlen:
+        # 最旧的一条即将被 deque 挤出，先从热词计数中扣除
+        group_data["hot_index"].remove(history[0])
+    history.append(msg)
+    group_data["token_prefix"].append(message_tokens(msg))
+    group_data["hot_index"].add(msg)
+    # token_counter 始终是窗口内消息的Token总数，随淘汰同步减少
+    group_data["token_counter"] = group_data["token_prefix"].total
+
+def restore_history(group_data: dict, records):
+    """用已有的消息记录重建群的 history、Token 前缀和与热词计数"""
+    for msg in records:
+        append_history(group_data, msg)
+
 def load_chat_db():
     """加载聊天数据库，如果文件不存在则创建新的"""
     chat_db = defaultdict(default_factory)
-    pkl_path = os.path.join("data", 'sum_up', 'chat_db.pkl')
+    pkl_path = os.path.join(CHAT_DB_DIR, 'chat_db.pkl')
     
+    # pkl 迁移成功后会被改名，仍然存在说明还没迁移过或上次迁移中途失败
     if os.path.exists(pkl_path) and os.path.getsize(pkl_path) > 0:
         try:
-            with open(pkl_path, 'rb') as f:
-                loaded_db = pickle.load(f)
-                # 兼容新存储格式：纯字典（history 列表，token_counter 整数）
-                if isinstance(loaded_db, dict):
-                    for group_id, data in loaded_db.items():
-                        history_list = data.get("history", [])
-                        token_counter = int(data.get("token_counter", 0))
-                        chat_db[group_id]["history"] = deque(history_list, maxlen=1000)
-                        chat_db[group_id]["token_counter"] = token_counter
-                    print(f"SumUp: 成功加载 {len(loaded_db)} 个群聊，共 {sum(len(data['history']) for data in loaded_db.values())} 条历史消息")
-                else:
-                    # 旧格式（直接pickle整个defaultdict）可能因模块名变化无法反序列化
-                    # 此处不再直接使用旧对象，改为初始化空库，避免导入错误
-                    print("SumUp: 检测到旧格式聊天记录，因插件模块名变化无法安全加载，已跳过并使用新格式初始化")
-        except Exception as e:
-            print(f"SumUp: 加载历史消息失败: {traceback.format_exc}")
-    else:
-        print("SumUp: 未找到历史数据文件，创建新的数据库")
+            if _migrate_pickle_db(pkl_path, chat_db):
+                return chat_db
+        except Exception:
+            print(f"SumUp: 迁移旧聊天记录失败，下次启动时会重试: {traceback.format_exc()}")
+    
+    try:
+        if os.path.isdir(CHAT_LOG_DIR):
+            for name, history in chat_log.load().items():
+                restore_history(chat_db[_group_key(name)], history)
+            print(f"SumUp: 成功加载 {len(chat_db)} 个群聊，共 {sum(len(data['history']) for data in chat_db.values())} 条历史消息")
+        else:
+            print("SumUp: 未找到历史数据文件，创建新的数据库")
+    except Exception as e:
+        print(f"SumUp: 加载历史消息失败: {traceback.format_exc()}")
     
     return chat_db
 
 chat_db = load_chat_db()
 
-# 估算Token（中文≈1字/Tok，英文≈1词/4字母）
-def estimate_tokens(text: str) -> int:
-    chinese_chars = sum(1 for c in text if '\u4e00' <= c <= '\u9fff')
-    non_chinese = len(text) - chinese_chars
-    return chinese_chars + (non_chinese // 4) + 1
-
-def add_message(group_id: str, user: str, content: str, chat_db=chat_db):
-    """添加消息并更新Token计数"""
-    tokens = estimate_tokens(f"{user}: {content}")
-    chat_db[group_id]["history"].append({"user": user, "content": content})
-    chat_db[group_id]["token_counter"] += tokens
+def add_message(group_id: str, user: str, content: str, chat_db=chat_db, user_id=None):
+    """添加消息并更新Token计数
+    
+    传入 user_id 时只记录QQ号，昵称在总结时再通过 nickname_cache 解析。
+    """
+    if user_id is not None:
+        msg = {"user_id": user_id, "content": content}
+    else:
+        msg = {"user": user, "content": content}
+    msg["tokens"] = estimate_tokens(f"{message_label(msg)}: {content}")
+    append_history(chat_db[group_id], msg)
     return chat_db
 
-def max_summarizable_msgs(group_id: str, max_tokens=800000) -> int:
-    """计算当前群聊最多可总结的消息条数"""
-    history = chat_db[group_id]["history"]
-    total_tokens = 0
-    count = 0
-    # 从最新消息向前回溯，直到Token超限
-    for msg in reversed(history):
-        msg_tokens = estimate_tokens(f"{msg['user']}: {msg['content']}")
-        if total_tokens + msg_tokens > max_tokens:
+NICKNAME_TTL = 6 * 3600  # 昵称缓存有效期（秒）
+NICKNAME_CACHE_SIZE = 5000  # 昵称缓存条数上限
+NICKNAME_LOOKUP_CONCURRENCY = 8  # 缓存未命中时同时查询昵称的用户数
+NICKNAME_WARMUP = Configurator.cm.get_cfg().others.get("sumup_nickname_warmup", False)  # 群内首条消息时预拉群成员列表
+
+class NicknameCache:
+    """(群号, QQ号) -> 显示名 的 TTL + LRU 缓存"""
+    
+    def __init__(self, ttl: float = NICKNAME_TTL, max_size: int = NICKNAME_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._data = OrderedDict()
+        self.warmed = {}  # 群号 -> 上次拉取群成员列表的时间
+    
+    def get(self, group_id, user_id):
+        key = (group_id, user_id)
+        item = self._data.get(key)
+        if item is None:
+            return None
+        name, expires = item
+        if expires < time.time():
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return name
+    
+    def put(self, group_id, user_id, name: str):
+        key = (group_id, user_id)
+        self._data[key] = (name, time.time() + self.ttl)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+    
+    def invalidate(self, group_id, user_id=None):
+        if user_id is None:
+            for key in [key for key in self._data if key[0] == group_id]:
+                del self._data[key]
+            self.warmed.pop(group_id, None)
+        else:
+            self._data.pop((group_id, user_id), None)
+    
+    def needs_warm_up(self, group_id) -> bool:
+        return time.time() - self.warmed.get(group_id, 0) > self.ttl
+
+nickname_cache = NicknameCache()
+
+def display_name(info: dict) -> str:
+    """群名片优先，没有则用QQ昵称"""
+    return f"@{info.get('card') or info.get('nickname') or info.get('user_id', '')}"
+
+async def warm_up_nicknames(group_id, Manager, actions):
+    """一次拉取整个群成员列表填充昵称缓存"""
+    nickname_cache.warmed[group_id] = time.time()
+    try:
+        members = Manager.Ret.fetch(await actions.custom.get_group_member_list(group_id=group_id)).data.raw
+        for member in members:
+            if member.get('user_id'):
+                nickname_cache.put(group_id, member['user_id'], display_name(member))
+        print(f"SumUp: 已缓存群 {group_id} 的 {len(members)} 个成员昵称")
+    except Exception as e:
+        print(f"SumUp: 获取群 {group_id} 成员列表失败: {e}")
+
+async def resolve_nicknames(group_id, messages, Manager, actions) -> dict:
+    """解析消息中所有 user_id 的显示名，优先走缓存，未命中时先整群预热再逐个查询"""
+    user_ids = {msg["user_id"] for msg in messages if "user_id" in msg}
+    names = {}
+    for _ in range(2):
+        missing = []
+        for user_id in user_ids:
+            name = nickname_cache.get(group_id, user_id)
+            if name is None:
+                missing.append(user_id)
+            else:
+                names[user_id] = name
+        if not missing or not nickname_cache.needs_warm_up(group_id):
             break
-        total_tokens += msg_tokens
-        count += 1
-    return count
+        await warm_up_nicknames(group_id, Manager, actions)
+        user_ids = missing
+    
+    # 已退群等不在成员列表中的用户单独查询，并发数受限
+    semaphore = asyncio.Semaphore(NICKNAME_LOOKUP_CONCURRENCY)
+    
+    async def lookup(user_id):
+        async with semaphore:
+            try:
+                name = await get_user_nickname(user_id, Manager, actions)
+            except Exception as e:
+                print(f"SumUp: 查询用户 {user_id} 昵称失败: {e}")
+                return
+        nickname_cache.put(group_id, user_id, name)
+        names[user_id] = name
+    
+    await asyncio.gather(*(lookup(user_id) for user_id in missing))
+    return names
 
-def handle_summary_request(group_id: str, match, chat_db=chat_db):
-    """处理用户总结请求（如：'总结以上100条消息'）"""
+SUMMARY_STREAM_MODE = Configurator.cm.get_cfg().others.get("sumup_stream_mode", "off")  # off / append / replace
+STREAM_INTERVAL = 3  # 流式推送部分总结的最小间隔（秒）
+MAX_CONCURRENT_SUMMARIES = 2  # 同时进行的总结任务上限
+summary_semaphore = asyncio.Semaphore(MAX_CONCURRENT_SUMMARIES)
+SINGLE_SHOT_TOKENS = 120000  # 不超过该Token数时直接一次性总结，否则分段总结再合并
+CHUNK_TOKENS = 60000  # 分段总结时每段的Token预算
+MAP_CONCURRENCY = 4  # 分段总结时同时请求的段数上限
+CHUNK_CACHE_SIZE = 256  # 分段摘要缓存条数
+chunk_summary_cache = OrderedDict()  # 内容哈希 -> 分段摘要
+
+async def stream_gen_content(prompt: str, on_chunk=None) -> str:
+    """在工作线程中流式调用 Gemini，事件循环只负责接收分块
+    
+    gen_content 是同步阻塞的生成器，直接在 on_message 里迭代会卡住整个机器人，
+    这里放到默认线程池中执行，每收到一块就通过 call_soon_threadsafe 送回事件循环，
+    on_chunk 会收到截至目前的完整文本。
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    finished = object()
+    
+    def worker():
+        try:
+            user_content = Roles.User(Parts.Text(prompt))
+            for response_chunk, _ in client.gen_content(user_content, model_override="gemini-2.0-flash", stream=True):
+                loop.call_soon_threadsafe(queue.put_nowait, response_chunk)
+        except Exception as e:
+            loop.call_soon_threadsafe(queue.put_nowait, e)
+        finally:
+            loop.call_soon_threadsafe(queue.put_nowait, finished)
+    
+    future = loop.run_in_executor(None, worker)
+    full_response = ""
     try:
-        n = int(match.group(1))
-        if n <= 0 or n > 1000:
-            return "❌ 命令格式错误！请用：'总结以上N条消息' (0<N<=1000)"
+        while True:
+            item = await queue.get()
+            if item is finished:
+                break
+            if isinstance(item, Exception):
+                raise item
+            full_response += item
+            if on_chunk:
+                try:
+                    await on_chunk(full_response)
+                except Exception as e:
+                    print(f"SumUp: 推送部分总结失败: {e}")
+    finally:
+        await future
+    return full_response
+
+class PartialSummarySender:
+    """把流式生成中的部分总结推送到群里
+    
+    append 模式只发送新增的文本；replace 模式撤回上一条部分结果后发送完整的最新文本，
+    用来模拟「编辑消息」。两次推送之间至少间隔 STREAM_INTERVAL 秒，避免刷屏。
+    """
+    
+    def __init__(self, actions, Manager, Segments, group_id, mode: str = SUMMARY_STREAM_MODE):
+        self.actions = actions
+        self.Manager = Manager
+        self.Segments = Segments
+        self.group_id = group_id
+        self.mode = mode
+        self.sent_len = 0
+        self.last_message_id = None
+        self.last_push = 0.0
+    
+    @property
+    def delivered(self) -> bool:
+        return self.sent_len > 0
+    
+    async def push(self, text: str, final: bool = False):
+        now = asyncio.get_running_loop().time()
+        if not final and now - self.last_push < STREAM_INTERVAL:
+            return
+        delta = text[self.sent_len:]
+        if not delta.strip():
+            return
+        self.last_push = now
         
-        total_tokens = sum(estimate_tokens(f"{msg['user']}: {msg['content']}") 
-                        for msg in list(chat_db[group_id]["history"])[-n:])
-        max_tokens = 800000  # Gemini 模型的 token 限制，预留缓冲
-        if total_tokens > max_tokens:
-            max_n = max_summarizable_msgs(group_id, max_tokens)
-            return f"⚠️ 消息过长（{total_tokens} Tokens > 上限{max_tokens}）\n最多可总结{max_n}条消息"
+        if self.mode == "append":
+            await self.actions.send(group_id=self.group_id, message=self.Manager.Message(self.Segments.Text(delta)))
+        else:
+            await self.retract()
+            ret = await self.actions.send(group_id=self.group_id, message=self.Manager.Message(self.Segments.Text(f"{text}\n……")))
+            self.last_message_id = ret.data.message_id
+        self.sent_len = len(text)
+    
+    async def retract(self):
+        """撤回 replace 模式下的上一条部分结果"""
+        if self.last_message_id is None:
+            return
+        try:
+            await self.actions.del_message(self.last_message_id)
+        except Exception as e:
+            print(f"SumUp: 撤回部分总结失败: {e}")
+        self.last_message_id = None
+
+SUMMARY_REQUIREMENTS = '''### 总结要求：
+1. 用紧凑的格式呈现，详细但少于{max_chars}个汉字
+2. 关键点或关键决策点需加粗
+3. 标注提出重要意见的成员
+4. 如果有，请列出未解决的问题
+5. 总结后给出建议或方案
+6. 尽量不要使用 Markdown 格式'''
+
+def format_messages(messages, names: dict = None) -> str:
+    return "\n".join(f"{message_label(msg, names)}: {msg['content']}" for msg in messages)
+
+def build_summary_prompt(messages: str, max_tokens: int = 800000) -> str:
+    """一次性总结整段聊天记录的提示词"""
+    return f'''请根据以下群聊记录生成摘要：
         
-        if len(list(chat_db[group_id]["history"])) < 5:
-            return "⚠️ 消息过少（少于 5 条消息）"
+### 聊天记录：
+{messages}
         
-        messages = "\n".join(f"{msg['user']}: {msg['content']}" for msg in list(chat_db[group_id]["history"])[-n:])
-        prompt = f'''请根据以下群聊记录生成摘要：
+{SUMMARY_REQUIREMENTS.format(max_chars=max_tokens // 10)}'''
+
+def build_chunk_prompt(messages: str, index: int, total: int) -> str:
+    """分段总结（map）阶段的提示词"""
+    return f'''以下是一段群聊记录（第{index}段，共{total}段），请按时间顺序提炼其中的要点：
         
 ### 聊天记录：
 {messages}
         
-### 总结要求：
-1. 用紧凑的格式呈现，详细但少于{max_tokens // 10}个汉字
-2. 关键点或关键决策点需加粗
-3. 标注提出重要意见的成员
-4. 如果有，请列出未解决的问题
-5. 总结后给出建议或方案
-6. 尽量不要使用 Markdown 格式'''
+### 要求：
+1. 保留关键事件、决策、分歧和未解决的问题
+2. 标注提出重要意见的成员
+3. 只输出要点，不要给出建议，不要使用 Markdown 格式'''
+
+def build_reduce_prompt(summaries: list, final: bool) -> str:
+    """合并分段摘要（reduce）阶段的提示词"""
+    parts = "\n\n".join(f"【第{i}段】\n{summary}" for i, summary in enumerate(summaries, 1))
+    if not final:
+        return f'''以下是按时间顺序排列的若干段群聊要点，请合并为一份更紧凑的要点，保留关键事件、决策、成员和未解决的问题，不要使用 Markdown 格式：
 
-        # 使用 GoogleAI 的 gen_content 方法
-        user_content = Roles.User(Parts.Text(prompt))
-        response_generator = client.gen_content(user_content, model_override="gemini-2.0-flash", stream=False)
+{parts}'''
+    return f'''以下是按时间顺序排列的各段群聊要点，请据此生成整段群聊的摘要：
         
-        # 收集所有响应内容
-        full_response = ""
-        for response_chunk, _ in response_generator:
-            full_response += response_chunk
+### 各段要点：
+{parts}
         
-        return full_response
+{SUMMARY_REQUIREMENTS.format(max_chars=CHUNK_TOKENS // 10)}'''
+
+def split_chunks(group_data: dict, n: int, budget: int = None) -> list:
+    """把最近 n 条消息按Token预算切分成若干段
+    
+    段边界取自累计Token（TokenPrefix）落在哪个 budget 区间，而不是从窗口起点开始计数，
+    所以窗口前后滑动时，中间各段的内容保持不变，可以直接命中分段摘要缓存。
+    """
+    budget = budget or CHUNK_TOKENS
+    history = list(group_data["history"])[-n:]
+    sums = group_data["token_prefix"].sums[-len(history) - 1:]
+    chunks, current, bucket = [], [], None
+    for i, msg in enumerate(history):
+        msg_bucket = sums[i] // budget
+        if current and msg_bucket != bucket:
+            chunks.append(current)
+            current = []
+        bucket = msg_bucket
+        current.append(msg)
+    if current:
+        chunks.append(current)
+    return chunks
+
+async def cached_gen_content(prompt: str, cache_key: str) -> str:
+    """带内容哈希缓存的非流式生成，供 map / 中间 reduce 阶段使用"""
+    key = hashlib.sha1(cache_key.encode("utf-8")).hexdigest()
+    summary = chunk_summary_cache.get(key)
+    if summary is not None:
+        chunk_summary_cache.move_to_end(key)
+        return summary
+    
+    summary = await stream_gen_content(prompt)
+    chunk_summary_cache[key] = summary
+    if len(chunk_summary_cache) > CHUNK_CACHE_SIZE:
+        chunk_summary_cache.popitem(last=False)
+    return summary
+
+async def map_reduce_summary(group_data: dict, n: int, on_partial=None, names: dict = None) -> str:
+    """分段并发总结后再合并，用于超长历史和大型合并转发记录"""
+    chunks = split_chunks(group_data, n)
+    pool = asyncio.Semaphore(MAP_CONCURRENCY)
+    
+    async def summarize(prompt: str, cache_key: str) -> str:
+        async with pool:
+            return await cached_gen_content(prompt, cache_key)
+    
+    texts = [format_messages(chunk, names) for chunk in chunks]
+    summaries = await asyncio.gather(*(
+        summarize(build_chunk_prompt(text, i, len(texts)), "map\n" + text)
+        for i, text in enumerate(texts, 1)
+    ))
+    print(f"SumUp: 分段总结完成，共 {len(chunks)} 段")
+    
+    # 分段摘要合起来仍然超出预算时，继续分组合并，直到能放进一次请求
+    while len(summaries) > 1 and sum(estimate_tokens(summary) for summary in summaries) > CHUNK_TOKENS:
+        groups, current, current_tokens = [], [], 0
+        for summary in summaries:
+            tokens = estimate_tokens(summary)
+            if current and current_tokens + tokens > CHUNK_TOKENS:
+                groups.append(current)
+                current, current_tokens = [], 0
+            current.append(summary)
+            current_tokens += tokens
+        groups.append(current)
+        if len(groups) == len(summaries):
+            break
+        summaries = await asyncio.gather(*(
+            summarize(build_reduce_prompt(group, final=False), "reduce\n" + "\n\n".join(group))
+            for group in groups
+        ))
+    
+    return await stream_gen_content(build_reduce_prompt(summaries, final=True), on_partial)
+
+async def handle_summary_request(group_id: str, match, chat_db=chat_db, on_partial=None, names: dict = None):
+    """处理用户总结请求（如：'总结以上100条消息'）"""
+    try:
+        n = int(match.group(1))
+        if n <= 0 or n > 1000:
+            return "❌ 命令格式错误！请用：'总结以上N条消息' (0<N<=1000)"
+        
+        group_data = chat_db[group_id]
+        if len(group_data["history"]) < 5:
+            return "⚠️ 消息过少（少于 5 条消息）"
+        
+        # 生成在工作线程中进行，不阻塞事件循环
+        async with summary_semaphore:
+            if group_data["token_prefix"].last(n) <= SINGLE_SHOT_TOKENS:
+                messages = format_messages(list(group_data["history"])[-n:], names)
+                return await stream_gen_content(build_summary_prompt(messages), on_partial)
+            return await map_reduce_summary(group_data, n, on_partial, names)
     except Exception as e:
         return f"❌ 总结时发生异常：\n{e}"
 
 async def handle_node_messages(data: dict):
-    temp_db = defaultdict(lambda: {
-        "history": deque(maxlen=1000),  
-        "token_counter": 0 
-    })
+    temp_db = defaultdict(default_factory)
     
     print(f"SumUp: 开始处理 {data}")
     framework_response = await ws_custom_api("get_version_info", {})
@@ -251,60 +823,6 @@ async def handle_node_messages(data: dict):
     print(f"SumUp: 处理完成，共收集 {len(temp_db[0]['history'])} 条消息")
     return temp_db
 
-def calculate_hot_words(messages, min_count=1, max_words=5, recursion_depth=0):
-    """计算热词排行
-    
-    Args:
-        messages: 消息列表，每个元素是字典包含'content'键
-        min_count: 最小出现次数
-        max_words: 最多返回的热词数量
-        recursion_depth: 当前递归深度（用于防止无限递归）
-        
-    Returns:
-        list: 热词列表，按出现次数排序
-    """
-    # 设置递归深度限制，防止无限递归
-    if recursion_depth > 20:
-        return []
-    
-    # 使用正则提取中文单词（只提取中文，且长度在2-4个字符之间）
-    all_words = []
-    # 常见停用词列表
-    stop_words = {
-        '的', '了', '是', '在', '我', '有', '和', '就', '不', '人', '都', '一', '一个', 
-        '上', '也', '很', '到', '说', '要', '去', '你', '会', '着', '没有', '看', '好', 
-        '自己', '这', '但', '而', '于', '以', '可', '为', '之', '与', '则', '其', '或', 
-        '即', '因', '及', '由', '时', '等', '所', '并', '且', '着', '呢', '吗', '啊', 
-        '吧', '呀', '哦', '恩', '嗯', '哈', '嘿', '嘻', '呗', '哒', '啦', '哟', '呼'
-    }
-    
-    for msg in messages:
-        # 只提取中文字符，排除数字、英文和其他符号
-        # 使用lookbehind和lookahead来确保我们提取的是完整的中文词语
-        words = re.findall(r'(?<![\u4e00-\u9fff])([\u4e00-\u9fff]{2,4})(?![\u4e00-\u9fff])', msg['content'])
-        # 过滤掉停用词
-        filtered_words = [word for word in words if word not in stop_words]
-        all_words.extend(filtered_words)
-    
-    # 统计词频
-    word_count = Counter(all_words)
-    
-    # 如果热词不足3个，降低标准
-    if len([w for w, c in word_count.items() if c >= min_count]) < 3 and min_count > 1:
-        min_count -= 1
-        return calculate_hot_words(messages, min_count, max_words, recursion_depth + 1)
-    
-    # 按词频排序，取前max_words个
-    hot_words = [word for word, _ in word_count.most_common(max_words) if _ >= min_count]
-    
-    # 确保至少有3个热词（使用迭代方式，避免递归）
-    current_min_count = min_count
-    while len(hot_words) < 3 and current_min_count > 1:
-        current_min_count -= 1
-        hot_words = [word for word, _ in word_count.most_common(max_words) if _ >= current_min_count]
-    
-    return hot_words
-
 def generate_chat_summary(group_id, chat_db=chat_db):
     """生成单个群的聊天数据看板
     
@@ -318,24 +836,15 @@ def generate_chat_summary(group_id, chat_db=chat_db):
     if group_id not in chat_db:
         return f"群：{group_id}\n消息总数：0\n发言人数：0\n热词排行：暂无数据"
     
-    # 获取群聊数据
+    # 获取群聊数据，发言人数和热词直接取增量维护的计数
     group_data = chat_db[group_id]
-    messages = list(group_data['history'])
-    message_count = len(messages)
-    
-    # 计算发言人数
-    speakers = set(msg['user'] for msg in messages)
-    speaker_count = len(speakers)
+    hot_index = group_data['hot_index']
+    message_count = len(group_data['history'])
+    speaker_count = len(hot_index.speakers)
     
     # 计算热词排行
     if message_count > 0:
-        # 先尝试使用默认标准获取热词
-        hot_words = calculate_hot_words(messages, 1, 5)
-        
-        # 确保热词数量符合要求（3-5个）
-        if len(hot_words) < 3:
-            # 如果热词不足3个，尝试使用更低的标准
-            hot_words = calculate_hot_words(messages, 0, 5)
+        hot_words = [word for word, _ in hot_index.top(5)]
         
         # 格式化热词排行
         hot_words_str = '；'.join(hot_words) if hot_words else "暂无足够热词"
@@ -369,8 +878,28 @@ def generate_chat_summary(group_id, chat_db=chat_db):
 #     else:
 #         return str(uid)
     
+async def send_summary(event, actions, Manager, Segments, bot_name, message: str):
+    """发送完整总结，较长的内容以合并转发的形式发送"""
+    if len(message) < 400:
+        await actions.send(group_id=event.group_id, message=Manager.Message(Segments.Reply(event.message_id), Segments.Text(message)))
+    else:
+        await actions.send_group_forward_msg(
+            group_id=event.group_id,
+            message=Manager.Message(Segments.CustomNode(
+                                    str(event.self_id),
+                                    bot_name,
+                                    Manager.Message(Segments.Text(message))
+                )
+            )
+        )
+
 async def on_message(event, actions, Manager, Events, Segments, bot_name, gen_message, ADMINS, CONFUSED_WORD):
     global chat_db
+    raw = getattr(event, "data", None)
+    if isinstance(raw, dict) and raw.get("notice_type") == "group_card":
+        # 群名片变更通知，丢弃该成员的昵称缓存
+        nickname_cache.invalidate(raw.get("group_id"), raw.get("user_id"))
+        return None
     if not isinstance(event, Events.GroupMessageEvent):
         return None
     
@@ -408,6 +937,10 @@ async def on_message(event, actions, Manager, Events, Segments, bot_name, gen_me
     match = re.search(r"总结(?:以上|最近)?(\d+)(?:条|个)?消息", user_message)
     if match and user_message.startswith(Configurator.cm.get_cfg().others["reminder"]):
         selfID = await actions.send(group_id=event.group_id, message=Manager.Message(Segments.Text(f"请等待，{bot_name} 正在总结消息......φ(゜▽゜*)♪")))
+        sender = None
+        if SUMMARY_STREAM_MODE in ("append", "replace"):
+            sender = PartialSummarySender(actions, Manager, Segments, event.group_id)
+        on_partial = sender.push if sender else None
         if isinstance(event.message[0], Segments.Reply):
             content = await actions.get_msg(event.message[0].id)
             msg = gen_message({"message": content.data["message"]})
@@ -415,61 +948,48 @@ async def on_message(event, actions, Manager, Events, Segments, bot_name, gen_me
                 if isinstance(i, Segments.Forward):
                     data = Manager.Ret.fetch(await actions.custom.get_forward_msg(id=i.id)).data.raw
                     node_messages = await handle_node_messages(data)
-                    message = handle_summary_request(0, match, node_messages)
+                    message = await handle_summary_request(0, match, node_messages, on_partial)
                     break
                 
             if not message:
                 message = "❌ 未找到转发的消息！\n请确保引用消息的是一条聊天记录，并确保消聊天记录中包含需要总结的消息"
         else:
-            message = handle_summary_request(event.group_id, match)
+            # 只解析本次要总结的最近 n 条消息中的发言人
+            n = int(match.group(1))
+            recent = list(chat_db[event.group_id]["history"])[-n:] if 0 < n <= 1000 else []
+            names = await resolve_nicknames(event.group_id, recent, Manager, actions)
+            message = await handle_summary_request(event.group_id, match, on_partial=on_partial, names=names)
             
-        if len(message) < 400:
-            await actions.send(group_id=event.group_id, message=Manager.Message(Segments.Reply(event.message_id), Segments.Text(message)))
+        if sender and sender.delivered and not message.startswith("❌") and sender.mode == "append":
+            # 部分结果已经逐段发出，只补发剩余的尾部
+            await sender.push(message, final=True)
         else:
-            await actions.send_group_forward_msg(
-                group_id=event.group_id,
-                message=Manager.Message(Segments.CustomNode(
-                                        str(event.self_id),
-                                        bot_name,
-                                        Manager.Message(Segments.Text(message))
-                    )
-                )
-            )
+            if sender:
+                await sender.retract()
+            await send_summary(event, actions, Manager, Segments, bot_name, message)
         await actions.del_message(selfID.data.message_id)
         return True
     else:
         if event.group_id not in chat_db:
             print(f"SumUp: 群组 {event.group_id} 不存在于`chat_db`中，将初始化")
             
-        nike = await get_user_nickname(event.user_id, Manager, actions)
-        chat_db = add_message(event.group_id, nike, user_message)
+        # 消息自带发送者信息，顺手刷新昵称缓存，不再为每条消息单独请求昵称
+        sender = getattr(event, "sender", None)
+        card, nickname = getattr(sender, "card", None), getattr(sender, "nickname", None)
+        if card or nickname:
+            nickname_cache.put(event.group_id, event.user_id, display_name({"card": card, "nickname": nickname}))
+        if NICKNAME_WARMUP and nickname_cache.needs_warm_up(event.group_id):
+            nickname_cache.warmed[event.group_id] = time.time()
+            asyncio.create_task(warm_up_nicknames(event.group_id, Manager, actions))
+        chat_db = add_message(event.group_id, None, user_message, user_id=event.user_id)
         
         # 调试日志：显示添加后的状态
-        print(f"SumUp: 添加ID为 {event.user_id} 的用户 {nike} 的信息到数据库，现有 {len(chat_db[event.group_id]['history'])} 条消息")
+        print(f"SumUp: 添加ID为 {event.user_id} 的用户的信息到数据库，现有 {len(chat_db[event.group_id]['history'])} 条消息")
         
         try:
-            os.makedirs(os.path.join("data", 'sum_up'), exist_ok=True)
-            pkl_path = os.path.join("data", 'sum_up', 'chat_db.pkl')
-            backup_path = pkl_path + '.backup'
-            # 备份旧文件
-            try:
-                if os.path.exists(pkl_path):
-                    shutil.copy2(pkl_path, backup_path)
-            except Exception as be:
-                print(f"SumUp: 备份旧聊天记录失败: {be}")
-            # 以稳定格式保存：纯字典（避免default_factory导致的模块引用）
-            serializable = {}
-            for gid, data in chat_db.items():
-                serializable[str(gid)] = {
-                    "history": list(data["history"]),
-                    "token_counter": int(data["token_counter"])
-                }
-            with open(pkl_path, 'wb') as f:
-                pickle.dump(serializable, f)
+            # 只追加这一条消息，不再重写整个数据库
+            chat_log.append(event.group_id, chat_db[event.group_id]["history"][-1])
         except Exception as e:
             print(f"SumUp: 保存聊天记录失败: {e}")
             
         return None
-    
-# 初始化时确保数据目录存在
-os.makedirs(os.path.join("data", 'sum_up'), exist_ok=True)
\ No newline at end of file
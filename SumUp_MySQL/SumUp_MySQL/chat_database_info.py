@@ -1,8 +1,13 @@
 import pymysql
 import json
 import os
+import time
+import asyncio
+from contextlib import contextmanager
 from decimal import Decimal # 导入 Decimal 类型
 
+STATS_TTL = 60  # 估算统计结果的缓存时间（秒）
+
 def load_mysql_config(config_path=os.path.join(os.path.dirname(__file__), "mysql.json")):
     try:
         with open(config_path, 'r', encoding='utf-8') as f:
@@ -101,15 +106,47 @@ def get_database_charset_and_engine(conn, database_name):
         print(f"获取数据库 '{database_name}' 字符集和排序规则时发生错误: {e}")
         return None
 
-def get_database_stats():
+@contextmanager
+def _own_connection(config):
+    """没有提供连接池时，临时建立一个连接"""
+    conn = create_connection(config)
+    try:
+        yield conn
+    finally:
+        if conn:
+            conn.close()
+
+def get_exact_table_counts(connection_factory=None) -> dict:
+    """逐表执行 SELECT COUNT(*)，大表上可能耗时数秒，只应在后台调用"""
     config = load_mysql_config()
     if not config:
-        return "错误: 无法加载数据库配置文件"
-    conn = create_connection(config)
-    if not conn:
-        return "错误: 数据库连接失败"
-    
+        return {}
     database_name = config.get('database', 'jianer_chat_db')
+    with (connection_factory or (lambda: _own_connection(config)))() as conn:
+        if not conn:
+            return {}
+        counts = {}
+        for table in get_all_tables_info(conn, database_name):
+            table_name = table.get('TABLE_NAME')
+            if table_name:
+                counts[table_name] = get_exact_table_count(conn, table_name)
+        return counts
+
+def get_database_stats(connection_factory=None, exact_counts=None):
+    """生成数据库统计信息
+
+    记录数默认使用 information_schema 中的估计值；exact_counts 为后台统计好的
+    {表名: 精确记录数}，没有时精确记录数一列显示「未统计」。
+    """
+    config = load_mysql_config()
+    if not config:
+        return "错误: 无法加载数据库配置文件"
+    with (connection_factory or (lambda: _own_connection(config)))() as conn:
+        if not conn:
+            return "错误: 数据库连接失败"
+        return _format_database_stats(conn, config.get('database', 'jianer_chat_db'), exact_counts or {})
+
+def _format_database_stats(conn, database_name, exact_counts):
     result_lines = []
     
     try:
@@ -163,9 +200,9 @@ def get_database_stats():
 
             engine = table.get('ENGINE', '未知') 
             
-            exact_count = get_exact_table_count(conn, table_name)
+            exact_count = exact_counts.get(table_name)
 
-            row_line = f"{table_name:<30} {estimated_rows:<15} {exact_count if exact_count is not None else 'N/A':<15} {data_size:<12.2f} {index_size:<12.2f} {engine:<10}"
+            row_line = f"{table_name:<30} {estimated_rows:<15} {exact_count if exact_count is not None else '未统计':<15} {data_size:<12.2f} {index_size:<12.2f} {engine:<10}"
             result_lines.append(row_line)
             
             total_rows_estimated += estimated_rows
@@ -177,7 +214,7 @@ def get_database_stats():
             total_index_size += index_size
         
         result_lines.append("-" * 20)
-        total_line = f"{'总计':<30} {total_rows_estimated:<15} {total_rows_exact if total_rows_exact is not None else 'N/A':<15} {total_data_size:<12.2f} {total_index_size:<12.2f}"
+        total_line = f"{'总计':<30} {total_rows_estimated:<15} {total_rows_exact if exact_counts else '未统计':<15} {total_data_size:<12.2f} {total_index_size:<12.2f}"
         result_lines.append(total_line)
         result_lines.append("=" * 20)
         result_lines.append("\n空间使用分析:")
@@ -209,7 +246,49 @@ def get_database_stats():
     except Exception as e:
         print(f"在get_database_stats中发生意外错误: {e}")
         return f"错误: 在获取数据库统计信息时发生意外错误: {e}"
-    finally:
-        if conn:
-            conn.close()
+
+class DatabaseStatsCollector:
+    """异步的数据库统计信息收集器
+
+    统计在线程池中执行，不阻塞事件循环；估算结果缓存 STATS_TTL 秒，
+    精确记录数只在明确请求时由后台任务统计，完成后并入之后的报告。
+    """
+
+    def __init__(self, connection_factory=None, ttl: float = STATS_TTL):
+        self.connection_factory = connection_factory
+        self.ttl = ttl
+        self.exact_counts = {}
+        self.exact_time = None
+        self._report = None
+        self._report_time = 0.0
+        self._exact_task = None
+
+    async def get_report(self, force: bool = False) -> str:
+        if not force and self._report is not None and time.time() - self._report_time < self.ttl:
+            return self._report
+        report = await asyncio.get_running_loop().run_in_executor(
+            None, get_database_stats, self.connection_factory, self.exact_counts
+        )
+        if self.exact_time is not None:
+            report += f"\n精确记录数统计于: {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.exact_time))}"
+        if not report.startswith("错误"):
+            self._report, self._report_time = report, time.time()
+        return report
+
+    @property
+    def exact_running(self) -> bool:
+        return self._exact_task is not None and not self._exact_task.done()
+
+    def start_exact_counts(self):
+        """启动后台精确统计，已有统计在进行时返回正在进行的任务"""
+        if not self.exact_running:
+            self._exact_task = asyncio.ensure_future(self._count_exact())
+        return self._exact_task
+
+    async def _count_exact(self):
+        counts = await asyncio.get_running_loop().run_in_executor(None, get_exact_table_counts, self.connection_factory)
+        if counts:
+            self.exact_counts = counts
+            self.exact_time = time.time()
+            self._report = None
 
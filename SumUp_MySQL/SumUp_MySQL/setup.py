@@ -8,16 +8,19 @@ from Hyper import Configurator
 Configurator.cm = Configurator.ConfigManager(Configurator.Config(file="config.json").load_from_file())
 from Hyper import Events
 from Tools.websocket_message import ws_custom_api
-from plugins.SumUp_MySQL.chat_database_info import get_database_stats
+from plugins.SumUp_MySQL.chat_database_info import DatabaseStatsCollector
 # 导入 PyMySQL 库和 contextlib 用于连接管理
 import pymysql
 from contextlib import contextmanager
-import json
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, date, timedelta
+import json, queue, atexit, threading, time
 
 TRIGGHT_KEYWORD = "Any"
 HELP_MESSAGE = f'''{Configurator.cm.get_cfg().others["reminder"]}总结以上N条消息 —> 总结当前群聊的指定数量的消息 (0<N<=1000)
 {Configurator.cm.get_cfg().others["reminder"]}聊天数据看板 —> 展示当前(或全部)群聊的聊天数据看板
-{Configurator.cm.get_cfg().others["reminder"]}查看数据库状态 —> 展示当前聊天数据库的状态'''
+{Configurator.cm.get_cfg().others["reminder"]}查看数据库状态 —> 展示当前聊天数据库的状态
+{Configurator.cm.get_cfg().others["reminder"]}查看数据库状态 精确 —> 在后台统计各表的精确记录数'''
 
 client = Context(
     api_key=Configurator.cm.get_cfg().others["gemini_key"],
@@ -34,6 +37,15 @@ MYSQL_USER = "root"
 MYSQL_PASSWORD = "Jianer_chat_db"
 MYSQL_DATABASE = "jianer_chat_db"
 MYSQL_PORT = 3306
+POOL_SIZE = 5  # 连接池大小，同时也是数据库工作线程数
+FLUSH_SIZE = 200  # 缓冲的消息达到该条数时立即批量写入
+FLUSH_INTERVAL = 2.0  # 缓冲消息的最长等待时间（秒）
+MAX_PENDING = 20000  # 数据库不可用时最多缓冲的消息条数，超出后丢弃最旧的消息
+RETENTION_DAYS = 0  # 消息保留天数，0 表示永久保留
+ARCHIVE_PRUNED = False  # 清理前是否把旧消息转存到 messages_archive 表
+PRUNE_BATCH_SIZE = 5000  # 每批删除的行数，避免长事务锁表
+PRUNE_INTERVAL = 3600  # 清理任务的执行间隔（秒）
+PARTITION_BY_MONTH = False  # 是否把 messages 表按月分区
 
 #try 从 mysql.json 加载配置
 try:
@@ -44,6 +56,14 @@ try:
         MYSQL_PASSWORD = mysql_json_data.get("password", MYSQL_PASSWORD)
         MYSQL_DATABASE = mysql_json_data.get("database", MYSQL_DATABASE)
         MYSQL_PORT = mysql_json_data.get("port", MYSQL_PORT)
+        POOL_SIZE = mysql_json_data.get("pool_size", POOL_SIZE)
+        FLUSH_SIZE = mysql_json_data.get("flush_size", FLUSH_SIZE)
+        FLUSH_INTERVAL = mysql_json_data.get("flush_interval", FLUSH_INTERVAL)
+        MAX_PENDING = mysql_json_data.get("max_pending", MAX_PENDING)
+        RETENTION_DAYS = mysql_json_data.get("retention_days", RETENTION_DAYS)
+        ARCHIVE_PRUNED = mysql_json_data.get("archive_pruned", ARCHIVE_PRUNED)
+        PRUNE_BATCH_SIZE = mysql_json_data.get("prune_batch_size", PRUNE_BATCH_SIZE)
+        PARTITION_BY_MONTH = mysql_json_data.get("partition_by_month", PARTITION_BY_MONTH)
     print(f"SumUp: 成功从 '{mysql_config_path}' 加载 MySQL 配置。")
 except FileNotFoundError:
     print(f"SumUp: 未找到 '{mysql_config_path}' 文件，将使用默认 MySQL 配置。请创建此文件以自定义数据库连接。")
@@ -53,6 +73,237 @@ except Exception as e:
     print(f"SumUp: 加载 '{mysql_config_path}' 时发生未知错误: {e}，将使用默认 MySQL 配置。")
 
 
+# 热词只统计 2-4 个字的完整中文片段，避免提取单个字或过长的词
+HOT_WORD_PATTERN = re.compile(r'(?<![\u4e00-\u9fff])([\u4e00-\u9fff]{2,4})(?![\u4e00-\u9fff])')
+# 常见停用词列表
+STOP_WORDS = {
+    '的', '了', '是', '在', '我', '有', '和', '就', '不', '人', '都', '一', '一个',
+    '上', '也', '很', '到', '说', '要', '去', '你', '会', '着', '没有', '看', '好',
+    '自己', '这', '但', '而', '于', '以', '可', '为', '之', '与', '则', '其', '或',
+    '即', '因', '及', '由', '时', '等', '所', '并', '且', '着', '呢', '吗', '啊',
+    '吧', '呀', '哦', '恩', '嗯', '哈', '嘿', '嘻', '呗', '哒', '啦', '哟', '呼'
+}
+
+
+def extract_hot_words(content: str) -> list:
+    """提取一条消息中参与热词统计的词语"""
+    return [word for word in HOT_WORD_PATTERN.findall(content) if word not in STOP_WORDS]
+
+
+def _count_stats(rows) -> tuple:
+    """把 (group_id, user_id, content, timestamp) 行汇总成三张统计表的增量"""
+    group_counts = Counter()
+    user_counts = {}
+    word_counts = Counter()
+    for group_id, user_id, content, timestamp in rows:
+        group_counts[group_id] += 1
+        count, last_active = user_counts.get((group_id, user_id), (0, timestamp))
+        user_counts[(group_id, user_id)] = (count + 1, max(last_active, timestamp))
+        day = timestamp.date()
+        for word in extract_hot_words(content):
+            word_counts[(group_id, day, word)] += 1
+    return group_counts, user_counts, word_counts
+
+
+def _apply_stats(cursor, rows, sign: int = 1):
+    """在同一事务中把一批消息累加（sign=1）或扣减（sign=-1）到统计表"""
+    group_counts, user_counts, word_counts = _count_stats(rows)
+    if group_counts:
+        cursor.executemany(
+            "INSERT INTO `group_stats` (`group_id`, `message_count`) VALUES (%s, %s) "
+            "ON DUPLICATE KEY UPDATE `message_count` = `message_count` + VALUES(`message_count`)",
+            [(group_id, sign * count) for group_id, count in group_counts.items()]
+        )
+    if user_counts:
+        cursor.executemany(
+            "INSERT INTO `group_user_stats` (`group_id`, `user_id`, `message_count`, `last_active`) VALUES (%s, %s, %s, %s) "
+            "ON DUPLICATE KEY UPDATE `message_count` = `message_count` + VALUES(`message_count`), "
+            "`last_active` = GREATEST(`last_active`, VALUES(`last_active`))",
+            [(group_id, user_id, sign * count, last_active) for (group_id, user_id), (count, last_active) in user_counts.items()]
+        )
+    if word_counts:
+        cursor.executemany(
+            "INSERT INTO `daily_word_freq` (`group_id`, `day`, `word`, `count`) VALUES (%s, %s, %s, %s) "
+            "ON DUPLICATE KEY UPDATE `count` = `count` + VALUES(`count`)",
+            [(group_id, day, word, sign * count) for (group_id, day, word), count in word_counts.items()]
+        )
+    if sign < 0:
+        # 只按主键清理本批扣减过的行，count 列没有索引，按条件删除会每批扫描全表
+        if user_counts:
+            cursor.executemany(
+                "DELETE FROM `group_user_stats` WHERE `group_id` = %s AND `user_id` = %s AND `message_count` <= 0",
+                list(user_counts)
+            )
+        if word_counts:
+            cursor.executemany(
+                "DELETE FROM `daily_word_freq` WHERE `group_id` = %s AND `day` = %s AND `word` = %s AND `count` <= 0",
+                list(word_counts)
+            )
+
+
+def _backfill_stats(cursor, batch_size: int = 10000):
+    """用已有消息一次性填充统计表（按 id 分批读取，避免一次拉取全表）"""
+    last_id = 0
+    while True:
+        cursor.execute(
+            "SELECT `id`, `group_id`, `user_id`, `content`, `timestamp` FROM `messages` WHERE `id` > %s ORDER BY `id` LIMIT %s",
+            (last_id, batch_size)
+        )
+        batch = cursor.fetchall()
+        if not batch:
+            break
+        last_id = batch[-1]['id']
+        _apply_stats(cursor, [(row['group_id'], row['user_id'], row['content'], row['timestamp']) for row in batch])
+
+
+def _add_message_indexes(cursor):
+    """给 messages 补上按群查询用的索引；已存在的索引（例如上次迁移只执行了一半）直接跳过"""
+    # 前者用于按群取最新消息和按群清理旧消息，后者让发言人数统计只扫索引
+    indexes = {
+        "idx_group_time": "(`group_id`, `timestamp`)",
+        "idx_group_user": "(`group_id`, `user_id`)",
+    }
+    cursor.execute(
+        "SELECT DISTINCT `index_name` AS name FROM information_schema.statistics "
+        "WHERE table_schema = DATABASE() AND table_name = 'messages'"
+    )
+    existing = {row['name'] for row in cursor.fetchall()}
+    missing = [f"ADD INDEX `{name}` {columns}" for name, columns in indexes.items() if name not in existing]
+    if missing:
+        cursor.execute(f"ALTER TABLE `messages` {', '.join(missing)}")
+
+
+# 按版本号顺序执行的表结构迁移，已执行的版本记录在 schema_version 表中
+# 每一步可以是 SQL 语句，也可以是接收 cursor 的函数
+SCHEMA_MIGRATIONS = [
+    (1, "创建 groups 和 messages 表", [
+        """
+        CREATE TABLE IF NOT EXISTS `groups` (
+            `group_id` VARCHAR(255) PRIMARY KEY
+        ) CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci;
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS `messages` (
+            `id` INT AUTO_INCREMENT PRIMARY KEY,
+            `group_id` VARCHAR(255) NOT NULL,
+            `user_id` VARCHAR(255) NOT NULL,
+            `nickname` VARCHAR(255) NOT NULL,
+            `content` TEXT NOT NULL,
+            `timestamp` DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (`group_id`) REFERENCES `groups`(`group_id`) ON DELETE CASCADE
+        ) CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci;
+        """,
+    ]),
+    (2, "messages 增加 (group_id, timestamp) 与 (group_id, user_id) 索引", [
+        _add_message_indexes,
+    ]),
+    (3, "创建预聚合的群统计、成员统计和每日词频表", [
+        """
+        CREATE TABLE IF NOT EXISTS `group_stats` (
+            `group_id` VARCHAR(255) PRIMARY KEY,
+            `message_count` BIGINT NOT NULL DEFAULT 0
+        ) CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci;
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS `group_user_stats` (
+            `group_id` VARCHAR(255) NOT NULL,
+            `user_id` VARCHAR(255) NOT NULL,
+            `message_count` BIGINT NOT NULL DEFAULT 0,
+            `last_active` DATETIME NULL,
+            PRIMARY KEY (`group_id`, `user_id`)
+        ) CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci;
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS `daily_word_freq` (
+            `group_id` VARCHAR(255) NOT NULL,
+            `day` DATE NOT NULL,
+            `word` VARCHAR(16) NOT NULL,
+            `count` INT NOT NULL DEFAULT 0,
+            PRIMARY KEY (`group_id`, `day`, `word`)
+        ) CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci;
+        """,
+        _backfill_stats,
+    ]),
+]
+
+
+def _month_start(day: date, offset: int = 0) -> date:
+    """day 所在月份往后 offset 个月的 1 号"""
+    month = day.month - 1 + offset
+    return date(day.year + month // 12, month % 12 + 1, 1)
+
+
+class ConnectionPool:
+    """线程安全的 pymysql 连接池
+
+    连接用完后放回队列复用，取出时 ping 一次以便自动重连；
+    池满时等待其他线程归还，出错的连接直接丢弃。
+    """
+
+    def __init__(self, size: int, **connect_kwargs):
+        self.size = size
+        self.connect_kwargs = connect_kwargs
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _acquire(self):
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                can_create = self._created < self.size
+                if can_create:
+                    self._created += 1
+            if can_create:
+                try:
+                    return pymysql.connect(**self.connect_kwargs)
+                except Exception:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+            conn = self._idle.get()
+        try:
+            conn.ping(reconnect=True)
+        except Exception:
+            self._discard(conn)
+            raise
+        return conn
+
+    def _discard(self, conn):
+        with self._lock:
+            self._created -= 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    @contextmanager
+    def connection(self):
+        conn = self._acquire()
+        try:
+            yield conn
+        except pymysql.Error:
+            self._discard(conn)
+            raise
+        except Exception:
+            conn.rollback()
+            self._idle.put(conn)
+            raise
+        else:
+            # 结束读操作留下的事务，否则下一个使用者会读到旧快照
+            conn.rollback()
+            self._idle.put(conn)
+
+    def close(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(conn)
+
+
 class MySQLManager:
     def __init__(self, host, user, password, database, port):
         self.host = host
@@ -60,31 +311,43 @@ class MySQLManager:
         self.password = password
         self.database = database
         self.port = port
+        # 连接池按需建立连接，建库完成前不会真正连接到 database
+        self.pool = ConnectionPool(
+            POOL_SIZE,
+            host=self.host,
+            user=self.user,
+            password=self.password,
+            database=self.database,
+            port=self.port,
+            charset='utf8mb4',
+            cursorclass=pymysql.cursors.DictCursor,
+            autocommit=False
+        )
         self._create_database_and_tables()
+        # 所有数据库操作都在该线程池中执行，避免阻塞事件循环
+        self._executor = ThreadPoolExecutor(max_workers=POOL_SIZE, thread_name_prefix="SumUp_MySQL")
+        self._known_groups = set(self.get_all_group_ids())
+        self._pending = []  # 等待批量写入的消息
+        self._flush_task = None
+        self._size_flush_task = None  # 缓冲满时触发的写入，同一时间最多一个
+        self._flush_failing = False  # 上次写入失败时只由定时任务重试
+        self._dropped = 0  # 缓冲溢出后丢弃的消息数，恢复写入后汇报一次
+        self._flush_lock = None
+        self._maintain_task = None
+        self._closed = False
+
+    async def run(self, func, *args):
+        """在数据库线程池中执行同步函数"""
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
 
     @contextmanager
     def _get_connection(self):
-        conn = None
         try:
-            conn = pymysql.connect(
-                host=self.host,
-                user=self.user,
-                password=self.password,
-                database=self.database,
-                port=self.port,
-                charset='utf8mb4',
-                cursorclass=pymysql.cursors.DictCursor,
-                autocommit=False
-            )
-            yield conn
+            with self.pool.connection() as conn:
+                yield conn
         except pymysql.Error as e:
             print(f"SumUp: MySQL 连接或操作错误: {e}")
-            if conn:
-                conn.rollback()
             raise
-        finally:
-            if conn:
-                conn.close()
 
     def _create_database_and_tables(self):
         temp_conn = None
@@ -108,50 +371,353 @@ class MySQLManager:
             if temp_conn:
                 temp_conn.close()
 
+        self._migrate_schema()
+        if PARTITION_BY_MONTH:
+            self._ensure_partitions()
+
+    def _migrate_schema(self):
+        """执行尚未执行过的表结构迁移"""
         with self._get_connection() as conn:
             with conn.cursor() as cursor:
-                # 创建 groups 表 (存储群ID)
                 cursor.execute("""
-                    CREATE TABLE IF NOT EXISTS `groups` (
-                        `group_id` VARCHAR(255) PRIMARY KEY
-                    ) CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci;
-                """)
-                # 创建 messages 表 (存储聊天消息)
-                cursor.execute("""
-                    CREATE TABLE IF NOT EXISTS `messages` (
-                        `id` INT AUTO_INCREMENT PRIMARY KEY,
-                        `group_id` VARCHAR(255) NOT NULL,
-                        `user_id` VARCHAR(255) NOT NULL,
-                        `nickname` VARCHAR(255) NOT NULL,
-                        `content` TEXT NOT NULL,
-                        `timestamp` DATETIME DEFAULT CURRENT_TIMESTAMP,
-                        FOREIGN KEY (`group_id`) REFERENCES `groups`(`group_id`) ON DELETE CASCADE
+                    CREATE TABLE IF NOT EXISTS `schema_version` (
+                        `version` INT PRIMARY KEY,
+                        `applied_at` DATETIME DEFAULT CURRENT_TIMESTAMP
                     ) CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci;
                 """)
+                cursor.execute("SELECT MAX(`version`) AS version FROM `schema_version`")
+                current = (cursor.fetchone() or {}).get('version') or 0
             conn.commit()
+
+            for version, description, statements in SCHEMA_MIGRATIONS:
+                if version <= current:
+                    continue
+                with conn.cursor() as cursor:
+                    for statement in statements:
+                        if callable(statement):
+                            statement(cursor)
+                        else:
+                            cursor.execute(statement)
+                    cursor.execute("INSERT INTO `schema_version` (`version`) VALUES (%s)", (version,))
+                conn.commit()
+                print(f"SumUp: 已执行表结构迁移 v{version}: {description}")
         print("SumUp: MySQL 表 'groups' 和 'messages' 检查/创建成功。")
 
-    def add_message(self, group_id: str, user_id: str, nickname: str, content: str):
-        """添加消息到数据库"""
+    def _ensure_partitions(self, months_ahead: int = 2):
+        """把 messages 表转换为按月 RANGE 分区，并预建之后几个月的分区
+
+        MySQL 分区表不支持外键，且主键必须包含分区列，所以转换时会去掉
+        messages 到 groups 的外键，并把主键改为 (id, timestamp)。
+        """
         with self._get_connection() as conn:
             with conn.cursor() as cursor:
-                # 确保群组存在，如果不存在则插入 (IGNORE 避免重复插入错误)
-                cursor.execute("INSERT IGNORE INTO `groups` (`group_id`) VALUES (%s)", (group_id,))
-                # 插入消息
                 cursor.execute(
-                    "INSERT INTO `messages` (`group_id`, `user_id`, `nickname`, `content`) VALUES (%s, %s, %s, %s)",
-                    (group_id, user_id, nickname, content)
+                    "SELECT `partition_name` AS name FROM information_schema.partitions "
+                    "WHERE table_schema = %s AND table_name = 'messages' AND `partition_name` IS NOT NULL",
+                    (self.database,)
                 )
+                existing = {row['name'] for row in cursor.fetchall()}
+                today = date.today()
+
+                if not existing:
+                    cursor.execute(
+                        "SELECT constraint_name AS name FROM information_schema.referential_constraints "
+                        "WHERE constraint_schema = %s AND table_name = 'messages'",
+                        (self.database,)
+                    )
+                    for row in cursor.fetchall():
+                        cursor.execute(f"ALTER TABLE `messages` DROP FOREIGN KEY `{row['name']}`")
+                    cursor.execute("SELECT MIN(`timestamp`) AS oldest FROM `messages`")
+                    oldest = (cursor.fetchone() or {}).get('oldest')
+                    first = _month_start(oldest.date() if oldest else today)
+                    cursor.execute(
+                        "ALTER TABLE `messages` MODIFY `timestamp` DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP, "
+                        "DROP PRIMARY KEY, ADD PRIMARY KEY (`id`, `timestamp`)"
+                    )
+                    months = []
+                    month = first
+                    while month <= _month_start(today, months_ahead):
+                        months.append(month)
+                        month = _month_start(month, 1)
+                    cursor.execute(
+                        "ALTER TABLE `messages` PARTITION BY RANGE (TO_DAYS(`timestamp`)) ("
+                        + ", ".join(self._partition_definition(month) for month in months)
+                        + ", PARTITION `pmax` VALUES LESS THAN MAXVALUE)"
+                    )
+                    print(f"SumUp: messages 表已转换为按月分区，共 {len(months)} 个分区")
+                else:
+                    missing = [
+                        _month_start(today, offset) for offset in range(months_ahead + 1)
+                        if f"p{_month_start(today, offset):%Y%m}" not in existing
+                    ]
+                    if missing:
+                        cursor.execute(
+                            "ALTER TABLE `messages` REORGANIZE PARTITION `pmax` INTO ("
+                            + ", ".join(self._partition_definition(month) for month in missing)
+                            + ", PARTITION `pmax` VALUES LESS THAN MAXVALUE)"
+                        )
             conn.commit()
+
+    @staticmethod
+    def _partition_definition(month: date) -> str:
+        return f"PARTITION `p{month:%Y%m}` VALUES LESS THAN (TO_DAYS('{_month_start(month, 1):%Y-%m-%d}'))"
+
+    def prune_old_messages(self) -> int:
+        """按保留天数分批清理旧消息，返回清理的行数"""
+        if RETENTION_DAYS <= 0:
+            return 0
+        cutoff = datetime.now() - timedelta(days=RETENTION_DAYS)
+        pruned = 0
+
+        if PARTITION_BY_MONTH and not ARCHIVE_PRUNED:
+            # 整个分区都早于截止时间时直接 DROP，代价与行数无关
+            pruned += self._drop_expired_partitions(cutoff)
+
+        if ARCHIVE_PRUNED:
+            with self._get_connection() as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute("CREATE TABLE IF NOT EXISTS `messages_archive` LIKE `messages`")
+                conn.commit()
+
+        for group_id in self.get_all_group_ids():
+            while True:
+                with self._get_connection() as conn:
+                    with conn.cursor() as cursor:
+                        # 走 (group_id, timestamp) 索引，每批一个短事务
+                        cursor.execute(
+                            "SELECT `id`, `group_id`, `user_id`, `content`, `timestamp` FROM `messages` "
+                            "WHERE `group_id` = %s AND `timestamp` < %s ORDER BY `timestamp` LIMIT %s",
+                            (group_id, cutoff, PRUNE_BATCH_SIZE)
+                        )
+                        batch = cursor.fetchall()
+                        if not batch:
+                            break
+                        ids = [row['id'] for row in batch]
+                        placeholders = ", ".join(["%s"] * len(ids))
+                        if ARCHIVE_PRUNED:
+                            cursor.execute(f"INSERT IGNORE INTO `messages_archive` SELECT * FROM `messages` WHERE `id` IN ({placeholders})", ids)
+                        cursor.execute(f"DELETE FROM `messages` WHERE `id` IN ({placeholders})", ids)
+                        _apply_stats(cursor, [(row['group_id'], row['user_id'], row['content'], row['timestamp']) for row in batch], sign=-1)
+                    conn.commit()
+                pruned += len(ids)
+                if len(ids) < PRUNE_BATCH_SIZE:
+                    break
+                time.sleep(0.05)  # 让出数据库给在线写入
+
+        if pruned:
+            print(f"SumUp: 已清理 {pruned} 条超过 {RETENTION_DAYS} 天的消息")
+        return pruned
+
+    def _drop_expired_partitions(self, cutoff: datetime) -> int:
+        with self._get_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    "SELECT `partition_name` AS name, `table_rows` AS estimated_rows FROM information_schema.partitions "
+                    "WHERE table_schema = %s AND table_name = 'messages' AND `partition_name` LIKE 'p______'",
+                    (self.database,)
+                )
+                expired = [
+                    row for row in cursor.fetchall()
+                    if row['name'][1:].isdigit()
+                    and _month_start(date(int(row['name'][1:5]), int(row['name'][5:7]), 1), 1) <= cutoff.date()
+                ]
+                for row in expired:
+                    # 整分区删除不会逐行经过 _apply_stats，先按分区聚合扣减统计表
+                    partition = row['name']
+                    cursor.execute(
+                        "UPDATE `group_stats` s JOIN (SELECT `group_id`, COUNT(*) AS c FROM `messages` "
+                        f"PARTITION (`{partition}`) GROUP BY `group_id`) d USING (`group_id`) "
+                        "SET s.`message_count` = s.`message_count` - d.c"
+                    )
+                    cursor.execute(
+                        "UPDATE `group_user_stats` s JOIN (SELECT `group_id`, `user_id`, COUNT(*) AS c FROM `messages` "
+                        f"PARTITION (`{partition}`) GROUP BY `group_id`, `user_id`) d USING (`group_id`, `user_id`) "
+                        "SET s.`message_count` = s.`message_count` - d.c"
+                    )
+                    cursor.execute(
+                        "DELETE s FROM `group_user_stats` s JOIN (SELECT DISTINCT `group_id`, `user_id` FROM `messages` "
+                        f"PARTITION (`{partition}`)) d USING (`group_id`, `user_id`) "
+                        "WHERE s.`message_count` <= 0"
+                    )
+                if expired:
+                    # 按群走主键前缀 (group_id, day) 删除过期词频，避免按 day 扫描全表
+                    expired_before = max(
+                        _month_start(date(int(row['name'][1:5]), int(row['name'][5:7]), 1), 1) for row in expired
+                    )
+                    cursor.execute("SELECT `group_id` FROM `groups`")
+                    group_ids = [row['group_id'] for row in cursor.fetchall()]
+                    if group_ids:
+                        cursor.executemany(
+                            "DELETE FROM `daily_word_freq` WHERE `group_id` = %s AND `day` < %s",
+                            [(group_id, expired_before) for group_id in group_ids]
+                        )
+                    cursor.execute("ALTER TABLE `messages` DROP PARTITION " + ", ".join(f"`{row['name']}`" for row in expired))
+            conn.commit()
+        return sum(row['estimated_rows'] or 0 for row in expired)
+
+    def maintain(self):
+        """定期维护：补建分区、清理过期消息"""
+        if PARTITION_BY_MONTH:
+            self._ensure_partitions()
+        self.prune_old_messages()
+
+    def add_message(self, group_id: str, user_id: str, nickname: str, content: str):
+        """立即添加一条消息到数据库（在线消息请使用 buffer_message）"""
+        self._write_batch([(group_id, user_id, nickname, content, datetime.now())])
         # print(f"SumUp: 消息已写入数据库: 群 {group_id}, 用户 {nickname}")
 
+    def buffer_message(self, group_id: str, user_id: str, nickname: str, content: str):
+        """把消息放入写缓冲，由后台任务按条数或时间批量写入"""
+        self._pending.append((group_id, user_id, nickname, content, datetime.now()))
+        if self._maintain_task is None and (RETENTION_DAYS > 0 or PARTITION_BY_MONTH):
+            self._maintain_task = asyncio.ensure_future(self._maintain_loop())
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.ensure_future(self._flush_loop())
+        if len(self._pending) >= FLUSH_SIZE and not self._flush_failing:
+            if self._size_flush_task is None or self._size_flush_task.done():
+                self._size_flush_task = asyncio.ensure_future(self._try_flush())
+        self._trim_pending()
+
+    def _trim_pending(self):
+        overflow = len(self._pending) - MAX_PENDING
+        if overflow > 0:
+            del self._pending[:overflow]
+            if not self._dropped:
+                print(f"SumUp: 写缓冲已超过 {MAX_PENDING} 条，开始丢弃最旧的消息")
+            self._dropped += overflow
+
+    async def _try_flush(self):
+        try:
+            await self.flush()
+            self._flush_failing = False
+            if self._dropped:
+                print(f"SumUp: 数据库写入已恢复，期间共丢弃 {self._dropped} 条消息")
+                self._dropped = 0
+        except Exception as e:
+            self._flush_failing = True
+            print(f"SumUp: 批量写入消息失败: {e}")
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(FLUSH_INTERVAL)
+            # 取消定时任务时不能打断进行中的写入，否则已取出的消息既没写完也不会放回缓冲
+            await asyncio.shield(self._try_flush())
+
+    async def _maintain_loop(self):
+        while True:
+            try:
+                await self.run(self.maintain)
+            except Exception as e:
+                print(f"SumUp: 数据库维护任务失败: {e}")
+            await asyncio.sleep(PRUNE_INTERVAL)
+
+    async def flush(self):
+        """立即把缓冲中的消息批量写入数据库"""
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        async with self._flush_lock:
+            if not self._pending:
+                return
+            rows, self._pending = self._pending, []
+            try:
+                await self.run(self._write_batch, rows)
+            except Exception:
+                # 写入失败时放回缓冲，等待下次重试；数据库长时间不可用时缓冲有上限
+                self._pending[:0] = rows
+                self._trim_pending()
+                raise
+
+    def flush_sync(self):
+        """同步写出缓冲中的消息（进程退出时使用）"""
+        if self._pending:
+            rows, self._pending = self._pending, []
+            self._write_batch(rows)
+
+    def _write_batch(self, rows: list):
+        """批量写入消息；个别行出错（如内容过长、字符集不符）时改为逐行写入，丢弃仍然出错的行
+
+        连接类错误原样抛出，由调用方放回缓冲重试。逐行写入中途断开时，已写入的行会从 rows 中删除，
+        调用方放回缓冲的只是尚未写入的部分。
+        """
+        try:
+            self._insert_rows(rows)
+            return
+        except (pymysql.OperationalError, pymysql.InterfaceError):
+            raise
+        except pymysql.Error as e:
+            if len(rows) == 1:
+                print(f"SumUp: 丢弃无法写入的消息 (群 {rows[0][0]}, 用户 {rows[0][1]}): {e}")
+                return
+            print(f"SumUp: 批量写入 {len(rows)} 条消息失败，改为逐行写入: {e}")
+        for i, row in enumerate(rows):
+            try:
+                self._insert_rows([row])
+            except (pymysql.OperationalError, pymysql.InterfaceError):
+                del rows[:i]
+                raise
+            except pymysql.Error as e:
+                print(f"SumUp: 丢弃无法写入的消息 (群 {row[0]}, 用户 {row[1]}): {e}")
+
+    def _insert_rows(self, rows: list):
+        new_groups = {row[0] for row in rows} - self._known_groups
+        with self._get_connection() as conn:
+            with conn.cursor() as cursor:
+                # groups 只在第一次见到某个群时写入
+                if new_groups:
+                    cursor.executemany("INSERT IGNORE INTO `groups` (`group_id`) VALUES (%s)", [(group_id,) for group_id in new_groups])
+                # PyMySQL 会把 executemany 的 INSERT 合并成多行 VALUES 的单条语句
+                cursor.executemany(
+                    "INSERT INTO `messages` (`group_id`, `user_id`, `nickname`, `content`, `timestamp`) VALUES (%s, %s, %s, %s, %s)",
+                    rows
+                )
+                # 统计表与消息在同一事务中更新，看板直接读取预聚合结果
+                _apply_stats(cursor, [(group_id, user_id, content, timestamp) for group_id, user_id, _, content, timestamp in rows])
+            conn.commit()
+        self._known_groups |= new_groups
+
+    def _cancel_tasks(self):
+        for task in (self._flush_task, self._size_flush_task, self._maintain_task):
+            # atexit 运行时事件循环通常已经关闭，此时 cancel() 会抛出 RuntimeError
+            if task is not None and not task.done() and not task.get_loop().is_closed():
+                task.cancel()
+        self._flush_task = self._size_flush_task = self._maintain_task = None
+
+    async def shutdown(self):
+        """插件停止时调用：停止后台任务，等进行中的写入结束后写出剩余消息并关闭连接池"""
+        if self._closed:
+            return
+        for task in (self._flush_task, self._maintain_task):
+            if task is not None:
+                task.cancel()
+        self._flush_task = self._maintain_task = None
+        try:
+            # flush 持有写入锁，会等进行中的批量写入结束后再写出剩余消息
+            await self.flush()
+        except Exception as e:
+            print(f"SumUp: 停止前写入剩余消息失败: {e}")
+        self._size_flush_task = None
+        await self.run(self.close)
+
+    def close(self):
+        """写出剩余消息并关闭连接池（也由 atexit 在进程退出时调用）"""
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            self.flush_sync()
+        finally:
+            self._cancel_tasks()
+            self._executor.shutdown(wait=False)
+            self.pool.close()
+
     def get_messages(self, group_id: str, limit: int = 1000) -> list:
         """从数据库获取指定群聊的最新 N 条消息"""
         with self._get_connection() as conn:
             with conn.cursor() as cursor:
                 cursor.execute(
                     "SELECT nickname, content FROM `messages` WHERE `group_id` = %s ORDER BY `timestamp` DESC LIMIT %s",
-                    (group_id, limit)
+                    # group_id 列是 VARCHAR，传入整数会让 MySQL 逐行转换而用不上 idx_group_time
+                    (str(group_id), limit)
                 )
                 return cursor.fetchall()[::-1]
 
@@ -163,32 +729,38 @@ class MySQLManager:
                 return [row['group_id'] for row in cursor.fetchall()]
 
     def get_group_stats(self, group_id: str):
-        """获取指定群聊的消息总数和发言人数"""
+        """获取指定群聊的消息总数和发言人数（读取预聚合的统计表）"""
         with self._get_connection() as conn:
             with conn.cursor() as cursor:
                 cursor.execute(
-                    "SELECT COUNT(*) as message_count, COUNT(DISTINCT `user_id`) as speaker_count FROM `messages` WHERE `group_id` = %s",
-                    (group_id,)
+                    "SELECT COALESCE((SELECT `message_count` FROM `group_stats` WHERE `group_id` = %s), 0) as message_count, "
+                    "(SELECT COUNT(*) FROM `group_user_stats` WHERE `group_id` = %s) as speaker_count",
+                    (str(group_id), str(group_id))
                 )
                 return cursor.fetchone()
 
-    def get_all_messages_content_for_hot_words(self, group_id: str) -> list:
-        """获取指定群聊的所有消息内容，用于热词计算"""
+    def get_hot_words(self, group_id: str, limit: int = 5) -> list:
+        """从每日词频表汇总指定群聊出现次数最多的词，返回 [(词, 次数)]"""
         with self._get_connection() as conn:
             with conn.cursor() as cursor:
                 cursor.execute(
-                    "SELECT content FROM `messages` WHERE `group_id` = %s",
-                    (group_id,)
+                    "SELECT `word`, SUM(`count`) AS total FROM `daily_word_freq` WHERE `group_id` = %s "
+                    "GROUP BY `word` ORDER BY total DESC LIMIT %s",
+                    (str(group_id), limit)
                 )
-                return cursor.fetchall()
+                return [(row['word'], int(row['total'])) for row in cursor.fetchall()]
 
 try:
     db_manager = MySQLManager(MYSQL_HOST, MYSQL_USER, MYSQL_PASSWORD, MYSQL_DATABASE, MYSQL_PORT)
+    atexit.register(db_manager.close)
     print("SumUp: MySQL Manager 初始化成功。")
 except Exception as e:
     print(f"SumUp: MySQL Manager 初始化失败，请检查配置和数据库连接: {e}")
     db_manager = None
 
+# 统计信息复用消息库的连接池，连接失败时由 chat_database_info 自行建立连接
+stats_collector = DatabaseStatsCollector(db_manager.pool.connection if db_manager else None)
+
 # --- 辅助函数 (估算Token) ---
 def estimate_tokens(text: str) -> int:
     """估算Token（中文≈1字/Tok，英文≈1词/4字母）"""
@@ -229,7 +801,8 @@ async def handle_summary_request(group_id: str, match):
         if n <= 0 or n > 1000:
             return "❌ 命令格式错误！请用：'总结以上N条消息' (0<N<=1000)"
 
-        messages_from_db = db_manager.get_messages(group_id, limit=n)
+        await db_manager.flush()
+        messages_from_db = await db_manager.run(db_manager.get_messages, group_id, n)
 
         if len(messages_from_db) < 5:
             return "⚠️ 消息过少（少于 5 条消息），无法有效总结。"
@@ -238,7 +811,7 @@ async def handle_summary_request(group_id: str, match):
                            for msg in messages_from_db)
         max_tokens = 800000  # Gemini 模型的 token 限制，预留缓冲
         if total_tokens > max_tokens:
-            max_n = max_summarizable_msgs(group_id, max_tokens)
+            max_n = await db_manager.run(max_summarizable_msgs, group_id, max_tokens)
             return f"⚠️ 消息过长（{total_tokens} Tokens > 上限{max_tokens}）\n最多可总结{max_n}条消息"
 
         messages_text = "\n".join(f"{msg['nickname']}: {msg['content']}" for msg in messages_from_db)
@@ -389,52 +962,24 @@ async def handle_node_messages(data: dict) -> list:
     return processed_messages
 
 # --- 热词计算和数据看板函数 ---
-def _calculate_hot_words_internal(messages_list_for_processing: list, min_count=1, max_words=5, recursion_depth=0):
-    """内部函数：计算热词排行，接收一个消息列表"""
-    if recursion_depth > 20: # 防止无限递归
-        return []
-
-    all_words = []
-    # 常见停用词列表
-    stop_words = {
-        '的', '了', '是', '在', '我', '有', '和', '就', '不', '人', '都', '一', '一个',
-        '上', '也', '很', '到', '说', '要', '去', '你', '会', '着', '没有', '看', '好',
-        '自己', '这', '但', '而', '于', '以', '可', '为', '之', '与', '则', '其', '或',
-        '即', '因', '及', '由', '时', '等', '所', '并', '且', '着', '呢', '吗', '啊',
-        '吧', '呀', '哦', '恩', '嗯', '哈', '嘿', '嘻', '呗', '哒', '啦', '哟', '呼'
-    }
-
-    for msg in messages_list_for_processing:
-        # 只提取中文字符，且长度在2-4个字符之间，避免提取单个字或过长的词
-        # 使用lookbehind和lookahead来确保我们提取的是完整的中文词语
-        words = re.findall(r'(?<![\u4e00-\u9fff])([\u4e00-\u9fff]{2,4})(?![\u4e00-\u9fff])', msg['content'])
-        # 过滤掉停用词
-        filtered_words = [word for word in words if word not in stop_words]
-        all_words.extend(filtered_words)
-
-    # 统计词频
-    word_count = Counter(all_words)
-
-    # 如果热词不足3个，降低标准
+def _select_hot_words(top_words: list, min_count=1) -> list:
+    """从按次数排好序的 [(词, 次数)] 中选出热词，不足3个时降低标准"""
     current_min_count = min_count
-    hot_words = [word for word, _ in word_count.most_common(max_words) if _ >= current_min_count]
+    hot_words = [word for word, count in top_words if count >= current_min_count]
 
     while len(hot_words) < 3 and current_min_count > 1:
         current_min_count -= 1
-        hot_words = [word for word, _ in word_count.most_common(max_words) if _ >= current_min_count]
+        hot_words = [word for word, count in top_words if count >= current_min_count]
 
     return hot_words
 
 def calculate_hot_words(group_id: str, min_count=1, max_words=5) -> list:
-    """计算热词排行，从数据库获取消息"""
+    """计算热词排行，读取数据库中预聚合的每日词频"""
     if not db_manager:
         return []
 
     try:
-
-        db_messages_raw = db_manager.get_all_messages_content_for_hot_words(group_id)
-        messages_for_processing = [{"content": msg['content']} for msg in db_messages_raw]
-        return _calculate_hot_words_internal(messages_for_processing, min_count, max_words)
+        return _select_hot_words(db_manager.get_hot_words(group_id, max_words), min_count)
     except Exception as e:
         print(f"SumUp: 计算群 {group_id} 热词失败: {e}")
         return []
@@ -464,13 +1009,37 @@ def generate_chat_summary(group_id: str):
         return f"群：{group_id}\n生成数据看板失败: {e}"
 
 async def on_message(event, actions, Manager, Events, Segments, bot_name, gen_message, ADMINS, CONFUSED_WORD):
+    if isinstance(event, Events.HyperListenerStopNotify):
+        print("SumUp: 插件将停止运行")
+        if db_manager:
+            await db_manager.shutdown()
+        return False
+
     if not isinstance(event, Events.GroupMessageEvent):
         return None
 
     user_message = str(event.message).strip()
     reminder_prefix = Configurator.cm.get_cfg().others['reminder']
-    if user_message == f'{reminder_prefix}查看数据库信息' or user_message == f'{reminder_prefix}查看数据库状态':
-        await actions.send(group_id=event.group_id, message=Manager.Message(Segments.Text(get_database_stats())))
+    if user_message in (f'{reminder_prefix}查看数据库信息', f'{reminder_prefix}查看数据库状态'):
+        await actions.send(group_id=event.group_id, message=Manager.Message(Segments.Text(await stats_collector.get_report())))
+        return True
+    if user_message in (f'{reminder_prefix}查看数据库信息 精确', f'{reminder_prefix}查看数据库状态 精确'):
+        running = stats_collector.exact_running
+        task = stats_collector.start_exact_counts()
+        if running:
+            await actions.send(group_id=event.group_id, message=Manager.Message(Segments.Text("已有精确统计正在进行，请稍后再查看数据库状态")))
+            return True
+        await actions.send(group_id=event.group_id, message=Manager.Message(Segments.Text("正在后台统计各表的精确记录数，完成后发送结果")))
+
+        async def send_exact_report():
+            try:
+                await task
+                report = await stats_collector.get_report(force=True)
+            except Exception as e:
+                report = f"错误: 精确统计失败: {e}"
+            await actions.send(group_id=event.group_id, message=Manager.Message(Segments.Text(report)))
+
+        asyncio.ensure_future(send_exact_report())
         return True
     if user_message.startswith(reminder_prefix) and '聊天数据看板' in user_message:
         if '@all' in user_message or '@全体' in user_message:
@@ -480,9 +1049,10 @@ async def on_message(event, actions, Manager, Events, Segments, bot_name, gen_me
 
             chat_summary = """===== 全群聊天数据看板 ====="""
             if db_manager:
-                all_group_ids = db_manager.get_all_group_ids()
-                for group_id in all_group_ids:
-                    group_summary = generate_chat_summary(group_id)
+                await db_manager.flush()
+                all_group_ids = await db_manager.run(db_manager.get_all_group_ids)
+                group_summaries = await asyncio.gather(*(db_manager.run(generate_chat_summary, group_id) for group_id in all_group_ids))
+                for group_summary in group_summaries:
                     chat_summary += f"\n{group_summary}\n{'-'*30}"
             else:
                 chat_summary += "\n数据库未连接，无法获取所有群聊数据。"
@@ -495,7 +1065,11 @@ async def on_message(event, actions, Manager, Events, Segments, bot_name, gen_me
                     Manager.Message(Segments.Text(chat_summary))
             )))
         else:
-            chat_summary = generate_chat_summary(event.group_id)
+            if db_manager:
+                await db_manager.flush()
+                chat_summary = await db_manager.run(generate_chat_summary, str(event.group_id))
+            else:
+                chat_summary = generate_chat_summary(str(event.group_id))
             await actions.send(group_id=event.group_id, message=Manager.Message(Segments.Reply(event.message_id), Segments.Text(chat_summary)))
         return True
     
@@ -518,7 +1092,7 @@ async def on_message(event, actions, Manager, Events, Segments, bot_name, gen_me
             else:
                 message_to_send = await summarize_arbitrary_messages(extracted_messages_for_summary, match)
         else:
-            message_to_send = await handle_summary_request(event.group_id, match)
+            message_to_send = await handle_summary_request(str(event.group_id), match)
 
         if len(message_to_send) < 400:
             await actions.send(group_id=event.group_id, message=Manager.Message(Segments.Reply(event.message_id), Segments.Text(message_to_send)))
@@ -537,7 +1111,7 @@ async def on_message(event, actions, Manager, Events, Segments, bot_name, gen_me
     else:
         if db_manager:
             nike = await get_user_nickname(event.user_id, Manager, actions)
-            db_manager.add_message(str(event.group_id), str(event.user_id), nike, user_message)
+            db_manager.buffer_message(str(event.group_id), str(event.user_id), nike, user_message)
             print(f"SumUp: 添加ID为 {event.user_id} 的用户 {nike} 的信息到数据库，群组 {event.group_id}")
         else:
             print(f"SumUp: 数据库未连接，未保存群组 {event.group_id} 的消息。")
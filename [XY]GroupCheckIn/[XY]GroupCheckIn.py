@@ -1,15 +1,20 @@
-from Hyper import Configurator
+from Hyper import Configurator, Events
 import json
 import os
+import time
+import base64
 import random
-from datetime import datetime
+import bisect
+import sqlite3
+from collections import OrderedDict, deque
+from datetime import datetime, timedelta
 import httpx
 import asyncio
 
 Configurator.cm = Configurator.ConfigManager(Configurator.Config(file="config.json").load_from_file())
 
 TRIGGHT_KEYWORD = "Any"
-HELP_MESSAGE = f"签到 -> 签到获取积分和好感度"
+HELP_MESSAGE = f"签到 -> 签到获取积分和好感度\n签到排行 [好感/积分/天数/连签] -> 查看签到排行"
 
 DEFAULT_CONFIG = {
     "好感度": {
@@ -22,23 +27,378 @@ DEFAULT_CONFIG = {
     },
     "数据存储路径": "./data/check_in/",
     "签到模式": "text",  # 支持 text, image, api
-    "模板文件": "template.html"
+    "模板文件": "template.html",
+    "渲染并发数": 4,  # image 模式下同时渲染的页面数
+    "排行模板文件": "rank_template.html",
+    "排行显示人数": 10
 }
 
+# 排行指令后缀 -> (用户数据字段, 排行标题)
+RANK_TYPES = {
+    "好感": ("好感度", "好感度排行"),
+    "积分": ("积分", "积分排行"),
+    "天数": ("total_days", "签到天数排行"),
+    "连签": ("max_streak", "最长连签排行")
+}
+
+class CheckInStore:
+    """基于 SQLite 的签到数据存储
+
+    users 表保存每个用户的累计数据、连签天数和最近一次的昵称；daily_counter 记录每天已签到人数，
+    daily_checkins 按名次保存当天的签到顺序。签到时在同一个事务里读写这几张表，
+    当日名次直接取计数器，不需要遍历所有用户。
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path, isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS users (
+                user_id TEXT PRIMARY KEY,
+                total_days INTEGER NOT NULL DEFAULT 0,
+                favor INTEGER NOT NULL DEFAULT 0,
+                points INTEGER NOT NULL DEFAULT 0,
+                last_check TEXT NOT NULL DEFAULT '',
+                streak INTEGER NOT NULL DEFAULT 0,
+                max_streak INTEGER NOT NULL DEFAULT 0,
+                nickname TEXT NOT NULL DEFAULT ''
+            );
+            CREATE TABLE IF NOT EXISTS daily_counter (
+                day TEXT PRIMARY KEY,
+                count INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS daily_checkins (
+                day TEXT NOT NULL,
+                rank INTEGER NOT NULL,
+                user_id TEXT NOT NULL,
+                check_time TEXT NOT NULL,
+                PRIMARY KEY (day, rank),
+                UNIQUE (day, user_id)
+            );
+        """)
+        # 旧版数据库没有连签和昵称字段
+        columns = {row["name"] for row in self.conn.execute("PRAGMA table_info(users)")}
+        for column, definition in (
+            ("streak", "INTEGER NOT NULL DEFAULT 0"),
+            ("max_streak", "INTEGER NOT NULL DEFAULT 0"),
+            ("nickname", "TEXT NOT NULL DEFAULT ''")
+        ):
+            if column not in columns:
+                self.conn.execute(f"ALTER TABLE users ADD COLUMN {column} {definition}")
+
+    @staticmethod
+    def _to_user_data(row) -> dict:
+        if row is None:
+            return {"total_days": 0, "好感度": 0, "积分": 0, "last_check": "", "streak": 0, "max_streak": 0}
+        return {
+            "total_days": row["total_days"],
+            "好感度": row["favor"],
+            "积分": row["points"],
+            "last_check": row["last_check"],
+            "streak": row["streak"],
+            "max_streak": row["max_streak"]
+        }
+
+    def get_user(self, user_id: str) -> dict:
+        row = self.conn.execute("SELECT * FROM users WHERE user_id = ?", (user_id,)).fetchone()
+        return self._to_user_data(row)
+
+    def all_users(self):
+        """遍历所有用户，返回 (user_id, 用户数据)，用于启动时建立排行索引"""
+        for row in self.conn.execute("SELECT * FROM users"):
+            yield row["user_id"], self._to_user_data(row)
+
+    def save_user(self, user_id: str, data: dict):
+        self.conn.execute(
+            "INSERT INTO users (user_id, total_days, favor, points, last_check, streak, max_streak) VALUES (?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(user_id) DO UPDATE SET total_days = excluded.total_days, favor = excluded.favor, points = excluded.points, "
+            "last_check = excluded.last_check, streak = excluded.streak, max_streak = excluded.max_streak",
+            (user_id, data.get("total_days", 0), data.get("好感度", 0), data.get("积分", 0), data.get("last_check", ""),
+             data.get("streak", 0), data.get("max_streak", 0))
+        )
+
+    def get_nicknames(self, user_ids) -> dict:
+        user_ids = list(user_ids)
+        if not user_ids:
+            return {}
+        placeholders = ",".join("?" * len(user_ids))
+        rows = self.conn.execute(f"SELECT user_id, nickname FROM users WHERE user_id IN ({placeholders})", user_ids)
+        return {row["user_id"]: row["nickname"] for row in rows if row["nickname"]}
+
+    def set_nickname(self, user_id: str, nickname: str):
+        self.conn.execute("UPDATE users SET nickname = ? WHERE user_id = ?", (nickname, user_id))
+
+    def daily_count(self, day: str) -> int:
+        row = self.conn.execute("SELECT count FROM daily_counter WHERE day = ?", (day,)).fetchone()
+        return row["count"] if row else 0
+
+    def check_in(self, user_id: str, day: str, favor: int, points: int):
+        """签到并返回 (当日名次, 更新后的用户数据)；今天已签到过时返回 None"""
+        conn = self.conn
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            user_data = self.get_user(user_id)
+            if user_data["last_check"] == day:
+                conn.execute("ROLLBACK")
+                return None
+
+            conn.execute("INSERT OR IGNORE INTO daily_counter (day, count) VALUES (?, 0)", (day,))
+            conn.execute("UPDATE daily_counter SET count = count + 1 WHERE day = ?", (day,))
+            rank = self.daily_count(day)
+            conn.execute(
+                "INSERT INTO daily_checkins (day, rank, user_id, check_time) VALUES (?, ?, ?, ?)",
+                (day, rank, user_id, datetime.now().strftime("%H:%M:%S"))
+            )
+
+            yesterday = (datetime.strptime(day, "%Y-%m-%d") - timedelta(days=1)).strftime("%Y-%m-%d")
+            user_data["streak"] = user_data["streak"] + 1 if user_data["last_check"] == yesterday else 1
+            user_data["max_streak"] = max(user_data["max_streak"], user_data["streak"])
+            user_data["total_days"] += 1
+            user_data["好感度"] += favor
+            user_data["积分"] += points
+            user_data["last_check"] = day
+            self.save_user(user_id, user_data)
+            conn.execute("COMMIT")
+            return rank, user_data
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def migrate_json_users(self, users_dir: str) -> int:
+        """把旧版 users/*.json 一次性导入数据库，完成后把目录改名为 users.migrated"""
+        if not os.path.isdir(users_dir):
+            return 0
+        files = [name for name in os.listdir(users_dir) if name.endswith(".json")]
+        today = datetime.now().strftime("%Y-%m-%d")
+        signed_today = []
+        conn = self.conn
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for filename in files:
+                path = os.path.join(users_dir, filename)
+                try:
+                    with open(path, "r", encoding="utf-8") as f:
+                        data = json.load(f)
+                except Exception as e:
+                    print(f"[签到系统]迁移用户数据失败 {filename}: {e}")
+                    continue
+                user_id = filename[:-len(".json")]
+                self.save_user(user_id, data)
+                if data.get("last_check") == today:
+                    signed_today.append((os.path.getmtime(path), user_id))
+
+            # 今天已签到的用户按文件修改时间恢复名次，保证迁移后名次继续递增
+            if signed_today and self.daily_count(today) == 0:
+                for rank, (mtime, user_id) in enumerate(sorted(signed_today), 1):
+                    conn.execute(
+                        "INSERT OR IGNORE INTO daily_checkins (day, rank, user_id, check_time) VALUES (?, ?, ?, ?)",
+                        (today, rank, user_id, datetime.fromtimestamp(mtime).strftime("%H:%M:%S"))
+                    )
+                conn.execute("INSERT OR REPLACE INTO daily_counter (day, count) VALUES (?, ?)", (today, len(signed_today)))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+        os.replace(users_dir, users_dir.rstrip("/\\") + ".migrated")
+        print(f"[签到系统]已将 {len(files)} 个用户数据文件迁移到 {self.db_path}")
+        return len(files)
+
+    def close(self):
+        self.conn.close()
+
+class CheckInRanking:
+    """签到排行索引
+
+    每个排行字段维护一个按 (-分数, user_id) 升序排列的列表，签到时用 bisect 删除旧位置、插入新位置。
+    前 N 名直接切片，"我的名次" 用 bisect 找到第一个同分的位置，两者都是 O(log n) 定位，
+    不需要再扫描全部用户。同分用户名次相同。
+    """
+
+    def __init__(self, fields):
+        self.fields = list(fields)
+        self.keys = {field: [] for field in self.fields}
+        self.scores = {field: {} for field in self.fields}
+
+    def load(self, users):
+        for field in self.fields:
+            self.keys[field].clear()
+            self.scores[field].clear()
+        for user_id, user_data in users:
+            for field in self.fields:
+                score = user_data.get(field, 0)
+                self.scores[field][user_id] = score
+                self.keys[field].append((-score, user_id))
+        for field in self.fields:
+            self.keys[field].sort()
+
+    def update(self, user_id: str, user_data: dict):
+        for field in self.fields:
+            keys = self.keys[field]
+            scores = self.scores[field]
+            score = user_data.get(field, 0)
+            old = scores.get(user_id)
+            if old == score:
+                continue
+            if old is not None:
+                index = bisect.bisect_left(keys, (-old, user_id))
+                del keys[index]
+            bisect.insort(keys, (-score, user_id))
+            scores[user_id] = score
+
+    def top(self, field: str, n: int):
+        """返回前 n 名的 [(名次, user_id, 分数)]"""
+        keys = self.keys[field]
+        result = []
+        for index, (neg_score, user_id) in enumerate(keys[:n]):
+            if result and result[-1][2] == -neg_score:
+                rank = result[-1][0]
+            else:
+                rank = index + 1
+            result.append((rank, user_id, -neg_score))
+        return result
+
+    def rank(self, field: str, user_id: str):
+        """返回 (名次, 分数)，未签到过的用户返回 None"""
+        score = self.scores[field].get(user_id)
+        if score is None:
+            return None
+        # 空字符串排在所有 user_id 之前，得到的位置即分数更高的人数
+        return bisect.bisect_left(self.keys[field], (-score, "")) + 1, score
+
+    def __len__(self):
+        return len(self.scores[self.fields[0]]) if self.fields else 0
+
+class BrowserPool:
+    """常驻的无头浏览器页面池，其他 HTML 转图片的插件也可以直接复用
+
+    浏览器只启动一次，页面用完放回池中复用，同时渲染的页面数由信号量限制；
+    浏览器崩溃或断开后会在下一次渲染时自动重启。
+
+    用法：
+        pool = BrowserPool(max_pages=4)
+        png_bytes = await pool.render(html, viewport={"width": 900, "height": 600}, selector="div.wrapper")
+        await pool.close()
+    """
+
+    def __init__(self, max_pages: int = 4, viewport: dict = None, max_page_uses: int = 200, launch_options: dict = None):
+        self.max_pages = max_pages
+        self.viewport = viewport or {"width": 800, "height": 600}
+        self.max_page_uses = max_page_uses  # 页面复用次数上限，避免长期运行的页面内存膨胀
+        self.launch_options = launch_options or {}
+        self._semaphore = asyncio.Semaphore(max_pages)
+        self._launch_lock = asyncio.Lock()
+        self._idle_pages = []  # [(page, 已使用次数)]
+        self._playwright = None
+        self._browser = None
+
+    def _browser_alive(self) -> bool:
+        return self._browser is not None and self._browser.is_connected()
+
+    async def _ensure_browser(self):
+        if self._browser_alive():
+            return self._browser
+        async with self._launch_lock:
+            if self._browser_alive():
+                return self._browser
+            if self._browser is not None:
+                print("[签到系统]检测到渲染浏览器已断开，正在重新启动")
+            await self._shutdown()
+            from playwright.async_api import async_playwright
+            self._playwright = await async_playwright().start()
+            self._browser = await self._playwright.chromium.launch(**self.launch_options)
+            return self._browser
+
+    async def _acquire_page(self, viewport: dict):
+        browser = await self._ensure_browser()
+        while self._idle_pages:
+            page, uses = self._idle_pages.pop()
+            if not page.is_closed():
+                if page.viewport_size != viewport:
+                    await page.set_viewport_size(viewport)
+                return page, uses
+        return await browser.new_page(viewport=viewport), 0
+
+    async def _release_page(self, page, uses: int):
+        if uses >= self.max_page_uses or not self._browser_alive():
+            await self._close_page(page)
+        else:
+            self._idle_pages.append((page, uses))
+
+    @staticmethod
+    async def _close_page(page):
+        try:
+            if not page.is_closed():
+                await page.close()
+        except Exception:
+            pass
+
+    async def render(self, html: str, viewport: dict = None, selector: str = None, full_page: bool = True, path: str = None) -> bytes:
+        """渲染 HTML 并截图，返回图片字节；指定 path 时同时写入文件"""
+        viewport = viewport or self.viewport
+        async with self._semaphore:
+            for attempt in range(2):
+                page, uses = await self._acquire_page(viewport)
+                try:
+                    await page.set_content(html)
+                    element = await page.query_selector(selector) if selector else None
+                    if element:
+                        data = await element.screenshot(path=path)
+                    else:
+                        data = await page.screenshot(path=path, full_page=full_page)
+                except Exception:
+                    await self._close_page(page)
+                    # 浏览器在渲染中途崩溃时重启后重试一次
+                    if attempt == 0 and not self._browser_alive():
+                        continue
+                    raise
+                await self._release_page(page, uses + 1)
+                return data
+
+    async def _shutdown(self):
+        pages, self._idle_pages = self._idle_pages, []
+        for page, _ in pages:
+            await self._close_page(page)
+        browser, self._browser = self._browser, None
+        playwright, self._playwright = self._playwright, None
+        try:
+            if browser is not None and browser.is_connected():
+                await browser.close()
+        except Exception as e:
+            print(f"[签到系统]关闭浏览器失败: {e}")
+        try:
+            if playwright is not None:
+                await playwright.stop()
+        except Exception as e:
+            print(f"[签到系统]停止 Playwright 失败: {e}")
+
+    async def close(self):
+        """关闭所有页面和浏览器"""
+        async with self._launch_lock:
+            await self._shutdown()
+
 class CheckInManager:
     def __init__(self):
         try:
-            os.makedirs("./data/check_in/users/", exist_ok=True)
+            os.makedirs("./data/check_in/", exist_ok=True)
             self.config = self._load_or_create_config()
+            os.makedirs(self.config["数据存储路径"], exist_ok=True)
+            self.store = CheckInStore(os.path.join(self.config["数据存储路径"], "check_in.db"))
+            self.store.migrate_json_users(os.path.join(self.config["数据存储路径"], "users"))
+            self.ranking = CheckInRanking(field for field, _ in RANK_TYPES.values())
+            self.ranking.load(self.store.all_users())
             self.command_file = os.path.join(self.config["数据存储路径"], "custom_commands.json")
             self.custom_commands = self._load_custom_commands()
             template_path = os.path.join(self.config["数据存储路径"], self.config["模板文件"])
             if not os.path.exists(template_path):
                 self._create_default_template(template_path)
-            self.browser_lock = asyncio.Lock()
-            self.browser = None
-            self.page = None
-            self.playwright = None
+            self.render_pool = BrowserPool(max_pages=self.config.get("渲染并发数", 4))
+            self._template_cache = {}  # 模板路径 -> (mtime_ns, 编译好的模板)
+            # 旧版本会把签到图片写到数据目录，启动时清理一次残留文件
+            self.clean_old_images()
         except Exception as e:
             print(f"[签到系统]初始化失败: {e}")
             print(f"[签到系统]当前工作目录: {os.getcwd()}")
@@ -98,26 +458,11 @@ class CheckInManager:
             print(f"[签到系统]配置文件操作失败: {e}")
             return DEFAULT_CONFIG
 
-    def _get_user_data_path(self, user_id: str) -> str:
-        return os.path.join(self.config["数据存储路径"], "users", f"{user_id}.json")
-
     def _load_user_data(self, user_id: str) -> dict:
-        path = self._get_user_data_path(user_id)
-        if not os.path.exists(path):
-            return {
-                "total_days": 0,
-                "好感度": 0,
-                "积分": 0,
-                "last_check": "",
-            }
-        with open(path, "r", encoding="utf-8") as f:
-            return json.load(f)
+        return self.store.get_user(user_id)
 
     def _save_user_data(self, user_id: str, data: dict):
-        path = self._get_user_data_path(user_id)
-        os.makedirs(os.path.dirname(path), exist_ok=True)
-        with open(path, "w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+        self.store.save_user(user_id, data)
 
     def _load_or_create_total_data(self):
         os.makedirs(self.config["数据存储路径"], exist_ok=True)
@@ -271,6 +616,104 @@ class CheckInManager:
             print(f"[签到系统]创建默认模板失败: {e}")
             raise e
 
+    def _create_default_rank_template(self, template_path):
+        try:
+            os.makedirs(os.path.dirname(template_path), exist_ok=True)
+            default_template = """<!DOCTYPE html>
+<html>
+<head>
+    <meta charset="UTF-8">
+    <style>
+        body {
+            font-family: 'Microsoft YaHei', sans-serif;
+            background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
+            margin: 0;
+            padding: 20px;
+            width: 560px;
+        }
+        .card {
+            background: rgba(255, 255, 255, 0.95);
+            border-radius: 15px;
+            padding: 20px;
+            box-shadow: 0 10px 20px rgba(0,0,0,0.2);
+        }
+        .title {
+            font-size: 24px;
+            font-weight: bold;
+            color: #333;
+            text-align: center;
+            margin-bottom: 15px;
+        }
+        .row {
+            display: flex;
+            align-items: center;
+            padding: 8px 10px;
+            border-radius: 10px;
+            margin: 6px 0;
+            background: #f8f9fa;
+        }
+        .row.me {
+            background: #e8e6ff;
+        }
+        .rank {
+            width: 40px;
+            font-size: 20px;
+            font-weight: bold;
+            color: #764ba2;
+        }
+        .avatar {
+            width: 40px;
+            height: 40px;
+            border-radius: 50%;
+            margin-right: 12px;
+        }
+        .name {
+            flex: 1;
+            font-size: 16px;
+            color: #333;
+            overflow: hidden;
+            white-space: nowrap;
+            text-overflow: ellipsis;
+        }
+        .score {
+            font-size: 18px;
+            font-weight: bold;
+            color: #667eea;
+        }
+        .footer {
+            margin-top: 15px;
+            text-align: center;
+            color: #666;
+            font-size: 14px;
+        }
+    </style>
+</head>
+<body>
+    <div class="card">
+        <div class="title">{{ title }}</div>
+        {% for entry in entries %}
+        <div class="row{% if entry.user_id == user_id %} me{% endif %}">
+            <span class="rank">{{ entry.rank }}</span>
+            <img class="avatar" src="{{ entry.avatar_url }}" alt="Avatar">
+            <span class="name">{{ entry.nickname }}</span>
+            <span class="score">{{ entry.score }}</span>
+        </div>
+        {% endfor %}
+        <div class="footer">
+            {% if my_rank %}你排在第 {{ my_rank }} 名（{{ my_score }}），共 {{ total }} 人{% else %}你还没有签到过哦，共 {{ total }} 人{% endif %}
+        </div>
+    </div>
+</body>
+</html>"""
+
+            with open(template_path, "w", encoding="utf-8") as f:
+                f.write(default_template)
+            print(f"[签到系统]已创建默认排行模板文件: {template_path}")
+
+        except Exception as e:
+            print(f"[签到系统]创建默认排行模板失败: {e}")
+            raise e
+
     def toggle_mode(self):
         mode_list = ["text", "image", "api"]
         current = self.config["签到模式"]
@@ -282,74 +725,73 @@ class CheckInManager:
             json.dump(self.config, f, ensure_ascii=False, indent=2)
         return self.config["签到模式"]
 
-    async def ensure_browser(self):
-        try:
-            from playwright.async_api import async_playwright
-            if self.playwright is None or self.browser is None:
-                if self.playwright:
-                    await self.playwright.stop()
-                self.playwright = await async_playwright().start()
-                self.browser = await self.playwright.chromium.launch()
-                self.page = await self.browser.new_page(viewport={"width": 800, "height": 600})
-            elif self.page is None:
-                self.page = await self.browser.new_page(viewport={"width": 800, "height": 600})
-        except Exception as e:
-            print(f"[签到系统]浏览器启动失败: {e}")
-            raise
-
     async def close_browser(self):
-        try:
-            if self.page:
-                await self.page.close()
-            if self.browser:
-                await self.browser.close()
-            if self.playwright:
-                await self.playwright.stop()
-        except Exception as e:
-            print(f"[签到系统]关闭浏览器失败: {e}")
+        await self.render_pool.close()
 
-    async def generate_image(self, user_id, nickname, rewards, hitokoto_text):
-        try:
-            import jinja2
-            from playwright.async_api import async_playwright
+    def _get_template(self, config_key: str = "模板文件"):
+        """读取并编译模板，模板文件未修改时直接使用缓存"""
+        import jinja2
 
-            async with async_playwright() as p:
-                browser = await p.chromium.launch()
-                page = await browser.new_page(viewport={"width": 800, "height": 600})
-
-                os.makedirs(self.config["数据存储路径"], exist_ok=True)
-                img_path = os.path.abspath(os.path.join(self.config["数据存储路径"], f"sign_{user_id}.png"))
-                if os.path.exists(img_path):
-                    os.remove(img_path)
-                template_path = os.path.abspath(os.path.join(self.config["数据存储路径"], self.config["模板文件"]))
-                if not os.path.exists(template_path):
-                    self._create_default_template(template_path)
-                with open(template_path, "r", encoding="utf-8") as f:
-                    template_content = f.read()
-                template = jinja2.Template(template_content)
-                html_content = template.render(
-                    user_id=user_id,
-                    nickname=nickname,
-                    rank=rewards["rank"],
-                    favor=rewards["favor"],
-                    points=rewards["points"],
-                    total_favor=rewards["total_favor"],
-                    total_points=rewards["total_points"],
-                    total_days=rewards["total_days"],
-                    hitokoto=hitokoto_text,
-                    avatar_url=f"http://q2.qlogo.cn/headimg_dl?dst_uin={user_id}&spec=640"
-                )
-                await page.set_content(html_content)
-                await page.screenshot(path=img_path, full_page=True)
-                await page.close()
-                await browser.close()
-                return img_path
+        template_path = os.path.abspath(os.path.join(self.config["数据存储路径"], self.config[config_key]))
+        if not os.path.exists(template_path):
+            if config_key == "排行模板文件":
+                self._create_default_rank_template(template_path)
+            else:
+                self._create_default_template(template_path)
+        mtime = os.stat(template_path).st_mtime_ns
+        cached = self._template_cache.get(template_path)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        with open(template_path, "r", encoding="utf-8") as f:
+            template = jinja2.Template(f.read())
+        self._template_cache[template_path] = (mtime, template)
+        return template
+
+    async def generate_image(self, user_id, nickname, rewards, hitokoto_text, avatar_url=None) -> bytes:
+        """渲染签到卡片，直接返回 PNG 字节，不落盘"""
+        try:
+            html_content = self._get_template().render(
+                user_id=user_id,
+                nickname=nickname,
+                rank=rewards["rank"],
+                favor=rewards["favor"],
+                points=rewards["points"],
+                total_favor=rewards["total_favor"],
+                total_points=rewards["total_points"],
+                total_days=rewards["total_days"],
+                hitokoto=hitokoto_text,
+                avatar_url=avatar_url or avatar_link(user_id)
+            )
+            return await self.render_pool.render(html_content)
         except Exception as e:
             print(f"[签到系统]生成图片失败: {e}")
             raise Exception(f"生成签到图片失败: {str(e)}")
-        finally:
-            if self.browser_lock.locked():
-                self.browser_lock.release()
+
+    def get_leaderboard(self, rank_type: str, user_id: str) -> dict:
+        field, title = RANK_TYPES[rank_type]
+        top = self.ranking.top(field, self.config.get("排行显示人数", 10))
+        nicknames = self.store.get_nicknames(uid for _, uid, _ in top)
+        mine = self.ranking.rank(field, str(user_id))
+        return {
+            "title": title,
+            "entries": [
+                {"rank": rank, "user_id": uid, "nickname": nicknames.get(uid, uid), "score": score}
+                for rank, uid, score in top
+            ],
+            "user_id": str(user_id),
+            "my_rank": mine[0] if mine else None,
+            "my_score": mine[1] if mine else None,
+            "total": len(self.ranking)
+        }
+
+    async def generate_rank_image(self, leaderboard: dict) -> bytes:
+        """用与签到卡片相同的模板缓存和渲染池生成排行图片"""
+        try:
+            html_content = self._get_template("排行模板文件").render(**leaderboard)
+            return await self.render_pool.render(html_content, viewport={"width": 600, "height": 400})
+        except Exception as e:
+            print(f"[签到系统]生成排行图片失败: {e}")
+            raise Exception(f"生成排行图片失败: {str(e)}")
 
     def clean_old_images(self):
         try:
@@ -372,22 +814,15 @@ class CheckInManager:
     def check_in(self, user_id: str) -> dict:
         user_id = str(user_id)
         today = datetime.now().strftime("%Y-%m-%d")
-        user_data = self._load_user_data(user_id)
-
-        if user_data.get("last_check") == today:
-            return {"success": False, "message": "今天已经签到过了哦~"}
-
-        rank = self._get_daily_rank()
 
         favor = random.randint(self.config["好感度"]["min"], self.config["好感度"]["max"])
         points = random.randint(self.config["积分"]["min"], self.config["积分"]["max"])
 
-        user_data["total_days"] += 1
-        user_data["好感度"] += favor
-        user_data["积分"] += points
-        user_data["last_check"] = today
-
-        self._save_user_data(user_id, user_data)
+        result = self.store.check_in(user_id, today, favor, points)
+        if result is None:
+            return {"success": False, "message": "今天已经签到过了哦~"}
+        rank, user_data = result
+        self.ranking.update(user_id, user_data)
 
         return {
             "success": True,
@@ -396,25 +831,98 @@ class CheckInManager:
                 "favor": favor,
                 "points": points,
                 "total_days": user_data["total_days"],
+                "streak": user_data["streak"],
                 "total_favor": user_data["好感度"],
                 "total_points": user_data["积分"]
             }
         }
 
     def _get_daily_rank(self) -> int:
-        today = datetime.now().strftime("%Y-%m-%d")
-        count = 0
-        users_dir = os.path.join(self.config["数据存储路径"], "users")
-        for filename in os.listdir(users_dir):
-            if filename.endswith('.json'):
-                with open(os.path.join(users_dir, filename), 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    if data.get("last_check") == today:
-                        count += 1
-        return count + 1
+        """下一个签到用户的名次"""
+        return self.store.daily_count(datetime.now().strftime("%Y-%m-%d")) + 1
 
 check_in_manager = CheckInManager()
 
+async def shutdown():
+    """插件卸载或机器人退出时调用，关闭常驻浏览器和 HTTP 客户端"""
+    await check_in_manager.close_browser()
+    if hitokoto_refill_task is not None and not hitokoto_refill_task.done():
+        hitokoto_refill_task.cancel()
+    if http_client is not None:
+        await http_client.aclose()
+
+HITOKOTO_BUFFER = 5  # 预取的一言条数
+AVATAR_TTL = 6 * 3600  # 头像缓存有效期（秒）
+AVATAR_CACHE_SIZE = 256  # 头像缓存个数
+
+http_client = None
+hitokoto_buffer = deque(maxlen=HITOKOTO_BUFFER)
+hitokoto_refill_task = None
+avatar_cache = OrderedDict()  # user_id -> (过期时间, data URI)
+
+def avatar_link(user_id) -> str:
+    return f"http://q2.qlogo.cn/headimg_dl?dst_uin={user_id}&spec=640"
+
+def get_http_client() -> httpx.AsyncClient:
+    """签到过程中共用的 HTTP 客户端，复用连接"""
+    global http_client
+    if http_client is None or http_client.is_closed:
+        http_client = httpx.AsyncClient(follow_redirects=True)
+    return http_client
+
+async def fetch_hitokoto() -> str:
+    hitokoto_response = await get_http_client().get("https://international.v1.hitokoto.cn/", timeout=5.0)
+    hitokoto_data = hitokoto_response.json()
+    return f"{hitokoto_data['hitokoto']} —— {hitokoto_data.get('from_who', '未知')}, {hitokoto_data.get('from', '未知')}"
+
+async def _refill_hitokoto():
+    try:
+        while len(hitokoto_buffer) < HITOKOTO_BUFFER:
+            hitokoto_buffer.append(await fetch_hitokoto())
+    except Exception as e:
+        print(f"[签到系统]预取一言失败: {e}")
+
+async def get_hitokoto() -> str:
+    """优先取预取好的一言，并在后台补充；缓冲为空时才现场请求"""
+    global hitokoto_refill_task
+    try:
+        text = hitokoto_buffer.popleft() if hitokoto_buffer else await fetch_hitokoto()
+    except Exception as e:
+        print(f"[签到系统]获取一言失败: {e}")
+        text = "一言获取失败..."
+    if hitokoto_refill_task is None or hitokoto_refill_task.done():
+        hitokoto_refill_task = asyncio.ensure_future(_refill_hitokoto())
+    return text
+
+async def get_avatar(user_id) -> str:
+    """下载头像并缓存为 data URI，渲染时页面无需再访问网络；失败时返回原始链接"""
+    now = time.time()
+    cached = avatar_cache.get(user_id)
+    if cached is not None and cached[0] > now:
+        avatar_cache.move_to_end(user_id)
+        return cached[1]
+    try:
+        resp = await get_http_client().get(avatar_link(user_id), timeout=5.0)
+        resp.raise_for_status()
+        content_type = resp.headers.get("Content-Type", "image/jpeg").split(";")[0]
+        data_uri = f"data:{content_type};base64,{base64.b64encode(resp.content).decode()}"
+    except Exception as e:
+        print(f"[签到系统]获取头像失败: {e}")
+        return avatar_link(user_id)
+    avatar_cache[user_id] = (now + AVATAR_TTL, data_uri)
+    avatar_cache.move_to_end(user_id)
+    while len(avatar_cache) > AVATAR_CACHE_SIZE:
+        avatar_cache.popitem(last=False)
+    return data_uri
+
+async def get_nickname(actions, group_id, user_id) -> str:
+    try:
+        group_member_info = await actions.get_group_member_info(group_id, user_id)
+        return group_member_info.data.raw.get("card") or group_member_info.data.raw.get("nickname")
+    except Exception:
+        stranger_info = await actions.get_stranger_info(user_id)
+        return stranger_info.data.raw.get("nickname", str(user_id))
+
 async def check_permission(event):
     user_id = str(event.user_id)
     return (user_id in Configurator.cm.get_cfg().others["ROOT_User"] or 
@@ -422,11 +930,13 @@ async def check_permission(event):
             user_id in open("./Manage_User.ini", "r").read().splitlines())
 
 async def on_message(event, actions, Manager, Segments):
-    if not hasattr(event, 'message'):
+    if isinstance(event, Events.HyperListenerStopNotify):
+        print("[签到系统]插件将停止运行")
+        await shutdown()
         return False
 
-    if random.random() < 0.01:
-        check_in_manager.clean_old_images()
+    if not hasattr(event, 'message'):
+        return False
 
     message_content = str(event.message).strip()
     reminder = Configurator.cm.get_cfg().others['reminder']
@@ -528,17 +1038,46 @@ async def on_message(event, actions, Manager, Segments):
             )
         return True
 
+    if message_content == "签到排行" or (message_content.startswith("签到排行 ") and message_content[5:].strip() in RANK_TYPES):
+        rank_type = message_content[5:].strip() or "好感"
+        leaderboard = check_in_manager.get_leaderboard(rank_type, event.user_id)
+        if check_in_manager.config["签到模式"] == "image" and leaderboard["entries"]:
+            try:
+                avatars = await asyncio.gather(*(get_avatar(entry["user_id"]) for entry in leaderboard["entries"]))
+                for entry, avatar_url in zip(leaderboard["entries"], avatars):
+                    entry["avatar_url"] = avatar_url
+                image_bytes = await check_in_manager.generate_rank_image(leaderboard)
+                await actions.send(
+                    group_id=event.group_id,
+                    message=Manager.Message([
+                        Segments.At(event.user_id),
+                        Segments.Image(f"base64://{base64.b64encode(image_bytes).decode()}")
+                    ])
+                )
+                return True
+            except Exception as e:
+                print(f"[签到系统]发送排行图片失败: {str(e)}")
+
+        lines = [leaderboard["title"]]
+        for entry in leaderboard["entries"]:
+            lines.append(f"{entry['rank']}. {entry['nickname']}：{entry['score']}")
+        if leaderboard["my_rank"]:
+            lines.append(f"——————————\n你排在第{leaderboard['my_rank']}名（{leaderboard['my_score']}），共{leaderboard['total']}人")
+        else:
+            lines.append(f"——————————\n你还没有签到过哦，共{leaderboard['total']}人")
+        await actions.send(
+            group_id=event.group_id,
+            message=Manager.Message([
+                Segments.At(event.user_id),
+                Segments.Text("\n" + "\n".join(lines))
+            ])
+        )
+        return True
+
     if message_content not in check_in_manager.get_commands():
         return False
 
     try:
-        try:
-            group_member_info = await actions.get_group_member_info(event.group_id, event.user_id)
-            user_nickname = group_member_info.data.raw.get("card") or group_member_info.data.raw.get("nickname")
-        except Exception:
-            stranger_info = await actions.get_stranger_info(event.user_id)
-            user_nickname = stranger_info.data.raw.get("nickname", str(event.user_id))
-        
         result = check_in_manager.check_in(str(event.user_id))
         
         if not result["success"]:
@@ -551,42 +1090,34 @@ async def on_message(event, actions, Manager, Segments):
             )
             return True
 
-        try:
-            async with httpx.AsyncClient() as client:
-                hitokoto_response = await client.get("https://international.v1.hitokoto.cn/", timeout=5.0)
-                hitokoto_data = hitokoto_response.json()
-                hitokoto_text = f"{hitokoto_data['hitokoto']} —— {hitokoto_data.get('from_who', '未知')}, {hitokoto_data.get('from', '未知')}"
-        except Exception as e:
-            print(f"[签到系统]获取一言失败: {e}")
-            hitokoto_text = "一言获取失败..."
+        image_mode = check_in_manager.config["签到模式"] == "image"
+        # 昵称、一言和头像互不依赖，并发获取
+        user_nickname, hitokoto_text, avatar_url = await asyncio.gather(
+            get_nickname(actions, event.group_id, event.user_id),
+            get_hitokoto(),
+            get_avatar(event.user_id) if image_mode else asyncio.sleep(0, result=None)
+        )
 
         rewards = result["rewards"]
+        check_in_manager.store.set_nickname(str(event.user_id), user_nickname)
         
-        if check_in_manager.config["签到模式"] == "image":
+        if image_mode:
             try:
-                img_path = await check_in_manager.generate_image(
+                image_bytes = await check_in_manager.generate_image(
                     event.user_id, 
                     user_nickname, 
                     rewards, 
-                    hitokoto_text
+                    hitokoto_text,
+                    avatar_url
                 )
                 
-                print(f"[签到系统]准备发送图片: {img_path}")
-                
                 await actions.send(
                     group_id=event.group_id,
                     message=Manager.Message([
                         Segments.At(event.user_id),
-                        Segments.Image(f"file:///{img_path}")
+                        Segments.Image(f"base64://{base64.b64encode(image_bytes).decode()}")
                     ])
                 )
-                
-                try:
-                    if os.path.exists(img_path):
-                        os.remove(img_path)
-                        print(f"[签到系统]已清理临时文件: {img_path}")
-                except Exception as e:
-                    print(f"[签到系统]清理文件失败: {str(e)}")
                     
             except Exception as e:
                 print(f"[签到系统]发送图片失败: {str(e)}")
@@ -600,12 +1131,13 @@ async def on_message(event, actions, Manager, Segments):
 累计好感：{rewards["total_favor"]}
 累计积分：{rewards["total_points"]}
 累计签到：{rewards["total_days"]}天
+连续签到：{rewards["streak"]}天
 ——————————
 {hitokoto_text}'''
             await actions.send(
                 group_id=event.group_id,
                 message=Manager.Message([
-                    Segments.Image(f"http://q2.qlogo.cn/headimg_dl?dst_uin={event.user_id}&spec=640"),
+                    Segments.Image(avatar_link(event.user_id)),
                     Segments.At(event.user_id),
                     Segments.Text(message)
                 ])
@@ -620,6 +1152,7 @@ async def on_message(event, actions, Manager, Segments):
                     f"累计好感：{rewards['total_favor']}\n"
                     f"累计积分：{rewards['total_points']}\n"
                     f"累计签到：{rewards['total_days']}天\n"
+                    f"连续签到：{rewards['streak']}天\n"
                     f"——————————\n"
                     f"{hitokoto_text}"
                 )